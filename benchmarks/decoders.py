@@ -0,0 +1,65 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from scan_engine import default_store
+from wallet_decoder import WalletDecodeError, WalletFormatError, available_backends, get_decoder
+from wallet_store import open_store
+
+# Parse throughput of the wallet decoder backends, in MB of wallet JSON per second.
+# 'json.loads (dicts)' is the plain stdlib parse the loaders used before the decoder layer.
+
+
+def load_sample(store, max_files, seed):
+    wallets = [wallet for wallet, _, _, _ in store.entries()]
+    random.Random(seed).shuffle(wallets)
+    sample = []
+    for wallet in wallets[:max_files]:
+        with store.open_wallet(wallet) as wf:
+            sample.append(wf.read())
+    return sample
+
+
+def throughput(decode, sample, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for data in sample:
+            try:
+                decode(data)
+            except (ValueError, WalletDecodeError, WalletFormatError):
+                pass
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the wallet decoder backends')
+    parser.add_argument('--folder', help='wallet folder to sample, in either layout (default: the data/ corpus)')
+    parser.add_argument('--files', type=int, default=2000, help='number of wallet files to decode')
+    parser.add_argument('--repeats', type=int, default=3, help='best of this many runs is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    sample = load_sample(open_store(args.folder) if args.folder else default_store(), args.files, args.seed)
+    megabytes = sum(len(data) for data in sample) / 1e6
+    print(f"{len(sample)} wallet files, {megabytes:.1f} MB")
+
+    candidates = [('json.loads (dicts)', json.loads)]
+    candidates += [(name, get_decoder(name).decode) for name in available_backends()]
+
+    baseline = None
+    for name, decode in candidates:
+        elapsed = throughput(decode, sample, args.repeats)
+        rate = megabytes / elapsed
+        baseline = baseline or rate
+        print(f"{name:20} {rate:8.1f} MB/s  {1000 * elapsed / megabytes:7.2f} ms/MB  x{rate / baseline:.2f}")
+
+
+if __name__ == '__main__':
+    main()
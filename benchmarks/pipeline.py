@@ -0,0 +1,503 @@
+import argparse
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import synthetic_corpus
+
+# Time of each stage of the pipeline on synthetic corpora (see synthetic_corpus.py) of several sizes,
+# for the logic of the original plot scripts ('legacy') and the scan engine, e.g.
+#
+#   python benchmarks/pipeline.py --sizes 10000 100000 --stages decode aggregate
+#
+# Every (stage, implementation) runs in its own process with CRYPTOABUSE_DATA pointing at the corpus,
+# so its peak RSS is its own. Only the stage itself is timed (best of --repeats): the wallet files are
+# read, decoded or parsed beforehand as far as the stage does not do it. File reads are from the
+# page cache after the first repeat.
+#
+# Each run appends one record per measurement to benchmarks/results.jsonl, tagged with the commit,
+# and measurements more than --tolerance slower than the last ones of another commit are flagged.
+benchmarks_folder = os.path.dirname(os.path.abspath(__file__))
+results_path = os.path.join(benchmarks_folder, 'results.jsonl')
+default_work_folder = os.path.join(tempfile.gettempdir(), 'cryptoabuse-benchmarks')
+
+stage_names = ('convert', 'discover', 'decode', 'threshold', 'aggregate', 'rates', 'render', 'scan')
+
+
+# Legacy logic, as in the plot scripts before the scan engine
+
+def legacy_euro_value(exchange_rates, timestamp):
+    date_str = datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d')
+    return Decimal(exchange_rates.get(date_str, '0'))
+
+
+def legacy_wallet_path(wallets_folder, wallet):
+    return os.path.join(wallets_folder, f"{wallet[:3]}/{wallet}.json")
+
+
+def legacy_over_thresholds(wallet_data):
+    return wallet_data.get('total_received', 0) > 10_000_000_000_000 or wallet_data.get('n_tx', 0) > 100_000
+
+
+# The per-transaction loop of Annual_crime.py
+def legacy_annual_crime(wallet, wallet_data, exchange_rates, annual_stolen_funds):
+    for tx in wallet_data.get('txs', []):
+        timestamp = tx.get('time')
+        if not timestamp or datetime.utcfromtimestamp(timestamp).year < 2012:
+            continue
+        conversion_rate = legacy_euro_value(exchange_rates, timestamp)
+        tx_year = datetime.utcfromtimestamp(timestamp).year
+        for output_tx in tx.get('out', []):
+            if 'addr' in output_tx and output_tx['addr'] == wallet:
+                annual_stolen_funds[tx_year] += Decimal(output_tx.get('value', 0)) / Decimal('100000000') * conversion_rate
+
+
+# Stages: each returns {implementation: function returning the timed callable and the
+# {'wallets', 'transactions', 'bytes'} it processes}. Imports are deferred to the stage
+# process, where CRYPTOABUSE_DATA is set.
+
+def _corpus():
+    from scan_engine import CorpusIndex, default_store
+    store = default_store()
+    wallets = store.listing(sorted(CorpusIndex().wallets('abuse_any')))
+    return store, wallets
+
+
+def _read_files(store, wallets):
+    files = {}
+    for wallet in wallets:
+        with store.open_wallet(wallet) as wf:
+            files[wallet] = wf.read()
+    return files
+
+
+def _legacy_documents(files):
+    from scan_engine import exceeds_thresholds
+    documents = {}
+    for wallet, data in files.items():
+        try:
+            document = json.loads(data)
+        except ValueError:
+            continue
+        if isinstance(document, dict) and not exceeds_thresholds(document.get('total_received', 0), document.get('n_tx', 0)):
+            documents[wallet] = document
+    return documents
+
+
+def _counts(files):
+    documents = _legacy_documents(files)
+    return {'wallets': len(files), 'transactions': sum(len(document.get('txs', [])) for document in documents.values()),
+            'bytes': sum(len(data) for data in files.values())}
+
+
+def convert_stage():
+    from scan_engine import CorpusIndex, abuse_json_path
+
+    def counts():
+        return {'wallets': len(CorpusIndex().wallets('abuse_any')), 'transactions': 0,
+                'bytes': os.path.getsize(abuse_json_path)}
+
+    # AbuseToPerCategory.py before the reverse index, writing to a scratch file
+    def legacy():
+        output = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+        output.close()
+
+        def run():
+            with open(abuse_json_path) as f:
+                abuse_data = json.load(f)
+            wallets_by_abuse_type = defaultdict(set)
+            for source, abuse_types in abuse_data.items():
+                for abuse_type, wallets in abuse_types.items():
+                    if abuse_type.lower() != "all":
+                        wallets_by_abuse_type[abuse_type].update(wallets)
+            with open(output.name, 'w') as f:
+                json.dump({k: list(v) for k, v in wallets_by_abuse_type.items()}, f, indent=4)
+        return run, counts()
+
+    # What a scan loads: the bitmask reverse index, decoded to wallet -> abuse types
+    def engine():
+        return (lambda: CorpusIndex().abuse_types_by_wallet), counts()
+
+    return {'legacy': legacy, 'engine': engine}
+
+
+def discover_stage():
+    from scan_engine import CorpusIndex, default_store, wallets_folder
+
+    def wanted():
+        return sorted(CorpusIndex().wallets('abuse_any'))
+
+    def legacy():
+        wallets = wanted()
+        return (lambda: [wallet for wallet in wallets if os.path.exists(legacy_wallet_path(wallets_folder, wallet))],
+                {'wallets': len(wallets), 'transactions': 0, 'bytes': 0})
+
+    def engine():
+        wallets = wanted()
+        store = default_store()
+        return lambda: store.listing(wallets), {'wallets': len(wallets), 'transactions': 0, 'bytes': 0}
+
+    return {'legacy': legacy, 'engine': engine}
+
+
+def decode_stage():
+    from wallet_decoder import WalletDecodeError, WalletFormatError, available_backends, get_decoder
+
+    def prepared():
+        files = _read_files(*_corpus())
+        return list(files.values()), _counts(files)
+
+    def legacy():
+        files, counts = prepared()
+
+        def run():
+            for data in files:
+                try:
+                    json.loads(data)
+                except ValueError:
+                    pass
+        return run, counts
+
+    def backend(name):
+        def engine():
+            files, counts = prepared()
+            decoder = get_decoder(name)
+
+            def run():
+                for data in files:
+                    try:
+                        decoder.decode(data)
+                    except (WalletDecodeError, WalletFormatError):
+                        pass
+            return run, counts
+        return engine
+
+    return dict({'legacy': legacy}, **{f'engine-{name}': backend(name) for name in available_backends()})
+
+
+def threshold_stage():
+    from scan_engine import exceeds_thresholds, wallets_folder
+    from wallet_decoder import WalletDecodeError, WalletFormatError, get_decoder
+    from wallet_header import read_header
+
+    # Parse every file whole to look at two header fields
+    def legacy():
+        store, wallets = _corpus()
+        counts = _counts(_read_files(store, wallets))
+
+        def run():
+            for wallet in wallets:
+                with open(legacy_wallet_path(wallets_folder, wallet)) as wf:
+                    try:
+                        legacy_over_thresholds(json.load(wf))
+                    except (ValueError, AttributeError):
+                        pass
+        return run, counts
+
+    # Header from the first block of each file (full parse only when it is not found)
+    def engine():
+        store, wallets = _corpus()
+        counts = _counts(_read_files(store, wallets))
+        decoder = get_decoder()
+
+        def run():
+            for wallet in wallets:
+                with store.open_wallet(wallet) as wf:
+                    header, prefix = read_header(wf)
+                    if header is None:
+                        try:
+                            document = decoder.decode(prefix + wf.read())
+                        except (WalletDecodeError, WalletFormatError):
+                            continue
+                        header = {'total_received': document.total_received, 'n_tx': document.n_tx}
+                    exceeds_thresholds(header.get('total_received', 0), header.get('n_tx', 0))
+        return run, counts
+
+    return {'legacy': legacy, 'engine': engine}
+
+
+def aggregate_stage():
+    from aggregators import AnnualCrime, figure_aggregators
+    from exchange_rates import RateTable
+    from scan_engine import CorpusIndex, WalletRecord, WalletScanner, exchange_rates_path, parse_transaction
+    from wallet_decoder import get_decoder
+
+    # Everything after json.load in Annual_crime.py (its date conversions included)
+    def legacy():
+        files = _read_files(*_corpus())
+        documents = _legacy_documents(files)
+        with open(exchange_rates_path) as f:
+            exchange_rates = json.load(f)
+
+        def run():
+            annual_stolen_funds = defaultdict(Decimal)
+            for wallet, document in documents.items():
+                legacy_annual_crime(wallet, document, exchange_rates, annual_stolen_funds)
+        return run, _counts(files)
+
+    # Everything after decoding in the engine: transaction parsing (rate lookup included) and the aggregators
+    def engine_with(aggregator_classes):
+        def engine():
+            files = _read_files(*_corpus())
+            decoder = get_decoder()
+            documents = {wallet: decoder.decode(files[wallet]) for wallet in _legacy_documents(files)}
+            rates = RateTable(exchange_rates_path)
+            abuse_types = CorpusIndex().abuse_types_by_wallet
+
+            def run():
+                aggregators = [cls() for cls in aggregator_classes]
+                scanner = WalletScanner(None, rates, aggregators)
+                missing_rate_days = set()
+                for wallet, document in documents.items():
+                    transactions = [parse_transaction(tx, wallet, rates) for tx in document.txs]
+                    record = WalletRecord(document.n_tx, document.total_received, transactions)
+                    scanner.feed(wallet, record, aggregators, abuse_types.get(wallet, ()), missing_rate_days)
+            return run, _counts(files)
+        return engine
+
+    return {'legacy': legacy, 'engine': engine_with([AnnualCrime]), 'engine-all-figures': engine_with(figure_aggregators)}
+
+
+def rates_stage():
+    import numpy as np
+    from exchange_rates import RateTable
+    from scan_engine import exchange_rates_path
+
+    def timestamps():
+        files = _read_files(*_corpus())
+        times = [tx['time'] for document in _legacy_documents(files).values()
+                 for tx in document.get('txs', []) if tx.get('time')]
+        return times, {'wallets': 0, 'transactions': len(times), 'bytes': 0}
+
+    def legacy():
+        times, counts = timestamps()
+        with open(exchange_rates_path) as f:
+            exchange_rates = json.load(f)
+        return lambda: [legacy_euro_value(exchange_rates, timestamp) for timestamp in times], counts
+
+    def engine():
+        times, counts = timestamps()
+        table = RateTable(exchange_rates_path)
+        return lambda: [table.rate(timestamp) for timestamp in times], counts
+
+    def vectorized():
+        times, counts = timestamps()
+        table = RateTable(exchange_rates_path)
+        array = np.array(times, dtype=np.int64)
+        return lambda: table.rates(array), counts
+
+    return {'legacy': legacy, 'engine': engine, 'engine-vectorized': vectorized}
+
+
+def render_stage(workers):
+    import render
+    from scan_engine import aggregates_path
+
+    def figures():
+        with contextlib.redirect_stdout(sys.stderr):
+            render.figure_aggregates(aggregates_path, workers)
+        output = tempfile.mkdtemp()
+        return [(os.path.join(render.plots_folder, script), os.path.join(output, name))
+                for script, name, _ in render.figures]
+
+    # One script after the other in one process, as when running them by hand
+    def legacy():
+        jobs = figures()
+        return (lambda: [render.render_figure(script, output, ['png'], 100) for script, output in jobs],
+                {'wallets': 0, 'transactions': 0, 'bytes': 0})
+
+    def engine():
+        jobs = figures()
+
+        def run():
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(render.render_figure, [script for script, _ in jobs], [output for _, output in jobs],
+                              [['png']] * len(jobs), [100] * len(jobs)))
+        return run, {'wallets': 0, 'transactions': 0, 'bytes': 0}
+
+    return {'legacy': legacy, 'engine': engine}
+
+
+# Whole scans, from the wallet list to the aggregate: Annual_crime.py against the engine
+def scan_stage(workers):
+    from aggregators import AnnualCrime, figure_aggregators
+    from scan_engine import CorpusIndex, ScanEngine, exchange_rates_path, wallets_folder
+
+    def counts():
+        return _counts(_read_files(*_corpus()))
+
+    def legacy():
+        def run():
+            with open(exchange_rates_path) as f:
+                exchange_rates = json.load(f)
+            annual_stolen_funds = defaultdict(Decimal)
+            for wallet in CorpusIndex().wallets('abuse_any'):
+                wallet_file_path = legacy_wallet_path(wallets_folder, wallet)
+                if not os.path.exists(wallet_file_path):
+                    continue
+                with open(wallet_file_path) as wf:
+                    try:
+                        wallet_data = json.load(wf)
+                    except json.JSONDecodeError:
+                        continue
+                if isinstance(wallet_data, dict) and not legacy_over_thresholds(wallet_data):
+                    legacy_annual_crime(wallet, wallet_data, exchange_rates, annual_stolen_funds)
+        return run, counts()
+
+    def engine_with(aggregator_classes):
+        def engine():
+            def run():
+                engine = ScanEngine()
+                for cls in aggregator_classes:
+                    engine.register(cls())
+                engine.run(workers)
+            return run, counts()
+        return engine
+
+    return {'legacy': legacy, 'engine': engine_with([AnnualCrime]), 'engine-all-figures': engine_with(figure_aggregators)}
+
+
+def stages(workers):
+    return {'convert': convert_stage, 'discover': discover_stage, 'decode': decode_stage,
+            'threshold': threshold_stage, 'aggregate': aggregate_stage, 'rates': rates_stage,
+            'render': lambda: render_stage(workers), 'scan': lambda: scan_stage(workers)}
+
+
+# Implementations of a stage, without setting any of them up
+def implementations(stage, workers):
+    return list(stages(workers)[stage]())
+
+
+def peak_rss_mb():
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+# Runs in the stage process: print the measurement as JSON on the last line
+def measure(stage, implementation, repeats, workers):
+    run, counts = stages(workers)[stage]()[implementation]()
+    best = None
+    with contextlib.redirect_stdout(sys.stderr):
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    print(json.dumps(dict(counts, seconds=best, peak_rss_mb=peak_rss_mb())))
+
+
+def corpus_folder(work_folder, size, seed, workers):
+    folder = os.path.join(work_folder, f'{size}-seed{seed}')
+    manifest = os.path.join(folder, 'synthetic.json')
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            options = json.load(f)['options']
+        if options['wallets'] == size and options['seed'] == seed:
+            return folder
+    print(f"Generating a corpus of {size} abuse wallets in {folder}")
+    with contextlib.redirect_stdout(sys.stderr):
+        synthetic_corpus.generate(folder, synthetic_corpus.CorpusOptions(wallets=size, seed=seed), workers, force=True)
+    return folder
+
+
+def git_revision():
+    def git(*args):
+        result = subprocess.run(['git', *args], cwd=benchmarks_folder, capture_output=True, text=True)
+        return result.stdout.strip() if result.returncode == 0 else ''
+    return git('rev-parse', '--short', 'HEAD') or 'unknown', bool(git('status', '--porcelain', '--untracked-files=no'))
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# The last earlier measurement of the same size, seed, stage and implementation on another commit
+def previous_result(results, record):
+    key = (record['size'], record['seed'], record['stage'], record['implementation'])
+    for previous in reversed(results):
+        if (previous['size'], previous['seed'], previous['stage'], previous['implementation']) == key \
+                and previous['commit'] != record['commit']:
+            return previous
+    return None
+
+
+def rate(count, seconds, scale=1):
+    return f'{count / scale / seconds:12.1f}' if count and seconds else f'{"":12}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark each stage of the pipeline on synthetic corpora')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000], help='abuse wallets per corpus')
+    parser.add_argument('--stages', nargs='+', choices=stage_names, default=list(stage_names))
+    parser.add_argument('--implementations', nargs='+', help='only these (e.g. legacy engine)')
+    parser.add_argument('--repeats', type=int, default=3, help='best of this many runs is reported')
+    parser.add_argument('--workers', type=int, default=4, help='worker processes of the engine scans and rendering')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work', default=default_work_folder, help='where the corpora are generated and kept')
+    parser.add_argument('--results', default=results_path, help='JSON lines file the measurements are appended to')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='slowdown flagged as a regression')
+    parser.add_argument('--measure', nargs=2, metavar=('STAGE', 'IMPLEMENTATION'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        measure(*args.measure, args.repeats, args.workers)
+        return
+
+    commit, dirty = git_revision()
+    results = load_results(args.results)
+    records = []
+    print(f"{'size':>8} {'stage':10} {'implementation':20} {'seconds':>9} {'wallets/s':>12} {'tx/s':>12} "
+          f"{'MB/s':>12} {'peak RSS MB':>12}  vs previous")
+    for size in args.sizes:
+        folder = corpus_folder(args.work, size, args.seed, args.workers)
+        env = dict(os.environ, CRYPTOABUSE_DATA=folder)
+        for stage in args.stages:
+            for implementation in implementations(stage, args.workers):
+                if args.implementations and implementation not in args.implementations:
+                    continue
+                result = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', stage, implementation,
+                                         '--repeats', str(args.repeats), '--workers', str(args.workers)],
+                                        env=env, capture_output=True, text=True)
+                if result.returncode != 0:
+                    print(f"{size:>8} {stage:10} {implementation:20} failed:\n{result.stderr}", file=sys.stderr)
+                    continue
+
+                measured = json.loads(result.stdout.strip().splitlines()[-1])
+                record = dict(measured, commit=commit, dirty=dirty, date=datetime.now(timezone.utc).isoformat(),
+                              python=sys.version.split()[0], size=size, seed=args.seed, stage=stage,
+                              implementation=implementation)
+                previous = previous_result(results, record)
+                comparison = ''
+                if previous:
+                    ratio = record['seconds'] / previous['seconds']
+                    comparison = f"x{ratio:.2f} of {previous['commit']}"
+                    if ratio > 1 + args.tolerance:
+                        comparison += '  REGRESSION'
+
+                seconds = record['seconds']
+                print(f"{size:>8} {stage:10} {implementation:20} {seconds:9.3f} {rate(record['wallets'], seconds)} "
+                      f"{rate(record['transactions'], seconds)} {rate(record['bytes'], seconds, 1e6)} "
+                      f"{record['peak_rss_mb']:12.1f}  {comparison}")
+                records.append(record)
+
+    with open(args.results, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    print(f"\nAppended {len(records)} measurements of {commit}{' (uncommitted changes)' if dirty else ''} to {args.results}")
+
+
+if __name__ == '__main__':
+    main()
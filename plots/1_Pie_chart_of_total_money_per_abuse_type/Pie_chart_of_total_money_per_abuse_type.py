@@ -1,14 +1,19 @@
 import json
 import os
+import sys
 from datetime import datetime
-from decimal import Decimal
 import matplotlib.pyplot as plt
 from collections import defaultdict
 
-# Paths
-abuse_json_path = '../../data/Abuses.json'
-wallets_folder = '../../data/bitcoin'
-exchange_rates_path = '../../data/BitcoinExchangeRates.json'
+# Shared exact money arithmetic in src/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../src'))
+from money import eur
+from exchange_rates import RateTable, day_of, report_missing_rates
+from scan_engine import abuse_json_path, default_store, exchange_rates_path
+from wallet_decoder import WalletDecodeError, WalletFormatError, get_decoder
+
+# Wallet documents, from data/bitcoin/ or its packed shard archives
+wallet_store = default_store()
 
 # Load the abuse data and store unique wallets
 unique_wallets = set()
@@ -18,79 +23,77 @@ with open(abuse_json_path) as f:
         all_wallets = abuse_types.get("All", [])
         unique_wallets.update(all_wallets)
 
-# Load Bitcoin to Euro exchange rates
-with open(exchange_rates_path) as f:
-    exchange_rates = json.load(f)
-
-# Helper function to convert satoshis to BTC
-def satoshis_to_btc(satoshis):
-    return Decimal(satoshis) / Decimal('100000000')  # 1 BTC = 100 million satoshis
+# Load Bitcoin to Euro exchange rates (micro-euros per BTC)
+exchange_rates = RateTable(exchange_rates_path)
+missing_rate_days = set()
 
-# Helper function to get EUR value for a given timestamp
+# Helper function to get the micro-euro rate for a given timestamp
 def get_euro_value(timestamp):
-    date_str = datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d')
-    return Decimal(exchange_rates.get(date_str, '0'))
+    day = day_of(timestamp)
+    if not exchange_rates.has_rate(day):
+        missing_rate_days.add(day)
+    return exchange_rates.rate(timestamp)
 
 # Check if transaction is after 2012
 def is_transaction_valid(timestamp):
     transaction_year = datetime.utcfromtimestamp(timestamp).year
     return transaction_year >= 2012
 
-# Dictionary to store yearly stolen funds
-annual_stolen_funds = defaultdict(Decimal)
+# Dictionary to store yearly stolen funds (EUR fixed-point units, see money.py)
+annual_stolen_funds = defaultdict(int)
 
 # Track progress
 total_wallets = len(unique_wallets)
 processed_wallets = 0
 wallets_included = 0
 
-# Process each unique wallet
-for wallet in unique_wallets:
-    wallet_file_path = os.path.join(wallets_folder, f"{wallet[:3]}/{wallet}.json")
-
-    if os.path.exists(wallet_file_path):
-        processed_wallets += 1
-        with open(wallet_file_path) as wf:
-            try:
-                wallet_data = json.load(wf)
-            except json.JSONDecodeError:
-                print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
+# Process each stored wallet, in the order the store lists them (one listing instead of a probe per wallet)
+for wallet in wallet_store.listing(unique_wallets):
+    processed_wallets += 1
+    with wallet_store.open_wallet(wallet) as wf:
+        try:
+            wallet_data = get_decoder().decode(wf.read())
+        except WalletDecodeError:
+            print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
+            continue
+        except WalletFormatError:
+            print(f"Warning: Unexpected format in JSON for wallet {wallet}. Skipping...")
+            continue
+
+        # Skip wallets with extremely large total_received or n_tx values
+        total_received = wallet_data.total_received
+        n_tx = wallet_data.n_tx
+        if (total_received > 10_000_000_000_000) or (n_tx > 100_000):
+            continue
+
+        wallet_included_in_result = False  # Flag to check if wallet is included
+
+        # Loop through transactions
+        for tx in wallet_data.txs:
+            timestamp = tx.time
+            if not timestamp or not is_transaction_valid(timestamp):
                 continue
 
-            # Skip wallets with extremely large total_received or n_tx values
-            total_received = wallet_data.get('total_received', 0)
-            n_tx = wallet_data.get('n_tx', 0)
-            if (total_received > 10_000_000_000_000) or (n_tx > 100_000):
-                continue
-
-            wallet_included_in_result = False  # Flag to check if wallet is included
-
-            # Loop through transactions
-            for tx in wallet_data.get('txs', []):
-                timestamp = tx.get('time')
-                if not timestamp or not is_transaction_valid(timestamp):
-                    continue
+            conversion_rate = get_euro_value(timestamp)
+            tx_year = datetime.utcfromtimestamp(timestamp).year
 
-                conversion_rate = get_euro_value(timestamp)
-                tx_year = datetime.utcfromtimestamp(timestamp).year
+            # Process received funds (outputs where the wallet is the recipient)
+            for output_tx in tx.out:
+                if output_tx.addr == wallet:
+                    annual_stolen_funds[tx_year] += output_tx.value * conversion_rate
 
-                # Process received funds (outputs where the wallet is the recipient)
-                for output_tx in tx.get('out', []):
-                    if 'addr' in output_tx and output_tx['addr'] == wallet:
-                        value_in_btc = satoshis_to_btc(output_tx.get('value', 0))
-                        value_in_euros = value_in_btc * conversion_rate
-                        annual_stolen_funds[tx_year] += value_in_euros
+        if wallet_included_in_result:
+            wallets_included += 1
 
-            if wallet_included_in_result:
-                wallets_included += 1
+    # Print progress for every 500 wallets processed
+    if processed_wallets % 500 == 0 or processed_wallets == total_wallets:
+        print(f"Processed {processed_wallets}/{total_wallets} wallets...")
 
-        # Print progress for every 500 wallets processed
-        if processed_wallets % 500 == 0 or processed_wallets == total_wallets:
-            print(f"Processed {processed_wallets}/{total_wallets} wallets...")
+report_missing_rates(missing_rate_days)
 
 # Prepare data for visualization
 years = sorted(annual_stolen_funds.keys())
-stolen_funds = [annual_stolen_funds[year] for year in years]
+stolen_funds = [float(eur(annual_stolen_funds[year])) for year in years]
 
 # Plotting the bar chart
 plt.figure(figsize=(10, 6))
@@ -1,36 +1,40 @@
-import json
 import os
+import sys
 from datetime import datetime
-from decimal import Decimal
 import matplotlib.pyplot as plt
 from collections import defaultdict
 
+# Shared exact money arithmetic in src/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../src'))
+from money import btc, eur
+from exchange_rates import RateTable, day_of, report_missing_rates
+from scan_engine import data_folder, default_store, exchange_rates_path
+from wallet_decoder import WalletDecodeError, WalletFormatError, get_decoder
+
 # Paths
-benign_wallets_path = '../../data/benign.txt'
-wallets_folder = '../../data/bitcoin'
-exchange_rates_path = '../../data/BitcoinExchangeRates.json'
-
-# Load Bitcoin to Euro exchange rates
-with open(exchange_rates_path) as f:
-    exchange_rates = json.load(f)
-
-# Initialize variables
-total_received_funds_eur = Decimal('0')
-total_received_funds_btc = Decimal('0')
-total_sent_funds_eur = Decimal('0')
-total_sent_funds_btc = Decimal('0')
-wallets_with_json_files = 0  # Counter for wallets with JSON files
+benign_wallets_path = os.path.join(data_folder, 'benign.txt')
 
+# Wallet documents, from data/bitcoin/ or its packed shard archives
+wallet_store = default_store()
 
-# Convert satoshis to BTC using Decimal for precision
-def satoshis_to_btc(satoshis):
-    return Decimal(satoshis) / Decimal('100000000')
+# Load Bitcoin to Euro exchange rates (micro-euros per BTC)
+exchange_rates = RateTable(exchange_rates_path)
+missing_rate_days = set()
+
+# Initialize variables (satoshis and EUR fixed-point units, see money.py)
+total_received_funds_eur = 0
+total_received_funds_btc = 0
+total_sent_funds_eur = 0
+total_sent_funds_btc = 0
+wallets_with_json_files = 0  # Counter for wallets with JSON files
 
 
-# Get EUR value for a timestamp
+# Get the micro-euro rate for a timestamp
 def get_euro_value(timestamp):
-    date_str = datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d')
-    return Decimal(exchange_rates.get(date_str, '0'))
+    day = day_of(timestamp)
+    if not exchange_rates.has_rate(day):
+        missing_rate_days.add(day)
+    return exchange_rates.rate(timestamp)
 
 
 # Exclude data before 2012
@@ -41,48 +45,42 @@ def is_transaction_valid(timestamp):
 
 # Process each wallet
 def process_wallet_batch(wallet_batch):
+    global total_received_funds_eur, total_received_funds_btc, total_sent_funds_eur, total_sent_funds_btc
     wallets_included = 0
 
+    # List the store once per batch instead of probing each wallet, and read in the store's order
+    listed = {wallet: position for position, wallet in enumerate(wallet_store.listing(wallet_batch))}
     for wallet in wallet_batch:
-        wallet_file_path = os.path.join(wallets_folder, f"{wallet[:3]}/{wallet}.json")
-
-        # Skip if the JSON file doesn't exist
-        if not os.path.exists(wallet_file_path):
+        if wallet not in listed:
             print(f"Warning: JSON file for wallet {wallet} not found. Skipping...")
-            continue
 
+    for wallet in sorted((wallet for wallet in wallet_batch if wallet in listed), key=listed.get):
         # Increment the counter for wallets with JSON files
         global wallets_with_json_files
         wallets_with_json_files += 1
 
-        # Attempt to load the wallet data
+        # Attempt to load the wallet data (the decoder also unwraps list-wrapped documents)
         try:
-            with open(wallet_file_path) as wf:
-                wallet_data = json.load(wf)
-        except (json.JSONDecodeError, OSError):
+            with wallet_store.open_wallet(wallet) as wf:
+                wallet_data = get_decoder().decode(wf.read())
+        except (WalletDecodeError, OSError):
             print(f"Warning: Could not decode JSON for wallet {wallet}. Skipping...")
             continue
-
-        # Handle wallet data wrapped in a list
-        if isinstance(wallet_data, list):
-            wallet_data = wallet_data[0] if wallet_data else {}
-
-        # Check if wallet_data is a dictionary
-        if not isinstance(wallet_data, dict):
+        except WalletFormatError:
             print(f"Warning: Unexpected format in JSON for wallet {wallet}. Skipping...")
             continue
 
         # Skip wallets with extremely large total_received or n_tx values
-        total_received = wallet_data.get('total_received', 0)
-        n_tx = wallet_data.get('n_tx', 0)
+        total_received = wallet_data.total_received
+        n_tx = wallet_data.n_tx
         if total_received > 10_000_000_000_000 or n_tx > 100_000:
             continue
 
         wallet_included_in_result = False  # Flag to track if wallet has valid transactions
 
         # Loop through transactions
-        for tx in wallet_data.get('txs', []):
-            timestamp = tx.get('time')
+        for tx in wallet_data.txs:
+            timestamp = tx.time
             if not timestamp or not is_transaction_valid(timestamp):
                 continue
 
@@ -90,23 +88,21 @@ def process_wallet_batch(wallet_batch):
             tx_date = datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d')
 
             # Process received funds
-            for output_tx in tx.get('out', []):
-                if 'addr' in output_tx and output_tx['addr'] == wallet:
-                    value_in_btc = satoshis_to_btc(output_tx.get('value', 0))
-                    total_received_funds_btc += value_in_btc
-                    value_in_euros = value_in_btc * conversion_rate
-                    total_received_funds_eur += value_in_euros
+            for output_tx in tx.out:
+                if output_tx.addr == wallet:
+                    value = output_tx.value
+                    total_received_funds_btc += value
+                    total_received_funds_eur += value * conversion_rate
 
                     wallet_included_in_result = True
 
             # Process sent funds
-            for input_tx in tx.get('inputs', []):
-                prev_out = input_tx.get('prev_out', {})
-                if 'addr' in prev_out and prev_out['addr'] == wallet:
-                    value_in_btc = satoshis_to_btc(prev_out.get('value', 0))
-                    total_sent_funds_btc += value_in_btc
-                    value_in_euros = value_in_btc * conversion_rate
-                    total_sent_funds_eur += value_in_euros
+            for input_tx in tx.inputs:
+                prev_out = input_tx.prev_out
+                if prev_out is not None and prev_out.addr == wallet:
+                    value = prev_out.value
+                    total_sent_funds_btc += value
+                    total_sent_funds_eur += value * conversion_rate
 
                     wallet_included_in_result = True
 
@@ -139,5 +135,6 @@ print(f"\nTotal wallets with JSON files: {wallets_with_json_files}")
 
 # Output the total funds received and sent
 print(f"\nTotal wallets included in the result: {total_included_wallets}")
-print(f"Total funds received: {total_received_funds_btc} BTC, {total_received_funds_eur:.2f} EUR")
-print(f"Total funds sent: {total_sent_funds_btc} BTC, {total_sent_funds_eur:.2f} EUR")
+report_missing_rates(missing_rate_days)
+print(f"Total funds received: {btc(total_received_funds_btc)} BTC, {eur(total_received_funds_eur):.2f} EUR")
+print(f"Total funds sent: {btc(total_sent_funds_btc)} BTC, {eur(total_sent_funds_eur):.2f} EUR")
@@ -1,93 +1,18 @@
-import json
 import os
-from datetime import datetime
-from decimal import Decimal
+import sys
 import matplotlib.pyplot as plt
-from collections import defaultdict
 
-# Paths
-abuse_json_path = '../../data/Abuses.json'
-wallets_folder = '../../data/bitcoin'
-exchange_rates_path = '../../data/BitcoinExchangeRates.json'
+# Shared scan engine in src/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../src'))
+from aggregators import AnnualCrime
+from scan_engine import load_aggregate
 
-# Load the abuse data and store unique wallets
-unique_wallets = set()
-with open(abuse_json_path) as f:
-    abuse_data = json.load(f)
-    for source, abuse_types in abuse_data.items():
-        for wallets in abuse_types.values():
-            unique_wallets.update(wallets)  # Add wallets to the set to remove duplicates
+# Scan every wallet of Abuses.json (or reuse the aggregates stored by `python src/cryptoabuse.py scan`)
+annual_crime = load_aggregate(AnnualCrime)
 
-# Load Bitcoin to Euro exchange rates
-with open(exchange_rates_path) as f:
-    exchange_rates = json.load(f)
-
-# Convert satoshis to BTC using Decimal for precision
-def satoshis_to_btc(satoshis):
-    return Decimal(satoshis) / Decimal('100000000')  # 1 BTC = 100 million satoshis
-
-# Get EUR value for a timestamp
-def get_euro_value(timestamp):
-    date_str = datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d')  # Use UTC time
-    return Decimal(exchange_rates.get(date_str, '0'))
-
-# Exclude data before 2012
-def is_transaction_valid(timestamp):
-    transaction_year = datetime.utcfromtimestamp(timestamp).year
-    return transaction_year >= 2012
-
-# Track progress
-total_wallets = len(unique_wallets)
-processed_wallets = 0
-wallets_included = 0  # Number of wallets taken into account
-
-# Dictionary to store total received funds per year
-annual_stolen_funds = defaultdict(Decimal)
-
-# Process each unique wallet
-for wallet in unique_wallets:
-    wallet_file_path = os.path.join(wallets_folder, f"{wallet[:3]}/{wallet}.json")
-
-    if os.path.exists(wallet_file_path):
-        processed_wallets += 1
-        with open(wallet_file_path) as wf:
-            try:
-                wallet_data = json.load(wf)
-            except json.JSONDecodeError:
-                print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
-                continue
-
-            # Skip wallets with extremely large total_received or n_tx values to avoid noise
-            total_received = wallet_data.get('total_received', 0)
-            n_tx = wallet_data.get('n_tx', 0)
-            if (total_received > 10_000_000_000_000) or (n_tx > 100_000):
-                continue
-
-            wallet_included_in_result = False
-
-            # Loop through transactions
-            for tx in wallet_data.get('txs', []):
-                timestamp = tx.get('time')
-                if not timestamp or not is_transaction_valid(timestamp):
-                    continue
-
-                conversion_rate = get_euro_value(timestamp)
-                tx_year = datetime.utcfromtimestamp(timestamp).year
-
-                # Process received funds (outputs where the wallet is the recipient)
-                for output_tx in tx.get('out', []):
-                    if 'addr' in output_tx and output_tx['addr'] == wallet:
-                        value_in_btc = satoshis_to_btc(output_tx.get('value', 0))
-                        value_in_euros = value_in_btc * conversion_rate
-                        annual_stolen_funds[tx_year] += value_in_euros
-                        wallet_included_in_result = True
-
-            if wallet_included_in_result:
-                wallets_included += 1  # Increment if wallet has valid transactions
-
-        # Print progress after every 500 wallets processed
-        if processed_wallets % 500 == 0 or processed_wallets == total_wallets:
-            print(f"Processed {processed_wallets}/{total_wallets} wallets...")
+# Total received funds per year
+annual_stolen_funds = annual_crime.annual_stolen_funds
+wallets_included = annual_crime.wallets_included  # Number of wallets taken into account
 
 # Output the number of included wallets
 print(f"\nTotal wallets included in analysis: {wallets_included}")
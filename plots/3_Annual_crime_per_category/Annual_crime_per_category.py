@@ -1,104 +1,19 @@
-import json
 import os
-from datetime import datetime
+import sys
 from decimal import Decimal
 import matplotlib.pyplot as plt
-from collections import defaultdict
-
-# Paths
-wallets_by_abuse_type_path = '../../data/wallets_by_abuse_type.json'
-wallets_folder = '../../data/bitcoin'
-exchange_rates_path = '../../data/BitcoinExchangeRates.json'
-
-# Load Bitcoin to Euro exchange rates
-with open(exchange_rates_path) as f:
-    exchange_rates = json.load(f)
-
-# Convert satoshis to BTC using Decimal for precision
-def satoshis_to_btc(satoshis):
-    return Decimal(satoshis) / Decimal('100000000')  # 1 BTC = 100 million satoshis
-
-# Get EUR value for a timestamp
-def get_euro_value(timestamp):
-    date_str = datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d')  # Use UTC time
-    return Decimal(exchange_rates.get(date_str, '0'))
-
-# Exclude data before 2012
-def is_transaction_valid(timestamp):
-    transaction_year = datetime.utcfromtimestamp(timestamp).year
-    return transaction_year >= 2012
-
-# Initialize a set to store unique wallets
-unique_wallets = set()
-wallets_by_abuse_type = {}
-
-# Load wallets by abuse type and store in the set for uniqueness
-with open(wallets_by_abuse_type_path) as f:
-    wallets_by_abuse_type = json.load(f)
-    for abuse_type, wallets in wallets_by_abuse_type.items():
-        unique_wallets.update(wallets)  # Add wallets to the set to remove duplicates
-
-# Track progress
-total_wallets = len(unique_wallets)  # Total number of unique wallets
-processed_wallets = 0
-wallets_included = 0
-
-# Dictionary to store total received funds per year for each abuse type
-annual_stolen_funds_by_category = defaultdict(lambda: defaultdict(Decimal))
-
-# Process each unique wallet
-for wallet in unique_wallets:
-    wallet_file_path = os.path.join(wallets_folder, f"{wallet[:3]}/{wallet}.json")
-
-    if os.path.exists(wallet_file_path):
-        processed_wallets += 1
-        with open(wallet_file_path) as wf:
-            try:
-                wallet_data = json.load(wf)
-            except json.JSONDecodeError:
-                print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
-                continue
-
-            # Skip wallets with extremely large total_received or n_tx values to avoid noise
-            total_received = wallet_data.get('total_received', 0)
-            n_tx = wallet_data.get('n_tx', 0)
-            if (total_received > 10_000_000_000_000) or (n_tx > 100_000):
-                continue
-
-            wallet_included_in_result = False
-
-            # Determine the abuse types associated with the wallet
-            wallet_abuse_types = [
-                abuse_type for abuse_type, wallets in wallets_by_abuse_type.items() if wallet in wallets
-            ]
-
-            # Loop through transactions
-            for tx in wallet_data.get('txs', []):
-                timestamp = tx.get('time')
-                if not timestamp or not is_transaction_valid(timestamp):
-                    continue
-
-                conversion_rate = get_euro_value(timestamp)
-                tx_year = datetime.utcfromtimestamp(timestamp).year
-
-                # Process received funds (outputs where the wallet is the recipient)
-                for output_tx in tx.get('out', []):
-                    if 'addr' in output_tx and output_tx['addr'] == wallet:
-                        value_in_btc = satoshis_to_btc(output_tx.get('value', 0))
-                        value_in_euros = value_in_btc * conversion_rate
-
-                        # Add the received value to each associated abuse type for the year
-                        for abuse_type in wallet_abuse_types:
-                            annual_stolen_funds_by_category[abuse_type][tx_year] += value_in_euros
-
-                        wallet_included_in_result = True
-
-            if wallet_included_in_result:
-                wallets_included += 1  # Increment if wallet has valid transactions
-
-        # Print progress after every 500 wallets processed
-        if processed_wallets % 500 == 0 or processed_wallets == total_wallets:
-            print(f"Processed {processed_wallets}/{total_wallets} wallets...")
+
+# Shared scan engine in src/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../src'))
+from aggregators import AnnualCrimePerCategory
+from scan_engine import load_aggregate
+
+# Scan the categorized wallets (or reuse the aggregates stored by `python src/cryptoabuse.py scan`)
+annual_crime_per_category = load_aggregate(AnnualCrimePerCategory)
+
+# Total received funds per year for each abuse type
+annual_stolen_funds_by_category = annual_crime_per_category.annual_stolen_funds_by_category
+wallets_included = annual_crime_per_category.wallets_included
 
 # Output the number of included wallets
 print(f"\nTotal wallets included in analysis: {wallets_included}")
@@ -1,87 +1,18 @@
-import json
 import os
-from datetime import datetime
-from decimal import Decimal
+import sys
 import matplotlib.pyplot as plt
 from collections import defaultdict
 
-# Paths
-abuse_json_path = '../../data/Abuses.json'
-wallets_folder = '../../data/bitcoin'
-exchange_rates_path = '../../data/BitcoinExchangeRates.json'
-wallets_by_abuse_type_path = '../../data/wallets_by_abuse_type.json'
-
-# Load the wallets by type and store them in sets to ensure no duplicates
-wallets_by_abuse_type = {}
-with open(wallets_by_abuse_type_path) as f:
-    data = json.load(f)
-    for abuse_type, wallets in data.items():
-        wallets_by_abuse_type[abuse_type] = set(wallets)
-
-# Load Bitcoin to Euro exchange rates
-with open(exchange_rates_path) as f:
-    exchange_rates = json.load(f)
-
-# Convert satoshis to BTC using Decimal for precision
-def satoshis_to_btc(satoshis):
-    return Decimal(satoshis) / Decimal('100000000')  # 1 BTC = 100 million satoshis
-
-# Get EUR value for a timestamp
-def get_euro_value(timestamp):
-    date_str = datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d')  # Use UTC time
-    return Decimal(exchange_rates.get(date_str, '0'))
-
-# Exclude data before 2012
-def is_transaction_valid(timestamp):
-    transaction_year = datetime.utcfromtimestamp(timestamp).year
-    return transaction_year >= 2012
-
-# Aggregate received funds per year by abuse type
-annual_funds_by_type = defaultdict(lambda: defaultdict(Decimal))  # {abuse_type: {year: total_eur}}
-
-# Track progress
-processed_wallets = 0
-total_wallets = sum(len(wallets) for wallets in wallets_by_abuse_type.values())
-
-# Process each abuse type
-for abuse_type, wallets in wallets_by_abuse_type.items():
-    for wallet in wallets:
-        wallet_file_path = os.path.join(wallets_folder, f"{wallet[:3]}/{wallet}.json")
-
-        if os.path.exists(wallet_file_path):
-            with open(wallet_file_path) as wf:
-                try:
-                    wallet_data = json.load(wf)
-                except json.JSONDecodeError:
-                    print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
-                    continue
-
-                # Skip wallets with extremely large total_received or n_tx values to avoid noise
-                total_received = wallet_data.get('total_received', 0)
-                n_tx = wallet_data.get('n_tx', 0)
-                if (total_received > 10_000_000_000_000) or (n_tx > 100_000):
-                    continue
-
-                # Loop through transactions
-                for tx in wallet_data.get('txs', []):
-                    timestamp = tx.get('time')
-                    if not timestamp or not is_transaction_valid(timestamp):
-                        continue
-
-                    conversion_rate = get_euro_value(timestamp)
-                    tx_year = datetime.utcfromtimestamp(timestamp).year
-
-                    # Process received funds (outputs where the wallet is the recipient)
-                    for output_tx in tx.get('out', []):
-                        if 'addr' in output_tx and output_tx['addr'] == wallet:
-                            value_in_btc = satoshis_to_btc(output_tx.get('value', 0))
-                            value_in_euros = value_in_btc * conversion_rate
-                            annual_funds_by_type[abuse_type][tx_year] += value_in_euros
-
-            processed_wallets += 1
-            # Print progress after every 500 wallets processed
-            if processed_wallets % 500 == 0:
-                print(f"Processed {processed_wallets}/{total_wallets} wallets...")
+# Shared scan engine in src/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../src'))
+from aggregators import AnnualCrimePerCategory
+from scan_engine import load_aggregate
+
+# Scan the categorized wallets (or reuse the aggregates stored by `python src/cryptoabuse.py scan`)
+annual_crime_per_category = load_aggregate(AnnualCrimePerCategory)
+
+# Received funds per year by abuse type: {abuse_type: {year: total_eur}}
+annual_funds_by_type = annual_crime_per_category.annual_stolen_funds_by_category
 
 # Calculate YoY changes for each abuse type
 yoy_changes = defaultdict(lambda: defaultdict(float))  # {abuse_type: {year: change}}
@@ -91,8 +22,8 @@ for abuse_type, yearly_funds in annual_funds_by_type.items():
     for i in range(1, len(sorted_years)):
         previous_year = sorted_years[i - 1]
         current_year = sorted_years[i]
-        previous_value = yearly_funds[previous_year]
-        current_value = yearly_funds[current_year]
+        previous_value = float(yearly_funds[previous_year])
+        current_value = float(yearly_funds[current_year])
 
         if previous_value != 0:
             change = ((current_value - previous_value) / previous_value) * 100
@@ -1,83 +1,22 @@
-import json
 import os
-from decimal import Decimal
+import sys
 import matplotlib.pyplot as plt
-from datetime import datetime
 from matplotlib.patches import FancyBboxPatch
 
-# Paths
-wallets_folder = '../../data/bitcoin'
-wallets_by_abuse_type_path = '../../data/wallets_by_abuse_type.json'
+# Shared scan engine in src/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../src'))
+from aggregators import OverallWalletsTransactions
+from scan_engine import load_aggregate
 
-# Load the wallets by type and store them in sets to ensure no duplicates
-all_wallets = set()
-with open(wallets_by_abuse_type_path) as f:
-    data = json.load(f)
-    for abuse_type, wallets in data.items():
-        all_wallets.update(wallets)
+# Scan the categorized wallets (or reuse the aggregates stored by `python src/cryptoabuse.py scan`)
+overall = load_aggregate(OverallWalletsTransactions)
 
-# Initialize counters for transactions
-total_wallets = 0
-total_transactions = 0
-total_incoming_transactions = 0
-total_outgoing_transactions = 0
-total_received_btc = Decimal('0')
-total_sent_btc = Decimal('0')
-
-# Track progress
-processed_wallets = 0
-
-# Process each wallet
-for wallet in all_wallets:
-    wallet_file_path = os.path.join(wallets_folder, f"{wallet[:3]}/{wallet}.json")
-
-    if os.path.exists(wallet_file_path):
-        with open(wallet_file_path) as wf:
-            try:
-                wallet_data = json.load(wf)
-            except json.JSONDecodeError:
-                print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
-                continue
-
-            # Skip wallets with extremely large total_received or n_tx values
-            total_received = wallet_data.get('total_received', 0)
-            n_tx = wallet_data.get('n_tx', 0)
-            if (total_received > 10_000_000_000_000) or (n_tx > 100_000):
-                continue
-
-            # Count this wallet only if it's not skipped
-            total_wallets += 1
-            total_transactions += n_tx
-
-            # Count incoming and outgoing transactions and BTC amounts
-            for tx in wallet_data.get('txs', []):
-                timestamp = tx.get('time')
-                if not timestamp:
-                    continue
-
-                # Convert timestamp to year and exclude transactions before 2012
-                transaction_year = datetime.utcfromtimestamp(timestamp).year
-                if transaction_year < 2012:
-                    continue
-
-                # Process incoming transactions (outputs where this wallet is the recipient)
-                for output in tx.get('out', []):
-                    if 'addr' in output and output['addr'] == wallet:
-                        total_incoming_transactions += 1
-                        total_received_btc += Decimal(output.get('value', 0)) / Decimal('100000000')
-
-                # Process outgoing transactions (inputs where this wallet is the sender)
-                for input_tx in tx.get('inputs', []):
-                    prev_out = input_tx.get('prev_out', {})
-                    if 'addr' in prev_out and prev_out['addr'] == wallet:
-                        total_outgoing_transactions += 1
-                        total_sent_btc += Decimal(prev_out.get('value', 0)) / Decimal('100000000')
-
-        processed_wallets += 1
-
-        # Print progress after every 500 wallets processed
-        if processed_wallets % 500 == 0 or processed_wallets == len(all_wallets):
-            print(f"Processed {processed_wallets}/{len(all_wallets)} wallets...")
+total_wallets = overall.total_wallets
+total_transactions = overall.total_transactions
+total_incoming_transactions = overall.total_incoming_transactions
+total_outgoing_transactions = overall.total_outgoing_transactions
+total_received_btc = overall.total_received_btc
+total_sent_btc = overall.total_sent_btc
 
 # Output the results
 print("\nOverall Statistics:")
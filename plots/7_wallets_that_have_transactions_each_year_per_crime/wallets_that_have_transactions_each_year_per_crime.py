@@ -1,80 +1,25 @@
-import json
 import os
-from collections import defaultdict
-from datetime import datetime
+import sys
 import matplotlib.pyplot as plt
 
-# Paths for input files
-wallets_by_abuse_type_path = '../../data/wallets_by_abuse_type.json'
-wallets_folder = '../../data/bitcoin'
+# Shared scan engine in src/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../src'))
+from aggregators import WalletsPerYearPerCrime
+from scan_engine import CorpusIndex, load_aggregate
 
-# Load the wallets_by_abuse_type data
-with open(wallets_by_abuse_type_path, 'r') as f:
-    wallets_by_abuse_type = json.load(f)
+# Scan the categorized wallets (or reuse the aggregates stored by `python src/cryptoabuse.py scan`)
+wallets_per_year_per_crime = load_aggregate(WalletsPerYearPerCrime)
 
-# Initialize a dictionary to store the count of wallets per year for each abuse type
-wallets_per_year_per_abuse = defaultdict(lambda: defaultdict(int))
-
-# Track total wallets processed and the threshold criteria
-total_wallets = sum(len(set(wallets)) for wallets in wallets_by_abuse_type.values())
-processed_wallets = 0
-included_wallets = 0
-
-# Store all unique wallets in sets per abuse type right after loading
-wallets_by_abuse_type = {abuse_type: set(wallets) for abuse_type, wallets in wallets_by_abuse_type.items()}
-
-# Process each abuse type and its wallets
-for abuse_type, unique_wallets in wallets_by_abuse_type.items():
-    for wallet in unique_wallets:
-        wallet_file_path = os.path.join(wallets_folder, f"{wallet[:3]}/{wallet}.json")
-
-        if os.path.exists(wallet_file_path):
-            with open(wallet_file_path, 'r') as wf:
-                try:
-                    wallet_data = json.load(wf)
-                except json.JSONDecodeError:
-                    print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
-                    continue
-
-                # Check if wallet meets the thresholds
-                total_received = wallet_data.get('total_received', 0)
-                n_tx = wallet_data.get('n_tx', 0)
-                if total_received > 10_000_000_000_000 or n_tx > 100_000:
-                    print(f"Skipping wallet {wallet} due to high total_received ({total_received}) or n_tx ({n_tx}).")
-                    continue
-
-                wallet_included = False
-                years_with_transactions = set()
-
-                # Check transactions and count wallets per year
-                for tx in wallet_data.get('txs', []):
-                    timestamp = tx.get('time')
-                    if timestamp:
-                        transaction_year = datetime.utcfromtimestamp(timestamp).year
-                        if transaction_year >= 2012:  # Only consider transactions from 2012 onwards
-                            years_with_transactions.add(transaction_year)
-                            wallet_included = True
-
-                # Update the count of wallets for each year in the given abuse type
-                for year in years_with_transactions:
-                    wallets_per_year_per_abuse[abuse_type][year] += 1
-
-                if wallet_included:
-                    included_wallets += 1
-
-        # Track progress
-        processed_wallets += 1
-        if processed_wallets % 500 == 0 or processed_wallets == total_wallets:
-            print(f"Processed {processed_wallets}/{total_wallets} wallets. Included wallets: {included_wallets}.")
+# Count of wallets per year for each abuse type
+wallets_per_year_per_abuse = wallets_per_year_per_crime.wallets_per_year_per_abuse
+included_wallets = wallets_per_year_per_crime.included_wallets
 
 # Output final logs
-print(f"Finished processing all wallets.")
-print(f"Total wallets processed: {processed_wallets}")
 print(f"Total wallets included in the result: {included_wallets}")
 
 # Prepare data for visualization
 years = sorted({year for yearly_data in wallets_per_year_per_abuse.values() for year in yearly_data})
-abuse_types = sorted(wallets_by_abuse_type.keys())
+abuse_types = sorted(CorpusIndex().wallets_by_abuse_type.keys())
 
 # Define custom colors for the abuse types
 colors = [
@@ -1,98 +1,23 @@
-import json
 import os
-from collections import defaultdict
-from datetime import datetime
+import sys
 import matplotlib.pyplot as plt
-from decimal import Decimal
 
-# Paths for input files
-wallets_by_abuse_type_path = '../../data/wallets_by_abuse_type.json'
-wallets_folder = '../../data/bitcoin'
+# Shared scan engine in src/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../src'))
+from aggregators import TransactionsPerYear
+from scan_engine import load_aggregate
 
-# Load the wallets_by_abuse_type data
-with open(wallets_by_abuse_type_path, 'r') as f:
-    wallets_by_abuse_type = json.load(f)
+# Scan the categorized wallets (or reuse the aggregates stored by `python src/cryptoabuse.py scan`)
+transactions_per_year = load_aggregate(TransactionsPerYear)
 
-# Store all unique wallets in sets per abuse type right after loading
-wallets_by_abuse_type = {abuse_type: set(wallets) for abuse_type, wallets in wallets_by_abuse_type.items()}
-
-# Initialize dictionaries to store transaction counts per year
-inputs_per_year = defaultdict(int)
-outputs_per_year = defaultdict(int)
-total_per_year = defaultdict(int)
-
-# Thresholds for transactions and total received
-total_received_threshold = 10_000_000_000_000  # 10 trillion satoshis
-n_tx_threshold = 100_000
-
-# Convert satoshis to BTC using Decimal for precision
-def satoshis_to_btc(satoshis):
-    return Decimal(satoshis) / Decimal('100000000')  # 1 BTC = 100 million satoshis
-
-# Track total wallets processed and included
-total_wallets = sum(len(set(wallets)) for wallets in wallets_by_abuse_type.values())
-processed_wallets = 0
-included_wallets = 0
-
-# Process each abuse type and its wallets
-for abuse_type, unique_wallets in wallets_by_abuse_type.items():
-    for wallet in unique_wallets:
-        wallet_file_path = os.path.join(wallets_folder, f"{wallet[:3]}/{wallet}.json")
-
-        if os.path.exists(wallet_file_path):
-            with open(wallet_file_path, 'r') as wf:
-                try:
-                    wallet_data = json.load(wf)
-                except json.JSONDecodeError:
-                    print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
-                    continue
-
-                # Check if wallet meets the thresholds
-                total_received = wallet_data.get('total_received', 0)
-                n_tx = wallet_data.get('n_tx', 0)
-                if total_received > total_received_threshold or n_tx > n_tx_threshold:
-                    print(f"Skipping wallet {wallet} due to high total_received ({total_received}) or n_tx ({n_tx}).")
-                    continue
-
-                included_wallets += 1
-
-                # Loop through transactions and count inputs, outputs, and total transactions per year
-                for tx in wallet_data.get('txs', []):
-                    timestamp = tx.get('time')
-                    if not timestamp:
-                        continue
-                    transaction_year = datetime.utcfromtimestamp(timestamp).year
-                    if transaction_year < 2012:
-                        continue  # Skip transactions before 2012
-
-                    input_count = 0
-                    output_count = 0
-
-                    # Process received funds (outputs where the wallet is the recipient)
-                    for output_tx in tx.get('out', []):
-                        if 'addr' in output_tx and output_tx['addr'] == wallet:
-                            outputs_per_year[transaction_year] += 1  # Count this as an output transaction
-                            output_count += 1
-
-                    # Process sent funds (inputs where the wallet is the sender)
-                    for input_tx in tx.get('inputs', []):
-                        prev_out = input_tx.get('prev_out', {})
-                        if 'addr' in prev_out and prev_out['addr'] == wallet:
-                            inputs_per_year[transaction_year] += 1  # Count this as an input transaction
-                            input_count += 1
-
-                    # Count this transaction for the total if it has inputs or outputs
-                    if input_count > 0 or output_count > 0:
-                        total_per_year[transaction_year] += 1
-
-        # Track progress
-        processed_wallets += 1
-        if processed_wallets % 500 == 0 or processed_wallets == total_wallets:
-            print(f"Processed {processed_wallets}/{total_wallets} wallets. Included wallets: {included_wallets}.")
+# Transaction counts per year, counted once for every abuse type of a wallet;
+# the total counts each transaction once even if it has several inputs/outputs of the wallet
+inputs_per_year = transactions_per_year.inputs_per_year
+outputs_per_year = transactions_per_year.outputs_per_year
+total_per_year = transactions_per_year.total_per_year
+included_wallets = transactions_per_year.included_wallets
 
 # Output final logs
-print(f"Finished processing all wallets.")
-print(f"Total wallets processed: {processed_wallets}")
 print(f"Total wallets included in the result: {included_wallets}")
 
 # Prepare data for visualization
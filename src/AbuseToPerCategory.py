@@ -1,9 +1,7 @@
 import json
 from collections import defaultdict
 
-# Paths for input and output files
-abuse_json_path = '../data/Abuses.json'
-wallets_by_abuse_type_path = '../data/wallets_by_abuse_type.json'
+from abuse_lists import abuse_json_path, abuse_masks, wallet_abuse_types_path, wallets_by_abuse_type_path
 
 # Load the Abuses.json file
 with open(abuse_json_path, 'r') as f:
@@ -25,4 +23,10 @@ wallets_by_abuse_type = {k: list(v) for k, v in wallets_by_abuse_type.items()}
 with open(wallets_by_abuse_type_path, 'w') as f:
     json.dump(wallets_by_abuse_type, f, indent=4)
 
-print(f"Converted {abuse_json_path} to {wallets_by_abuse_type_path}")
+# Write the reverse index: each wallet with a bitmask of its abuse types (bit i = abuse_types[i]),
+# so scans can look up all categories of a wallet at once
+abuse_types = sorted(wallets_by_abuse_type)
+with open(wallet_abuse_types_path, 'w') as f:
+    json.dump({'abuse_types': abuse_types, 'wallets': abuse_masks(abuse_types, wallets_by_abuse_type)}, f)
+
+print(f"Converted {abuse_json_path} to {wallets_by_abuse_type_path} and {wallet_abuse_types_path}")
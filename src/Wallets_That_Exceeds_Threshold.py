@@ -1,10 +1,13 @@
 import json
 import os
 
-# Paths for input files
-wallets_by_abuse_type_path = '../data/wallets_by_abuse_type.json'
-wallets_folder = '../data/bitcoin'
-output_path = '../data/wallets_exceeding_thresholds.json'
+import columnar_store
+from scan_engine import CorpusIndex, data_folder, default_catalog, default_store, wallets_by_abuse_type_path
+from wallet_decoder import WalletDecodeError, WalletFormatError, get_decoder
+from wallet_header import read_header
+
+# Output file, in the data folder next to the lists
+output_path = os.path.join(data_folder, 'wallets_exceeding_thresholds.json')
 
 # Load the wallets_by_abuse_type data
 with open(wallets_by_abuse_type_path, 'r') as f:
@@ -20,27 +23,78 @@ wallets_exceeding_thresholds = {}
 total_received_threshold = 10_000_000_000_000  # 10 trillion satoshis
 n_tx_threshold = 100_000
 
-# Process each abuse type and its wallets
-for abuse_type, unique_wallets in wallets_by_abuse_type.items():
-    wallets_exceeding_thresholds[abuse_type] = []
-
-    for wallet in unique_wallets:
-        wallet_file_path = os.path.join(wallets_folder, f"{wallet[:3]}/{wallet}.json")
-
-        if os.path.exists(wallet_file_path):
-            with open(wallet_file_path, 'r') as wf:
-                try:
-                    wallet_data = json.load(wf)
-                except json.JSONDecodeError:
-                    print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
-                    continue
-
-                # Check if wallet exceeds the thresholds
-                total_received = wallet_data.get('total_received', 0)
-                n_tx = wallet_data.get('n_tx', 0)
-                if total_received > total_received_threshold or n_tx > n_tx_threshold:
+# Wallet documents, from data/bitcoin/ or its packed shard archives
+wallet_store = default_store()
+
+# Use the wallet catalog when available (refreshed first when wallet files changed since): two indexed
+# queries answer the question
+catalog = default_catalog(wallet_store)
+if catalog is not None:
+    for abuse_type in wallets_by_abuse_type:
+        wallets_exceeding_thresholds[abuse_type] = []
+
+    abuse_types_by_wallet = CorpusIndex(by_type_path=wallets_by_abuse_type_path).abuse_types_by_wallet
+    for wallet in catalog.wallets_with_status(columnar_store.STATUS_DECODE_ERROR):
+        if wallet in abuse_types_by_wallet:
+            print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
+
+    for wallet, total_received, n_tx in catalog.exceeding_thresholds(total_received_threshold, n_tx_threshold):
+        for abuse_type in abuse_types_by_wallet.get(wallet, ()):
+            wallets_exceeding_thresholds[abuse_type].append(wallet)
+        if wallet in abuse_types_by_wallet:
+            print(f"Wallet {wallet} exceeds thresholds: total_received={total_received}, n_tx={n_tx}")
+# Otherwise the compiled columnar store, unless the wallet files changed since it was ingested:
+# the header columns answer the question without opening any file
+elif columnar_store.exists() and columnar_store.stale(wallet_store) is None:
+    store = columnar_store.ColumnarStore()
+    exceeding = (store.wallet_status == columnar_store.STATUS_OK) & (
+        (store.wallet_total_received > total_received_threshold) | (store.wallet_n_tx > n_tx_threshold))
+
+    for abuse_type, unique_wallets in wallets_by_abuse_type.items():
+        wallets_exceeding_thresholds[abuse_type] = []
+
+        for wallet in unique_wallets:
+            wallet_id = store.wallet_ids.get(wallet)
+            if wallet_id is None:
+                continue
+
+            if store.wallet_status[wallet_id] == columnar_store.STATUS_DECODE_ERROR:
+                print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
+            elif exceeding[wallet_id]:
+                wallets_exceeding_thresholds[abuse_type].append(wallet)
+                print(f"Wallet {wallet} exceeds thresholds: total_received={store.wallet_total_received[wallet_id]}, n_tx={store.wallet_n_tx[wallet_id]}")
+else:
+    for abuse_type in wallets_by_abuse_type:
+        wallets_exceeding_thresholds[abuse_type] = []
+
+    # Parse each wallet once and fan the result out to all of its abuse types
+    abuse_types_by_wallet = CorpusIndex(by_type_path=wallets_by_abuse_type_path).abuse_types_by_wallet
+    # List the store once instead of probing every wallet, and read in its preferred order
+    for wallet in wallet_store.listing(abuse_types_by_wallet):
+        abuse_types = abuse_types_by_wallet[wallet]
+        with wallet_store.open_wallet(wallet) as wf:
+            # A header within the thresholds settles it. Otherwise the whole file is parsed, also when the
+            # header exceeds them: a truncated or corrupt file is reported as such, not as a whale.
+            header, prefix = read_header(wf)
+            if header is not None and not (header.get('total_received', 0) > total_received_threshold
+                                           or header.get('n_tx', 0) > n_tx_threshold):
+                continue
+            try:
+                document = get_decoder().decode(prefix + wf.read())
+            except WalletDecodeError:
+                print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
+                continue
+            except WalletFormatError:
+                print(f"Warning: Unexpected format in JSON for wallet {wallet}. Skipping...")
+                continue
+            total_received = document.total_received
+            n_tx = document.n_tx
+
+            # Check if wallet exceeds the thresholds
+            if total_received > total_received_threshold or n_tx > n_tx_threshold:
+                for abuse_type in abuse_types:
                     wallets_exceeding_thresholds[abuse_type].append(wallet)
-                    print(f"Wallet {wallet} exceeds thresholds: total_received={total_received}, n_tx={n_tx}")
+                print(f"Wallet {wallet} exceeds thresholds: total_received={total_received}, n_tx={n_tx}")
 
 # Write the wallets exceeding thresholds to a JSON file
 with open(output_path, 'w') as f:
@@ -0,0 +1,28 @@
+import os
+
+# Data folder and abuse lists, kept free of the scan engine's dependencies so that
+# AbuseToPerCategory.py can build the lists without loading the decoders; scan_engine re-exports them.
+# Paths are resolved from this file so the scripts work from any working directory.
+# CRYPTOABUSE_DATA points every loader at another data folder, e.g. a synthetic corpus (synthetic_corpus.py).
+data_folder = os.path.abspath(os.environ.get('CRYPTOABUSE_DATA') or
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+abuse_json_path = os.path.join(data_folder, 'Abuses.json')
+wallets_by_abuse_type_path = os.path.join(data_folder, 'wallets_by_abuse_type.json')
+wallet_abuse_types_path = os.path.join(data_folder, 'wallet_abuse_types.json')
+
+
+# Reverse index: wallet -> bitmask with bit i set when the wallet is listed under abuse_types[i]
+def abuse_masks(abuse_types, wallets_by_abuse_type):
+    masks = {}
+    for bit, abuse_type in enumerate(abuse_types):
+        for wallet in wallets_by_abuse_type[abuse_type]:
+            masks[wallet] = masks.get(wallet, 0) | (1 << bit)
+    return masks
+
+
+# Turn {wallet: bitmask} into {wallet: tuple of abuse types}, sharing one tuple per distinct mask
+def decode_abuse_masks(abuse_types, masks):
+    decoded = {}
+    for mask in set(masks.values()):
+        decoded[mask] = tuple(abuse_type for bit, abuse_type in enumerate(abuse_types) if mask >> bit & 1)
+    return {wallet: decoded[mask] for wallet, mask in masks.items()}
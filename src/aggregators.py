@@ -0,0 +1,519 @@
+from collections import defaultdict
+from functools import partial
+
+from exchange_rates import date_of_day, day_of_date
+from hyperloglog import HyperLogLog
+from money import btc, eur
+from scan_engine import Aggregator
+
+# Distinct wallet counts of WalletsPerYear: 0 keeps the exact sets of addresses, a precision (4 to 18)
+# keeps a HyperLogLog sketch per year instead (see hyperloglog.py); set by `cryptoabuse.py scan`
+distinct_precision = 0
+
+
+# Add the values of `source` into `target` ({key: number} dicts with a default)
+def merge_sums(target, source):
+    for key, value in source.items():
+        target[key] += value
+
+
+# Same as merge_sums for {outer_key: {key: number}} dicts
+def merge_nested_sums(target, source):
+    for outer_key, values in source.items():
+        merge_sums(target[outer_key], values)
+
+
+# Inverse of merge_sums. Keys are kept even at zero: see Contributors for when they go.
+def subtract_sums(target, source):
+    for key, value in source.items():
+        target[key] -= value
+
+
+def subtract_nested_sums(target, source):
+    for outer_key, values in source.items():
+        subtract_sums(target[outer_key], values)
+
+
+# Number of wallets that added to each key of an aggregator's sum dicts, {(attribute, key): wallets}
+# or {(attribute, outer key, key): wallets} for nested dicts. A full scan keeps a key once any wallet
+# added to it, even when the sum is zero (a day without rate, outputs of value 0); subtract() drops it
+# when its last wallet is subtracted, so an incremental update leaves the same keys as a full scan.
+# Aggregators keep it as `_contributors`: it is bookkeeping, not part of the figures' data.
+class Contributors:
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self._touched = set()
+
+    def touch(self, *path):
+        self._touched.add(path)
+
+    def finish_wallet(self):
+        for path in self._touched:
+            self.counts[path] += 1
+        self._touched = set()
+
+    def merge(self, other):
+        merge_sums(self.counts, other.counts)
+
+    def subtract(self, aggregator, other):
+        for path, count in other.counts.items():
+            self.counts[path] -= count
+            if self.counts[path]:
+                continue
+            del self.counts[path]
+            attribute, *keys = path
+            if len(keys) == 1:
+                del getattr(aggregator, attribute)[keys[0]]
+            else:
+                values = getattr(aggregator, attribute)[keys[0]]
+                del values[keys[1]]
+                if not values:
+                    del getattr(aggregator, attribute)[keys[0]]
+
+
+# Amounts below are accumulated as exact integers (satoshis, EUR fixed-point units, see money.py)
+# and exposed as Decimal BTC/EUR through properties at reporting time.
+
+# 0_Overall_crime: total and daily funds received/sent by the "All" wallets
+class OverallCrime(Aggregator):
+    name = 'overall_crime'
+    universe = 'abuse_all'
+
+    def __init__(self):
+        self.total_received_satoshis = 0
+        self.total_received_eur_fixed = 0
+        self.total_sent_satoshis = 0
+        self.total_sent_eur_fixed = 0
+        self.daily_received_satoshis = defaultdict(int)
+        self.daily_sent_satoshis = defaultdict(int)
+        self.wallets_included = 0
+        self._contributors = Contributors()
+        self._wallet_included = False
+
+    def start_wallet(self, ctx):
+        self._wallet_included = False
+
+    def add_transaction(self, ctx, tx):
+        if tx.received:
+            received = sum(tx.received)
+            self.total_received_satoshis += received
+            self.total_received_eur_fixed += received * tx.rate
+            self.daily_received_satoshis[tx.day] += received
+            self._contributors.touch('daily_received_satoshis', tx.day)
+            self._wallet_included = True
+
+        if tx.sent:
+            sent = sum(tx.sent)
+            self.total_sent_satoshis += sent
+            self.total_sent_eur_fixed += sent * tx.rate
+            self.daily_sent_satoshis[tx.day] += sent
+            self._contributors.touch('daily_sent_satoshis', tx.day)
+            self._wallet_included = True
+
+    def finish_wallet(self, ctx):
+        self._contributors.finish_wallet()
+        if self._wallet_included:
+            self.wallets_included += 1
+
+    def merge(self, other):
+        self.total_received_satoshis += other.total_received_satoshis
+        self.total_received_eur_fixed += other.total_received_eur_fixed
+        self.total_sent_satoshis += other.total_sent_satoshis
+        self.total_sent_eur_fixed += other.total_sent_eur_fixed
+        merge_sums(self.daily_received_satoshis, other.daily_received_satoshis)
+        merge_sums(self.daily_sent_satoshis, other.daily_sent_satoshis)
+        self._contributors.merge(other._contributors)
+        self.wallets_included += other.wallets_included
+
+    def subtract(self, other):
+        self.total_received_satoshis -= other.total_received_satoshis
+        self.total_received_eur_fixed -= other.total_received_eur_fixed
+        self.total_sent_satoshis -= other.total_sent_satoshis
+        self.total_sent_eur_fixed -= other.total_sent_eur_fixed
+        subtract_sums(self.daily_received_satoshis, other.daily_received_satoshis)
+        subtract_sums(self.daily_sent_satoshis, other.daily_sent_satoshis)
+        self._contributors.subtract(self, other._contributors)
+        self.wallets_included -= other.wallets_included
+
+    # Rebuild from the abuse_all daily cube (see daily_cube.py) instead of scanning
+    @classmethod
+    def from_cube(cls, cube):
+        aggregator = cls()
+        for direction in ('received', 'sent'):
+            daily = {day_of_date(date): satoshis for date, satoshis in cube.rollup('satoshis', 'day', direction).items()}
+            setattr(aggregator, f'daily_{direction}_satoshis', defaultdict(int, daily))
+            setattr(aggregator, f'total_{direction}_satoshis', sum(daily.values()))
+            setattr(aggregator, f'total_{direction}_eur_fixed', sum(cube.rollup('eur_fixed', 'total', direction).values()))
+        aggregator.wallets_included = cube.rollup('wallets', 'total', 'moved').get('total', 0)
+        return aggregator
+
+    @property
+    def total_received_funds_btc(self):
+        return btc(self.total_received_satoshis)
+
+    @property
+    def total_received_funds_eur(self):
+        return eur(self.total_received_eur_fixed)
+
+    @property
+    def total_sent_funds_btc(self):
+        return btc(self.total_sent_satoshis)
+
+    @property
+    def total_sent_funds_eur(self):
+        return eur(self.total_sent_eur_fixed)
+
+    @property
+    def daily_received_btc(self):
+        return {date_of_day(day): btc(satoshis) for day, satoshis in self.daily_received_satoshis.items()}
+
+    @property
+    def daily_sent_btc(self):
+        return {date_of_day(day): btc(satoshis) for day, satoshis in self.daily_sent_satoshis.items()}
+
+
+# 2_Annual_crime: EUR received per year by every wallet of Abuses.json
+class AnnualCrime(Aggregator):
+    name = 'annual_crime'
+    universe = 'abuse_any'
+
+    def __init__(self):
+        self.annual_received_eur_fixed = defaultdict(int)
+        self.wallets_included = 0
+        self._contributors = Contributors()
+        self._wallet_included = False
+
+    def start_wallet(self, ctx):
+        self._wallet_included = False
+
+    def add_transaction(self, ctx, tx):
+        if tx.received:
+            self.annual_received_eur_fixed[tx.year] += sum(tx.received) * tx.rate
+            self._contributors.touch('annual_received_eur_fixed', tx.year)
+            self._wallet_included = True
+
+    def finish_wallet(self, ctx):
+        self._contributors.finish_wallet()
+        if self._wallet_included:
+            self.wallets_included += 1
+
+    def merge(self, other):
+        merge_sums(self.annual_received_eur_fixed, other.annual_received_eur_fixed)
+        self._contributors.merge(other._contributors)
+        self.wallets_included += other.wallets_included
+
+    def subtract(self, other):
+        subtract_sums(self.annual_received_eur_fixed, other.annual_received_eur_fixed)
+        self._contributors.subtract(self, other._contributors)
+        self.wallets_included -= other.wallets_included
+
+    @classmethod
+    def from_cube(cls, cube):
+        aggregator = cls()
+        aggregator.annual_received_eur_fixed.update(cube.rollup('eur_fixed', 'year', 'received'))
+        aggregator.wallets_included = cube.rollup('wallets', 'total', 'received').get('total', 0)
+        return aggregator
+
+    @property
+    def annual_stolen_funds(self):
+        return {year: eur(fixed) for year, fixed in self.annual_received_eur_fixed.items()}
+
+
+# 3_Annual_crime_per_category and 4_yoy_change_in_each_abuse_type:
+# EUR received per year for each abuse type of the wallet
+class AnnualCrimePerCategory(Aggregator):
+    name = 'annual_crime_per_category'
+
+    def __init__(self):
+        self.annual_received_eur_fixed_by_category = defaultdict(partial(defaultdict, int))
+        self.wallets_included = 0
+        self._contributors = Contributors()
+        self._wallet_included = False
+
+    def start_wallet(self, ctx):
+        self._wallet_included = False
+
+    def add_transaction(self, ctx, tx):
+        if tx.received:
+            value_in_euros = sum(tx.received) * tx.rate
+
+            # Add the received value to each associated abuse type for the year
+            for abuse_type in ctx.abuse_types:
+                self.annual_received_eur_fixed_by_category[abuse_type][tx.year] += value_in_euros
+                self._contributors.touch('annual_received_eur_fixed_by_category', abuse_type, tx.year)
+
+            self._wallet_included = True
+
+    def finish_wallet(self, ctx):
+        self._contributors.finish_wallet()
+        if self._wallet_included:
+            self.wallets_included += 1
+
+    def merge(self, other):
+        merge_nested_sums(self.annual_received_eur_fixed_by_category, other.annual_received_eur_fixed_by_category)
+        self._contributors.merge(other._contributors)
+        self.wallets_included += other.wallets_included
+
+    def subtract(self, other):
+        subtract_nested_sums(self.annual_received_eur_fixed_by_category, other.annual_received_eur_fixed_by_category)
+        self._contributors.subtract(self, other._contributors)
+        self.wallets_included -= other.wallets_included
+
+    @classmethod
+    def from_cube(cls, cube):
+        aggregator = cls()
+        for abuse_type in cube.abuse_types:
+            yearly = cube.rollup('eur_fixed', 'year', 'received', abuse_type)
+            if yearly:
+                aggregator.annual_received_eur_fixed_by_category[abuse_type].update(yearly)
+        aggregator.wallets_included = cube.rollup('wallets', 'total', 'received').get('total', 0)
+        return aggregator
+
+    @property
+    def annual_stolen_funds_by_category(self):
+        return {
+            abuse_type: {year: eur(fixed) for year, fixed in yearly.items()}
+            for abuse_type, yearly in self.annual_received_eur_fixed_by_category.items()
+        }
+
+
+# 5_overall_wallets_transactions: overall wallet/transaction counters and BTC moved
+class OverallWalletsTransactions(Aggregator):
+    name = 'overall_wallets_transactions'
+
+    def __init__(self):
+        self.total_wallets = 0
+        self.total_transactions = 0
+        self.total_incoming_transactions = 0
+        self.total_outgoing_transactions = 0
+        self.total_received_satoshis = 0
+        self.total_sent_satoshis = 0
+
+    def start_wallet(self, ctx):
+        # Count this wallet only if it's not skipped
+        self.total_wallets += 1
+        self.total_transactions += ctx.n_tx
+
+    def add_transaction(self, ctx, tx):
+        self.total_incoming_transactions += len(tx.received)
+        self.total_received_satoshis += sum(tx.received)
+        self.total_outgoing_transactions += len(tx.sent)
+        self.total_sent_satoshis += sum(tx.sent)
+
+    def merge(self, other):
+        self.total_wallets += other.total_wallets
+        self.total_transactions += other.total_transactions
+        self.total_incoming_transactions += other.total_incoming_transactions
+        self.total_outgoing_transactions += other.total_outgoing_transactions
+        self.total_received_satoshis += other.total_received_satoshis
+        self.total_sent_satoshis += other.total_sent_satoshis
+
+    def subtract(self, other):
+        self.total_wallets -= other.total_wallets
+        self.total_transactions -= other.total_transactions
+        self.total_incoming_transactions -= other.total_incoming_transactions
+        self.total_outgoing_transactions -= other.total_outgoing_transactions
+        self.total_received_satoshis -= other.total_received_satoshis
+        self.total_sent_satoshis -= other.total_sent_satoshis
+
+    @property
+    def total_received_btc(self):
+        return btc(self.total_received_satoshis)
+
+    @property
+    def total_sent_btc(self):
+        return btc(self.total_sent_satoshis)
+
+
+# 6_wallets_that_have_transactions_each_year: wallets active in each year, as exact sets of
+# addresses or, with a precision, as HyperLogLog sketches of fixed size (approximate counts)
+class WalletsPerYear(Aggregator):
+    name = 'wallets_per_year'
+
+    def __init__(self, precision=None):
+        self.precision = distinct_precision if precision is None else precision
+        self.wallets_per_year = defaultdict(partial(HyperLogLog, self.precision) if self.precision else set)
+        self._years_with_transactions = set()
+
+    def start_wallet(self, ctx):
+        self._years_with_transactions = set()
+
+    def add_transaction(self, ctx, tx):
+        self._years_with_transactions.add(tx.year)
+
+    def finish_wallet(self, ctx):
+        for year in self._years_with_transactions:
+            self.wallets_per_year[year].add(ctx.wallet)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge wallets_per_year of precision {self.precision} and {other.precision}")
+        for year, wallets in other.wallets_per_year.items():
+            self.wallets_per_year[year] |= wallets
+
+    # Each wallet only ever adds itself, so removing its partial's wallets is exact; sketches
+    # cannot forget a wallet
+    def subtract(self, other):
+        if self.precision:
+            raise ValueError("Approximate distinct counts cannot be updated incrementally")
+        for year, wallets in other.wallets_per_year.items():
+            self.wallets_per_year[year] -= wallets
+            if not self.wallets_per_year[year]:
+                del self.wallets_per_year[year]
+
+    # {year: (wallets, error bound)}: the bound is the half-width of the ~95% confidence interval
+    # of the approximate count, 0 for exact counts
+    def counts(self):
+        return {year: (len(wallets), wallets.error_bound() if self.precision else 0)
+                for year, wallets in sorted(self.wallets_per_year.items())}
+
+
+# 7_wallets_that_have_transactions_each_year_per_crime: active wallets per year for each abuse type
+class WalletsPerYearPerCrime(Aggregator):
+    name = 'wallets_per_year_per_crime'
+
+    def __init__(self):
+        self.wallets_per_year_per_abuse = defaultdict(partial(defaultdict, int))
+        self.included_wallets = 0
+        self._contributors = Contributors()
+        self._years_with_transactions = set()
+
+    def start_wallet(self, ctx):
+        self._years_with_transactions = set()
+
+    def add_transaction(self, ctx, tx):
+        self._years_with_transactions.add(tx.year)
+
+    def finish_wallet(self, ctx):
+        # Update the count of wallets for each year in each abuse type of the wallet
+        for abuse_type in ctx.abuse_types:
+            for year in self._years_with_transactions:
+                self.wallets_per_year_per_abuse[abuse_type][year] += 1
+                self._contributors.touch('wallets_per_year_per_abuse', abuse_type, year)
+        self._contributors.finish_wallet()
+
+        if self._years_with_transactions:
+            self.included_wallets += len(ctx.abuse_types)
+
+    def merge(self, other):
+        merge_nested_sums(self.wallets_per_year_per_abuse, other.wallets_per_year_per_abuse)
+        self._contributors.merge(other._contributors)
+        self.included_wallets += other.included_wallets
+
+    def subtract(self, other):
+        subtract_nested_sums(self.wallets_per_year_per_abuse, other.wallets_per_year_per_abuse)
+        self._contributors.subtract(self, other._contributors)
+        self.included_wallets -= other.included_wallets
+
+    @classmethod
+    def from_cube(cls, cube):
+        aggregator = cls()
+        for abuse_type in cube.abuse_types:
+            yearly = cube.rollup('wallets', 'year', 'any', abuse_type)
+            if yearly:
+                aggregator.wallets_per_year_per_abuse[abuse_type].update(yearly)
+            aggregator.included_wallets += cube.rollup('wallets', 'total', 'any', abuse_type).get('total', 0)
+        return aggregator
+
+
+# 8_number_of_transactions_each_year: inputs/outputs per year, counted once per abuse type
+# of the wallet, plus the number of transactions involving the wallet (Tottal_only_one)
+class TransactionsPerYear(Aggregator):
+    name = 'transactions_per_year'
+
+    def __init__(self):
+        self.inputs_per_year = defaultdict(int)
+        self.outputs_per_year = defaultdict(int)
+        self.total_per_year = defaultdict(int)
+        self.included_wallets = 0
+        self._contributors = Contributors()
+
+    def start_wallet(self, ctx):
+        self.included_wallets += len(ctx.abuse_types)
+
+    def add_transaction(self, ctx, tx):
+        multiplicity = len(ctx.abuse_types)
+        if tx.received:
+            self.outputs_per_year[tx.year] += len(tx.received) * multiplicity
+            self._contributors.touch('outputs_per_year', tx.year)
+        if tx.sent:
+            self.inputs_per_year[tx.year] += len(tx.sent) * multiplicity
+            self._contributors.touch('inputs_per_year', tx.year)
+
+        # Count this transaction for the total if it has inputs or outputs
+        if tx.received or tx.sent:
+            self.total_per_year[tx.year] += multiplicity
+            self._contributors.touch('total_per_year', tx.year)
+
+    def finish_wallet(self, ctx):
+        self._contributors.finish_wallet()
+
+    def merge(self, other):
+        merge_sums(self.inputs_per_year, other.inputs_per_year)
+        merge_sums(self.outputs_per_year, other.outputs_per_year)
+        merge_sums(self.total_per_year, other.total_per_year)
+        self._contributors.merge(other._contributors)
+        self.included_wallets += other.included_wallets
+
+    def subtract(self, other):
+        subtract_sums(self.inputs_per_year, other.inputs_per_year)
+        subtract_sums(self.outputs_per_year, other.outputs_per_year)
+        subtract_sums(self.total_per_year, other.total_per_year)
+        self._contributors.subtract(self, other._contributors)
+        self.included_wallets -= other.included_wallets
+
+
+# 10_Number_of_wallets_and_transactions: active wallets and transactions per year
+class WalletsAndTransactions(Aggregator):
+    name = 'wallets_and_transactions'
+
+    def __init__(self):
+        self.annual_wallet_count = defaultdict(int)
+        self.annual_transaction_count = defaultdict(int)
+        self._contributors = Contributors()
+        self._years_with_transactions = set()
+
+    def start_wallet(self, ctx):
+        self._years_with_transactions = set()
+
+    def add_transaction(self, ctx, tx):
+        self.annual_transaction_count[tx.year] += 1
+        self._contributors.touch('annual_transaction_count', tx.year)
+        self._years_with_transactions.add(tx.year)
+
+    def finish_wallet(self, ctx):
+        # Count wallet only once per year if it has transactions
+        for year in self._years_with_transactions:
+            self.annual_wallet_count[year] += 1
+            self._contributors.touch('annual_wallet_count', year)
+        self._contributors.finish_wallet()
+
+    def merge(self, other):
+        merge_sums(self.annual_wallet_count, other.annual_wallet_count)
+        merge_sums(self.annual_transaction_count, other.annual_transaction_count)
+        self._contributors.merge(other._contributors)
+
+    def subtract(self, other):
+        subtract_sums(self.annual_wallet_count, other.annual_wallet_count)
+        subtract_sums(self.annual_transaction_count, other.annual_transaction_count)
+        self._contributors.subtract(self, other._contributors)
+
+    @classmethod
+    def from_cube(cls, cube):
+        aggregator = cls()
+        aggregator.annual_wallet_count.update(cube.rollup('wallets', 'year', 'any'))
+        aggregator.annual_transaction_count.update(cube.rollup('transactions', 'year', 'any'))
+        return aggregator
+
+
+# One aggregator per README figure, in figure order
+figure_aggregators = [
+    OverallCrime,
+    AnnualCrime,
+    AnnualCrimePerCategory,
+    OverallWalletsTransactions,
+    WalletsPerYear,
+    WalletsPerYearPerCrime,
+    TransactionsPerYear,
+    WalletsAndTransactions,
+]
@@ -0,0 +1,236 @@
+import contextlib
+import hashlib
+import json
+import os
+from array import array
+
+import numpy as np
+
+from scan_engine import WalletRecord, data_folder, make_transaction
+from wallet_decoder import WalletDecodeError, WalletFormatError, get_decoder
+from wallet_store import store_change
+
+# Compiled columnar copy of data/bitcoin/, one .npy file per column
+columnar_folder = os.path.join(data_folder, 'columnar')
+
+# Row directions
+DIRECTION_RECEIVED = 0  # out[] paying the wallet
+DIRECTION_SENT = 1      # inputs[].prev_out spent by the wallet
+DIRECTION_NONE = 2      # transaction without any input/output of the wallet (value 0)
+
+# Wallet parse status
+STATUS_OK = 0
+STATUS_DECODE_ERROR = 1
+STATUS_INVALID = 2  # parsed, but not a wallet document
+
+row_columns = ('wallet_id', 'time', 'direction', 'value', 'tx_index')
+wallet_columns = ('status', 'n_tx', 'total_received', 'total_sent', 'row_offset')
+
+
+# Compile every wallet document of `store` (see wallet_store.py) into `output`
+def ingest(store, output=columnar_folder):
+    # Taken first: a wallet file changed while reading makes the copy stale, not wrongly fresh
+    state = store.state()
+    entries = list(store.entries())
+    wallet_files = sorted((wallet, location) for wallet, location, _, _ in entries)
+
+    rows = {column: array('q') for column in row_columns}
+    wallet_data_columns = {column: array('q') for column in wallet_columns}
+
+    for wallet_id, (wallet, _) in enumerate(wallet_files):
+        wallet_data_columns['row_offset'].append(len(rows['wallet_id']))
+
+        try:
+            with store.open_wallet(wallet) as wf:
+                document = get_decoder().decode(wf.read())
+        except WalletDecodeError:
+            print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
+            _append_wallet(wallet_data_columns, STATUS_DECODE_ERROR)
+            continue
+        except WalletFormatError:
+            print(f"Warning: Unexpected format in JSON for wallet {wallet}. Skipping...")
+            _append_wallet(wallet_data_columns, STATUS_INVALID)
+            continue
+
+        _append_wallet(wallet_data_columns, STATUS_OK, document.n_tx, document.total_received, document.total_sent)
+
+        for tx_index, tx in enumerate(document.txs):
+            timestamp = tx.time
+            if not timestamp:
+                continue
+
+            matched = False
+            for output_tx in tx.out:
+                if output_tx.addr == wallet:
+                    _append_row(rows, wallet_id, timestamp, DIRECTION_RECEIVED, output_tx.value, tx_index)
+                    matched = True
+            for input_tx in tx.inputs:
+                prev_out = input_tx.prev_out
+                if prev_out is not None and prev_out.addr == wallet:
+                    _append_row(rows, wallet_id, timestamp, DIRECTION_SENT, prev_out.value, tx_index)
+                    matched = True
+
+            # Keep the transaction itself visible to the per-year activity counts
+            if not matched:
+                _append_row(rows, wallet_id, timestamp, DIRECTION_NONE, 0, tx_index)
+
+        if (wallet_id + 1) % 500 == 0:
+            print(f"Ingested {wallet_id + 1}/{len(wallet_files)} wallets...")
+
+    wallet_data_columns['row_offset'].append(len(rows['wallet_id']))
+
+    os.makedirs(output, exist_ok=True)
+    np.save(os.path.join(output, 'wallet_id.npy'), np.frombuffer(rows['wallet_id'], dtype=np.int64).astype(np.int32))
+    np.save(os.path.join(output, 'time.npy'), np.frombuffer(rows['time'], dtype=np.int64))
+    np.save(os.path.join(output, 'direction.npy'), np.frombuffer(rows['direction'], dtype=np.int64).astype(np.int8))
+    np.save(os.path.join(output, 'value.npy'), np.frombuffer(rows['value'], dtype=np.int64))
+    np.save(os.path.join(output, 'tx_index.npy'), np.frombuffer(rows['tx_index'], dtype=np.int64).astype(np.int32))
+    np.save(os.path.join(output, 'wallet_status.npy'), np.frombuffer(wallet_data_columns['status'], dtype=np.int64).astype(np.int8))
+    for column in ('n_tx', 'total_received', 'total_sent', 'row_offset'):
+        np.save(os.path.join(output, f'wallet_{column}.npy'), np.frombuffer(wallet_data_columns[column], dtype=np.int64))
+
+    with open(os.path.join(output, 'wallets.json'), 'w') as f:
+        json.dump([wallet for wallet, _ in wallet_files], f)
+    with open(os.path.join(output, 'meta.json'), 'w') as f:
+        json.dump({'source': os.path.abspath(store.folder), 'store': state, 'wallets': len(wallet_files),
+                   'rows': len(rows['wallet_id'])}, f, indent=4)
+
+    print(f"Ingested {len(wallet_files)} wallets ({len(rows['wallet_id'])} rows) into {output}")
+
+
+def _append_wallet(columns, status, n_tx=0, total_received=0, total_sent=0):
+    columns['status'].append(status)
+    columns['n_tx'].append(n_tx)
+    columns['total_received'].append(total_received)
+    columns['total_sent'].append(total_sent)
+
+
+def _append_row(rows, wallet_id, timestamp, direction, value, tx_index):
+    rows['wallet_id'].append(wallet_id)
+    rows['time'].append(timestamp)
+    rows['direction'].append(direction)
+    rows['value'].append(value)
+    rows['tx_index'].append(tx_index)
+
+
+def exists(path=columnar_folder):
+    return os.path.exists(os.path.join(path, 'meta.json'))
+
+
+# Why the store at `path` no longer matches the wallet `store` it should be a copy of, None when it does:
+# the shard mtimes recorded at ingest are compared with the current ones (see wallet_store.store_change)
+def stale(store, path=columnar_folder):
+    with open(os.path.join(path, 'meta.json')) as f:
+        return store_change(json.load(f).get('store'), store)
+
+
+# Read-only view of an ingested store; columns are memory-mapped NumPy arrays.
+# Rows are sorted by wallet id, and the rows of wallet i are
+# wallet_row_offset[i]:wallet_row_offset[i + 1].
+class ColumnarStore:
+    def __init__(self, path=columnar_folder):
+        self.path = path
+        self._open()
+
+    def _open(self):
+        def load(name):
+            return np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+
+        with open(os.path.join(self.path, 'wallets.json')) as f:
+            self.wallets = json.load(f)
+        self.wallet_ids = {wallet: wallet_id for wallet_id, wallet in enumerate(self.wallets)}
+
+        self.wallet_id = load('wallet_id')
+        self.time = load('time')
+        self.direction = load('direction')
+        self.value = load('value')
+        self.tx_index = load('tx_index')
+
+        self.wallet_status = load('wallet_status')
+        self.wallet_n_tx = load('wallet_n_tx')
+        self.wallet_total_received = load('wallet_total_received')
+        self.wallet_total_sent = load('wallet_total_sent')
+        self.wallet_row_offset = load('wallet_row_offset')
+
+    # Only the path travels to worker processes; they map the columns themselves
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._open()
+
+    def rows(self, wallet_id):
+        return slice(int(self.wallet_row_offset[wallet_id]), int(self.wallet_row_offset[wallet_id + 1]))
+
+    # Yield (time, received values, sent values) for each transaction of the wallet
+    def transactions(self, wallet_id):
+        rows = self.rows(wallet_id)
+        times = self.time[rows].tolist()
+        directions = self.direction[rows].tolist()
+        values = self.value[rows].tolist()
+        tx_indices = self.tx_index[rows].tolist()
+
+        i = 0
+        while i < len(tx_indices):
+            tx_index = tx_indices[i]
+            received = []
+            sent = []
+            while i < len(tx_indices) and tx_indices[i] == tx_index:
+                if directions[i] == DIRECTION_RECEIVED:
+                    received.append(values[i])
+                elif directions[i] == DIRECTION_SENT:
+                    sent.append(values[i])
+                i += 1
+            yield times[i - 1], received, sent
+
+
+# Scan engine source reading wallets from a ColumnarStore instead of the JSON files
+class ColumnarWalletSource:
+    def __init__(self, store):
+        self.store = store
+
+    def has_wallet(self, wallet):
+        return wallet in self.store.wallet_ids
+
+    # Stored wallets among `wallets`, in row order
+    def listing(self, wallets):
+        wallet_ids = self.store.wallet_ids
+        return [wallet for _, wallet in sorted((wallet_ids[wallet], wallet) for wallet in set(wallets) if wallet in wallet_ids)]
+
+    # Content hash of the wallet's header fields and rows, for incremental scans
+    def fingerprint(self, wallet):
+        wallet_id = self.store.wallet_ids.get(wallet)
+        if wallet_id is None:
+            return None
+
+        digest = hashlib.blake2b(digest_size=16)
+        for column in (self.store.wallet_status, self.store.wallet_n_tx, self.store.wallet_total_received):
+            digest.update(column[wallet_id:wallet_id + 1].tobytes())
+        rows = self.store.rows(wallet_id)
+        for column in (self.store.time, self.store.direction, self.store.value, self.store.tx_index):
+            digest.update(column[rows].tobytes())
+        return digest.hexdigest()
+
+    # Rows are read from memory-mapped arrays: there are no documents to read ahead
+    def prefetch(self, wallets, stats):
+        return contextlib.nullcontext(self)
+
+    # Every row is stored, so `thresholds` changes nothing here: the scanner applies them
+    def read_wallet(self, wallet, exchange_rates, thresholds=True, stats=None):
+        wallet_id = self.store.wallet_ids[wallet]
+        status = self.store.wallet_status[wallet_id]
+        if status == STATUS_DECODE_ERROR:
+            if stats is not None:
+                stats.counters['decode_errors'] += 1
+            print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
+            return None
+        if status == STATUS_INVALID:
+            if stats is not None:
+                stats.counters['format_errors'] += 1
+            print(f"Warning: Unexpected format in JSON for wallet {wallet}. Skipping...")
+            return None
+
+        transactions = (make_transaction(timestamp, received, sent, exchange_rates)
+                        for timestamp, received, sent in self.store.transactions(wallet_id))
+        return WalletRecord(int(self.store.wallet_n_tx[wallet_id]), int(self.store.wallet_total_received[wallet_id]), transactions)
@@ -0,0 +1,323 @@
+import argparse
+
+import aggregators as aggregators_module
+import columnar_store
+import daily_cube
+import hyperloglog
+import partitioned_scan
+import query as cube_query
+import render as figure_renderer
+import scan_cache
+import scan_engine
+import shard_archive
+import synthetic_corpus
+import transaction_table
+import wallet_catalog
+import wallet_store
+from aggregators import figure_aggregators
+from scan_engine import (ScanEngine, aggregates_path, default_store, packed_wallets_folder, save_aggregates,
+                         wallets_folder)
+from wallet_store import open_store
+
+
+# --distinct-precision: 0 (exact) or a HyperLogLog precision
+def distinct_precision(value):
+    precision = int(value)
+    if precision and not hyperloglog.min_precision <= precision <= hyperloglog.max_precision:
+        raise argparse.ArgumentTypeError(
+            f"expected 0 or a precision from {hyperloglog.min_precision} to {hyperloglog.max_precision}")
+    return precision
+
+
+# Scan the corpus once and feed every figure's aggregator
+def scan(args):
+    scan_engine.default_stream_threshold = args.stream_above
+    scan_engine.default_read_ahead = args.read_ahead
+    scan_engine.default_io_threads = args.io_threads
+    aggregators_module.distinct_precision = args.distinct_precision
+    selected = [cls for cls in figure_aggregators if not args.figures or cls.name in args.figures]
+
+    engine = ScanEngine(report_path=args.report, slow_log=args.slow_log,
+                        checkpoint_path=args.checkpoint if args.checkpoint_interval > 0 or args.resume else None,
+                        checkpoint_interval=args.checkpoint_interval if args.checkpoint_interval > 0 else float('inf'))
+    for aggregator_class in selected:
+        engine.register(aggregator_class())
+    if args.incremental:
+        if args.resume:
+            raise SystemExit("Error: incremental scans keep their progress in their cache; --resume does not apply")
+        if args.distinct_precision:
+            raise SystemExit("Error: approximate distinct counts cannot be updated incrementally")
+        aggregators = scan_cache.update(engine, args.cache, args.workers)
+    else:
+        try:
+            aggregators = engine.run(args.workers, resume=args.resume)
+        except ValueError as e:
+            raise SystemExit(f"Error: {e}")
+
+    save_aggregates(aggregators, args.output, engine.store_state)
+    print(f"\nSaved {len(aggregators)} aggregates to {args.output}")
+
+
+# Split the wallets into partitions of whole shards for map-reduce scans, in a shared folder
+def plan(args):
+    try:
+        partitioned_scan.make_plan(args.folder, args.partitions, args.figures, args.distinct_precision)
+    except ValueError as e:
+        raise SystemExit(f"Error: {e}")
+
+
+# Scan one partition of the plan in the shared folder into its partial aggregates file
+def map_partition(args):
+    scan_engine.default_stream_threshold = args.stream_above
+    try:
+        partitioned_scan.map_partition(args.folder, args.partition, args.workers)
+    except ValueError as e:
+        raise SystemExit(f"Error: {e}")
+
+
+# Merge partition files into the aggregates of the figures
+def reduce_partitions(args):
+    try:
+        partitioned_scan.reduce_partitions(args.files, args.output)
+    except ValueError as e:
+        raise SystemExit(f"Error: {e}")
+
+
+# Plan, map every partition in a local process and reduce, in place of a cluster
+def mapreduce(args):
+    scan_engine.default_stream_threshold = args.stream_above
+    try:
+        partitioned_scan.run_local(args.folder, args.partitions, args.output, args.processes, args.workers,
+                                   args.figures, args.distinct_precision)
+    except ValueError as e:
+        raise SystemExit(f"Error: {e}")
+
+
+# The wallet store of --folder (either layout), the default corpus otherwise
+def store_of(args):
+    return open_store(args.folder) if args.folder else default_store()
+
+
+# Materialize the daily time-series cube of every wallet universe in one scan
+def cube(args):
+    scan_engine.default_stream_threshold = args.stream_above
+    daily_cube.build(args.output, args.workers, threshold_policy=args.threshold_policy)
+
+
+# Answer a metric / group-by / filter query from the materialized cubes
+def query(args):
+    try:
+        columns, rows = cube_query.run_query(args.metric, args.group_by, args.since, args.until, args.abuse_types,
+                                             args.sources, args.directions, args.universe, args.threshold_policy,
+                                             args.cube)
+    except ValueError as e:
+        raise SystemExit(f"Error: {e}")
+    cube_query.write_result(columns, rows, args.format)
+
+
+# Compute the aggregates and render every README figure headlessly into plots/
+def render(args):
+    scan_engine.default_stream_threshold = args.stream_above
+    figure_renderer.render(args.workers, args.formats, args.dpi, args.force)
+
+
+# Write a deterministic synthetic corpus (lists and wallet files) into a data folder
+def generate(args):
+    options = synthetic_corpus.CorpusOptions(
+        wallets=args.wallets, benign=args.benign, seed=args.seed, multi_category=args.multi_category,
+        whales=args.whales, corrupt=args.corrupt, missing=args.missing, tail=args.tail, max_tx=args.max_tx)
+    try:
+        synthetic_corpus.generate(args.output, options, args.workers, args.sharding, force=args.force)
+    except ValueError as e:
+        raise SystemExit(f"Error: {e}")
+
+
+# Compile the per-wallet JSON corpus into the columnar store
+def ingest(args):
+    columnar_store.ingest(store_of(args), args.output)
+
+
+# Build the corpus-wide transaction table, deduplicated by tx hash
+def transactions(args):
+    transaction_table.ingest(store_of(args), args.output)
+
+
+# Pack the wallet JSON tree into one shard archive per shard directory
+def pack(args):
+    shard_archive.pack(args.folder, args.output, force=args.force, sharding=args.sharding)
+
+
+# Copy the wallet store into another layout and/or sharding
+def migrate(args):
+    wallet_store.migrate(args.folder, args.output, args.layout, args.sharding)
+
+
+# Build or incrementally refresh the SQLite wallet catalog
+def catalog(args):
+    wallet_catalog.refresh(store_of(args), args.output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='cryptoabuse', description='Cryptoabuse insights pipeline')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    scan_parser = commands.add_parser('scan', help='compute the aggregates of every figure in a single pass')
+    scan_parser.add_argument('--figures', nargs='*', choices=[cls.name for cls in figure_aggregators],
+                             help='only compute these aggregates (default: all)')
+    scan_parser.add_argument('--output', default=aggregates_path, help='where to store the aggregates')
+    scan_parser.add_argument('--workers', type=int, default=1,
+                             help='number of worker processes; results are identical to a serial run')
+    scan_parser.add_argument('--stream-above', type=int, default=scan_engine.default_stream_threshold, metavar='BYTES',
+                             help='parse wallet files larger than this one transaction at a time (0: all files)')
+    scan_parser.add_argument('--read-ahead', type=int, default=scan_engine.default_read_ahead, metavar='N',
+                             help='wallet files read in the background ahead of the parser, per process (0: off)')
+    scan_parser.add_argument('--io-threads', type=int, default=scan_engine.default_io_threads, metavar='N',
+                             help='threads reading wallet files ahead, per process')
+    scan_parser.add_argument('--incremental', action='store_true',
+                             help='only rescan the wallets that changed since the last incremental scan')
+    scan_parser.add_argument('--cache', default=scan_cache.cache_path, help='per-wallet cache of incremental scans')
+    scan_parser.add_argument('--report', default=scan_engine.scan_report_path,
+                             help='where to write the JSON report of the run (counters, phase timers)')
+    scan_parser.add_argument('--slow-log', type=int, default=0, metavar='N',
+                             help='name the N slowest wallets in the report')
+    scan_parser.add_argument('--checkpoint', default=scan_engine.checkpoint_path,
+                             help='where to save the progress of the scan')
+    scan_parser.add_argument('--checkpoint-interval', type=float, default=300, metavar='SECONDS',
+                             help='seconds between checkpoints (0: none)')
+    scan_parser.add_argument('--resume', action='store_true',
+                             help='continue the interrupted scan from its checkpoint; the results are identical')
+    scan_parser.add_argument('--distinct-precision', type=distinct_precision, default=0, metavar='P',
+                             help='count the wallets active each year with HyperLogLog sketches of this '
+                                  'precision (4 to 18) instead of exact sets of addresses (0)')
+    scan_parser.set_defaults(func=scan)
+
+    plan_parser = commands.add_parser('plan', help='split the wallets into partitions of whole shards for map-reduce scans')
+    plan_parser.add_argument('folder', help='folder shared by the hosts, for the plan and the partition files')
+    plan_parser.add_argument('--partitions', type=int, required=True, help='number of partitions')
+    plan_parser.add_argument('--figures', nargs='*', choices=[cls.name for cls in figure_aggregators],
+                             help='only compute these aggregates (default: all)')
+    plan_parser.add_argument('--distinct-precision', type=distinct_precision, default=0, metavar='P',
+                             help='count the wallets active each year with HyperLogLog sketches of this '
+                                  'precision (4 to 18) instead of exact sets of addresses (0)')
+    plan_parser.set_defaults(func=plan)
+
+    map_parser = commands.add_parser('map', help='scan one partition of a plan into its partial aggregates')
+    map_parser.add_argument('folder', help='shared folder of the plan')
+    map_parser.add_argument('partition', type=int, help='partition id, from 0')
+    map_parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    map_parser.add_argument('--stream-above', type=int, default=scan_engine.default_stream_threshold, metavar='BYTES',
+                            help='parse wallet files larger than this one transaction at a time (0: all files)')
+    map_parser.set_defaults(func=map_partition)
+
+    reduce_parser = commands.add_parser('reduce', help='merge partition files into the aggregates of the figures')
+    reduce_parser.add_argument('files', nargs='+', help='partition files of one plan (any subset)')
+    reduce_parser.add_argument('--output', default=aggregates_path, help='where to store the aggregates')
+    reduce_parser.set_defaults(func=reduce_partitions)
+
+    mapreduce_parser = commands.add_parser('mapreduce', help='plan, map every partition in a local process, and reduce')
+    mapreduce_parser.add_argument('folder', help='folder for the plan and the partition files')
+    mapreduce_parser.add_argument('--partitions', type=int, required=True, help='number of partitions')
+    mapreduce_parser.add_argument('--processes', type=int, default=1, help='partitions mapped at the same time')
+    mapreduce_parser.add_argument('--workers', type=int, default=1, help='worker processes of each partition')
+    mapreduce_parser.add_argument('--figures', nargs='*', choices=[cls.name for cls in figure_aggregators],
+                                  help='only compute these aggregates (default: all)')
+    mapreduce_parser.add_argument('--output', default=aggregates_path, help='where to store the aggregates')
+    mapreduce_parser.add_argument('--stream-above', type=int, default=scan_engine.default_stream_threshold,
+                                  metavar='BYTES',
+                                  help='parse wallet files larger than this one transaction at a time (0: all files)')
+    mapreduce_parser.add_argument('--distinct-precision', type=distinct_precision, default=0, metavar='P',
+                                  help='count the wallets active each year with HyperLogLog sketches of this '
+                                       'precision (4 to 18) instead of exact sets of addresses (0)')
+    mapreduce_parser.set_defaults(func=mapreduce)
+
+    render_parser = commands.add_parser('render', help='scan if needed and render every figure into plots/ without a display')
+    render_parser.add_argument('--workers', type=int, default=1, help='number of worker processes (scan and rendering)')
+    render_parser.add_argument('--formats', nargs='+', choices=['png', 'svg', 'pdf'], default=['png'])
+    render_parser.add_argument('--dpi', type=int, default=100)
+    render_parser.add_argument('--force', action='store_true', help='render figures that are up to date')
+    render_parser.add_argument('--stream-above', type=int, default=scan_engine.default_stream_threshold, metavar='BYTES',
+                               help='parse wallet files larger than this one transaction at a time (0: all files)')
+    render_parser.set_defaults(func=render)
+
+    cube_parser = commands.add_parser('cube', help='materialize the daily cube (day x abuse type x direction x metric)')
+    cube_parser.add_argument('--output', help='where to write the cubes (default: the folder of the threshold policy)')
+    cube_parser.add_argument('--threshold-policy', choices=sorted(daily_cube.threshold_policies), default='exclude',
+                             help='exclude the wallets over the thresholds like the figures, or include them')
+    cube_parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    cube_parser.add_argument('--stream-above', type=int, default=scan_engine.default_stream_threshold, metavar='BYTES',
+                             help='parse wallet files larger than this one transaction at a time (0: all files)')
+    cube_parser.set_defaults(func=cube)
+
+    query_parser = commands.add_parser('query', help='answer a query from the materialized cubes (see `cube`)')
+    query_parser.add_argument('metric', choices=list(cube_query.metrics))
+    query_parser.add_argument('--group-by', nargs='+', default=[], choices=cube_query.dimensions)
+    query_parser.add_argument('--since', help='first date: YYYY, YYYY-MM or YYYY-MM-DD')
+    query_parser.add_argument('--until', help='last date (inclusive): YYYY, YYYY-MM or YYYY-MM-DD')
+    query_parser.add_argument('--abuse-types', nargs='+', help='only these abuse types')
+    query_parser.add_argument('--sources', nargs='+', help='only the wallets listed by these sources of Abuses.json')
+    query_parser.add_argument('--directions', nargs='+', choices=daily_cube.directions,
+                              help='default: received (received and sent when grouped by direction)')
+    query_parser.add_argument('--universe', choices=[cls.universe for cls in daily_cube.cube_aggregators],
+                              default='categorized', help='wallets to query, as in the figures')
+    query_parser.add_argument('--threshold-policy', choices=sorted(daily_cube.threshold_policies), default='exclude',
+                              help='query the cubes without (exclude) or with (include) the wallets over the thresholds')
+    query_parser.add_argument('--cube', help='folder of the cubes (default: the folder of the threshold policy)')
+    query_parser.add_argument('--format', choices=cube_query.formats, default='table')
+    query_parser.set_defaults(func=query)
+
+    ingest_parser = commands.add_parser('ingest', help='compile data/bitcoin/ into the columnar transaction store')
+    ingest_parser.add_argument('--folder', help='wallet folder to compile, in either layout (default: the data/ corpus)')
+    ingest_parser.add_argument('--output', default=columnar_store.columnar_folder, help='where to write the store')
+    ingest_parser.set_defaults(func=ingest)
+
+    transactions_parser = commands.add_parser('transactions',
+                                              help='build the transaction table of the corpus, one row per tx hash')
+    transactions_parser.add_argument('--folder', help='wallet folder to read, in either layout (default: the data/ corpus)')
+    transactions_parser.add_argument('--output', default=transaction_table.transactions_folder,
+                                     help='where to write the table')
+    transactions_parser.set_defaults(func=transactions)
+
+    catalog_parser = commands.add_parser('catalog', help='build or refresh the SQLite catalog of the wallet files')
+    catalog_parser.add_argument('--folder', help='wallet folder to catalog, in either layout (default: the data/ corpus)')
+    catalog_parser.add_argument('--output', default=wallet_catalog.catalog_path, help='catalog database')
+    catalog_parser.set_defaults(func=catalog)
+
+    pack_parser = commands.add_parser('pack', help='pack data/bitcoin/ into one shard archive per prefix directory')
+    pack_parser.add_argument('--folder', default=wallets_folder, help='wallet JSON tree to pack')
+    pack_parser.add_argument('--output', default=packed_wallets_folder, help='folder of the shard archives')
+    pack_parser.add_argument('--force', action='store_true', help='rewrite shards that are up to date')
+    pack_parser.add_argument('--sharding', help='prefix:N or hash:N (default: the sharding of --folder)')
+    pack_parser.set_defaults(func=pack)
+
+    migrate_parser = commands.add_parser('migrate', help='copy the wallet store into another layout and sharding')
+    migrate_parser.add_argument('output', help='folder of the new store')
+    migrate_parser.add_argument('--folder', default=wallets_folder, help='store to copy, in either layout')
+    migrate_parser.add_argument('--layout', choices=['directory', 'packed'], default='directory')
+    migrate_parser.add_argument('--sharding', default='hash:4096',
+                                help='prefix:N (the fetched layout is prefix:3) or hash:N buckets')
+    migrate_parser.set_defaults(func=migrate)
+
+    generate_parser = commands.add_parser('generate', help='write a synthetic corpus for tests and benchmarks')
+    generate_parser.add_argument('output', help='data folder to write (use it with CRYPTOABUSE_DATA=<output>)')
+    generate_parser.add_argument('--wallets', type=int, default=10_000, help='number of listed abuse wallets')
+    generate_parser.add_argument('--benign', type=int, help='number of benign wallets (default: --wallets)')
+    generate_parser.add_argument('--seed', type=int, default=0, help='the same seed writes the same corpus')
+    generate_parser.add_argument('--multi-category', type=float, default=0.1,
+                                 help='share of abuse wallets listed under several abuse types')
+    generate_parser.add_argument('--whales', type=float, default=0.001, help='share of wallets over the thresholds')
+    generate_parser.add_argument('--corrupt', type=float, default=0.002, help='share of unreadable wallet files')
+    generate_parser.add_argument('--missing', type=float, default=0.01, help='share of wallets without a file')
+    generate_parser.add_argument('--tail', type=float, default=1.2,
+                                 help='Pareto shape of the transactions per wallet (lower: heavier tail)')
+    generate_parser.add_argument('--max-tx', type=int, default=5_000, help='most transactions in one wallet file')
+    generate_parser.add_argument('--sharding', default='prefix:3', help='prefix:N (as the fetched tree) or hash:N')
+    generate_parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    generate_parser.add_argument('--force', action='store_true', help='overwrite a corpus in --output')
+    generate_parser.set_defaults(func=generate)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
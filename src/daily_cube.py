@@ -0,0 +1,299 @@
+import json
+import os
+from collections import defaultdict
+from functools import lru_cache
+
+import numpy as np
+
+from aggregators import merge_sums, subtract_sums
+from exchange_rates import RateTable, date_of_day
+from scan_engine import Aggregator, ScanEngine, data_folder, exchange_rates_path, first_day
+from wallet_store import store_change
+
+# Dense daily time-series cube of a wallet universe, materialized once by `cryptoabuse.py cube`
+# (data/cube/<universe>/) so that any daily, weekly, monthly or yearly rollup is a NumPy reduction:
+#
+#   counts.npy          - int64 [day, slot, direction, metric] with metrics (satoshis, transactions)
+#   rates.npy           - micro-euros per BTC of each day (0 when missing, as in the scans)
+#   active_<unit>.npy   - int64 [period, slot, direction]: wallets with at least one transaction
+#                         in the period; distinct counts do not add up, so each unit is stored
+#   meta.json           - universe, threshold policy, first day, slots and the state of the wallet store
+#
+# A slot is an (abuse type, source of Abuses.json) pair, either of which may be All. Slot (All, All)
+# counts every wallet once; (type, All) the wallets of an abuse type, as the figures count them
+# (a wallet listed under several abuse types counts in each); (All, source) the wallets of a source;
+# (type, source) the wallets that source lists under that type. Directions of a transaction for a wallet:
+#   received - it pays the wallet          sent - it spends from the wallet
+#   moved    - either of the two           any  - every transaction of the wallet document
+# EUR amounts are not stored: all transactions of a day share its rate, so the EUR value of a day
+# is exactly its satoshis times its rate (see money.py).
+#
+# Cubes skip the wallets over the thresholds like the figures ('exclude' policy, data/cube/);
+# `cube --threshold-policy include` builds cubes that keep them (data/cube_unfiltered/).
+cube_folder = os.path.join(data_folder, 'cube')
+threshold_policies = {'exclude': cube_folder, 'include': os.path.join(data_folder, 'cube_unfiltered')}
+
+directions = ('received', 'sent', 'moved', 'any')
+metrics = ('satoshis', 'transactions')
+units = ('day', 'week', 'month', 'year', 'total')
+all_slot = 'All'
+
+RECEIVED, SENT, MOVED, ANY = range(len(directions))
+
+
+# Period index of `days` (days since the Unix epoch; a scalar or a NumPy array) in `unit`.
+# Weeks start on Monday (1970-01-01 was a Thursday).
+def period_of(days, unit):
+    if unit == 'day':
+        return days
+    if unit == 'week':
+        return (days + 3) // 7
+    if unit == 'month':
+        return np.asarray(days).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    if unit == 'year':
+        return np.asarray(days).astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64)
+    if unit == 'total':
+        return np.zeros_like(days)
+    raise ValueError(f"Unknown unit {unit!r}: expected one of {', '.join(units)}")
+
+
+@lru_cache(maxsize=None)
+def period_of_day(day, unit):
+    return int(period_of(day, unit))
+
+
+# Label of a period index: its date for days and weeks (the Monday), YYYY-MM, the year, or 'total'
+def period_label(period, unit):
+    if unit == 'day':
+        return date_of_day(period)
+    if unit == 'week':
+        return date_of_day(period * 7 - 3)
+    if unit == 'month':
+        return str(np.datetime64(period, 'M'))
+    if unit == 'year':
+        return 1970 + period
+    return 'total'
+
+
+# Slots a wallet counts in: (All, All), its abuse types, its sources and the (type, source) lists holding it
+def slots_of(ctx):
+    sources = sorted({source for source, _ in ctx.listings})
+    pairs = sorted({(abuse_type, source) for source, abuse_type in ctx.listings if abuse_type.lower() != 'all'})
+    return ([(all_slot, all_slot)] + [(abuse_type, all_slot) for abuse_type in ctx.abuse_types]
+            + [(all_slot, source) for source in sources] + pairs)
+
+
+# Collects the cube of one universe during a scan; see Cube for the materialized form.
+# One subclass per universe, so the scanner's per-class scratch copies stay distinct.
+class DailyCube(Aggregator):
+    uses_listings = True
+
+    def __init__(self):
+        self.satoshis = defaultdict(int)      # (day, slot, direction) -> satoshis
+        self.transactions = defaultdict(int)  # (day, slot, direction) -> transactions
+        self.active = defaultdict(int)        # (unit, period, slot, direction) -> wallets
+        self._slots = ()
+        self._active_days = set()
+
+    def start_wallet(self, ctx):
+        self._slots = slots_of(ctx)
+        self._active_days = set()
+
+    def add_transaction(self, ctx, tx):
+        received = sum(tx.received)
+        sent = sum(tx.sent)
+        entries = [(ANY, received + sent)]
+        if tx.received or tx.sent:
+            entries.append((MOVED, received + sent))
+        if tx.received:
+            entries.append((RECEIVED, received))
+        if tx.sent:
+            entries.append((SENT, sent))
+
+        for slot in self._slots:
+            for direction, value in entries:
+                self.satoshis[tx.day, slot, direction] += value
+                self.transactions[tx.day, slot, direction] += 1
+        for direction, _ in entries:
+            self._active_days.add((tx.day, direction))
+
+    def finish_wallet(self, ctx):
+        for unit in units:
+            periods = {(period_of_day(day, unit), direction) for day, direction in self._active_days}
+            for slot in self._slots:
+                for period, direction in periods:
+                    self.active[unit, period, slot, direction] += 1
+
+    def merge(self, other):
+        merge_sums(self.satoshis, other.satoshis)
+        merge_sums(self.transactions, other.transactions)
+        merge_sums(self.active, other.active)
+
+    # The transaction count of a key is the number of transactions that added to it, so a key drops out
+    # when no remaining wallet contributes to it, as aggregators.Contributors does; satoshis share its keys
+    def subtract(self, other):
+        subtract_sums(self.satoshis, other.satoshis)
+        subtract_sums(self.transactions, other.transactions)
+        subtract_sums(self.active, other.active)
+        for key in other.transactions:
+            if not self.transactions[key]:
+                del self.transactions[key]
+                del self.satoshis[key]
+        for key in other.active:
+            if not self.active[key]:
+                del self.active[key]
+
+
+class AbuseAllCube(DailyCube):
+    name = 'cube_abuse_all'
+    universe = 'abuse_all'
+
+
+class AbuseAnyCube(DailyCube):
+    name = 'cube_abuse_any'
+    universe = 'abuse_any'
+
+
+class CategorizedCube(DailyCube):
+    name = 'cube_categorized'
+    universe = 'categorized'
+
+
+cube_aggregators = [AbuseAllCube, AbuseAnyCube, CategorizedCube]
+
+
+# Scan the corpus once into the cube of every universe and write them under `output`
+# (by default the folder of the threshold policy)
+def build(output=None, workers=1, rates_path=exchange_rates_path, threshold_policy='exclude'):
+    output = output or threshold_policies[threshold_policy]
+    engine = ScanEngine(rates_path=rates_path, thresholds=threshold_policy == 'exclude')
+    for aggregator_class in cube_aggregators:
+        engine.register(aggregator_class())
+    engine.run(workers)
+
+    rates = RateTable(rates_path)
+    for aggregator in engine.aggregators:
+        cube = Cube.materialize(aggregator, rates, threshold_policy)
+        cube.save(os.path.join(output, aggregator.universe), engine.store_state)
+        print(f"Saved the {aggregator.universe} cube ({cube.counts.shape[0]} days, {len(cube.slots)} slots) "
+              f"to {os.path.join(output, aggregator.universe)}")
+
+
+def exists(universe, path=cube_folder):
+    return os.path.exists(os.path.join(path, universe, 'meta.json'))
+
+
+# Why the cube of `universe` no longer matches the wallet `store`, None when it does (see
+# wallet_store.store_change)
+def stale(universe, store, path=cube_folder):
+    with open(os.path.join(path, universe, 'meta.json')) as f:
+        return store_change(json.load(f).get('store'), store)
+
+
+# Materialized cube of one universe
+class Cube:
+    def __init__(self, universe, threshold_policy, first_day, slots, counts, rates, active):
+        self.universe = universe
+        self.threshold_policy = threshold_policy
+        self.first_day = first_day
+        self.slots = slots
+        self.slot_ids = {slot: i for i, slot in enumerate(slots)}
+        self.counts = counts
+        self.rates = rates
+        self.active = active  # unit -> (first period, array)
+
+    @classmethod
+    def materialize(cls, aggregator, rates, threshold_policy='exclude'):
+        all_slots = (all_slot, all_slot)
+        slots = [all_slots] + sorted({slot for _, slot, _ in aggregator.transactions} - {all_slots})
+        slot_ids = {slot: i for i, slot in enumerate(slots)}
+        days = [day for day, _, _ in aggregator.transactions]
+        start = min(days, default=first_day)
+        n_days = max(days, default=start - 1) - start + 1
+
+        counts = np.zeros((n_days, len(slots), len(directions), len(metrics)), dtype=np.int64)
+        for (day, slot, direction), transactions in aggregator.transactions.items():
+            counts[day - start, slot_ids[slot], direction] = (aggregator.satoshis[day, slot, direction], transactions)
+        day_rates = np.array([rates.rate_of_day(day) for day in range(start, start + n_days)], dtype=np.int64)
+
+        active = {}
+        for unit in units:
+            cells = [(period, slot, direction, wallets)
+                     for (cell_unit, period, slot, direction), wallets in aggregator.active.items() if cell_unit == unit]
+            first_period = min((period for period, _, _, _ in cells), default=0)
+            n_periods = max((period for period, _, _, _ in cells), default=first_period - 1) - first_period + 1
+            array = np.zeros((n_periods, len(slots), len(directions)), dtype=np.int64)
+            for period, slot, direction, wallets in cells:
+                array[period - first_period, slot_ids[slot], direction] = wallets
+            active[unit] = (first_period, array)
+
+        return cls(aggregator.universe, threshold_policy, start, slots, counts, day_rates, active)
+
+    # `store_state`: the state of the wallet store the cube was built from (see ScanEngine.store_state)
+    def save(self, folder, store_state=None):
+        os.makedirs(folder, exist_ok=True)
+        np.save(os.path.join(folder, 'counts.npy'), self.counts)
+        np.save(os.path.join(folder, 'rates.npy'), self.rates)
+        for unit, (_, array) in self.active.items():
+            np.save(os.path.join(folder, f'active_{unit}.npy'), array)
+        with open(os.path.join(folder, 'meta.json'), 'w') as f:
+            json.dump({'universe': self.universe, 'threshold_policy': self.threshold_policy,
+                       'first_day': self.first_day, 'slots': self.slots,
+                       'first_periods': {unit: first_period for unit, (first_period, _) in self.active.items()},
+                       'store': store_state}, f, indent=4)
+
+    @classmethod
+    def load(cls, universe, path=cube_folder):
+        folder = os.path.join(path, universe)
+        with open(os.path.join(folder, 'meta.json')) as f:
+            meta = json.load(f)
+        active = {unit: (first_period, np.load(os.path.join(folder, f'active_{unit}.npy')))
+                  for unit, first_period in meta['first_periods'].items()}
+        return cls(meta['universe'], meta['threshold_policy'], meta['first_day'], [tuple(slot) for slot in meta['slots']],
+                   np.load(os.path.join(folder, 'counts.npy')), np.load(os.path.join(folder, 'rates.npy')), active)
+
+    @property
+    def abuse_types(self):
+        return sorted(abuse_type for abuse_type, source in self.slots if source == all_slot and abuse_type != all_slot)
+
+    @property
+    def sources(self):
+        return sorted(source for abuse_type, source in self.slots if abuse_type == all_slot and source != all_slot)
+
+    # {period label: value} of `metric` per `unit` for the wallets of slot (abuse_type, source),
+    # over the periods that have transactions in `direction`. Metrics:
+    #   satoshis, transactions - sums over the days of the period
+    #   eur_fixed              - exact EUR value in fixed-point units (see money.py)
+    #   wallets                - distinct wallets with a transaction in the period
+    def rollup(self, metric, unit='year', direction='received', abuse_type=all_slot, source=all_slot):
+        direction_id = directions.index(direction)
+        slot_id = self.slot_ids.get((abuse_type, source))
+        if slot_id is None:
+            return {}
+
+        if metric == 'wallets':
+            if unit not in self.active:
+                raise ValueError(f"Unknown unit {unit!r}: expected one of {', '.join(units)}")
+            first_period, array = self.active[unit]
+            values = array[:, slot_id, direction_id]
+            used = np.nonzero(values)[0]
+            return {period_label(int(first_period + i), unit): int(values[i]) for i in used}
+
+        cells = self.counts[:, slot_id, direction_id]
+        used = np.nonzero(cells[:, 1])[0]
+        periods = period_of(used + self.first_day, unit)
+        if metric == 'satoshis':
+            values = cells[used, 0].tolist()
+        elif metric == 'transactions':
+            values = cells[used, 1].tolist()
+        elif metric == 'eur_fixed':
+            # Satoshis x micro-euro rates exceed int64: multiply per day with Python integers
+            values = [satoshis * rate for satoshis, rate in zip(cells[used, 0].tolist(), self.rates[used].tolist())]
+        else:
+            raise ValueError(f"Unknown metric {metric!r}: expected satoshis, eur_fixed, transactions or wallets")
+
+        totals = {}
+        for period, value in zip(np.asarray(periods).tolist(), values):
+            label = period_label(period, unit)
+            totals[label] = totals.get(label, 0) + value
+        return totals
@@ -0,0 +1,82 @@
+import json
+from datetime import date, timedelta
+from functools import lru_cache
+
+import numpy as np
+
+from money import rate_to_micro_euros
+
+SECONDS_PER_DAY = 86_400
+epoch = date(1970, 1, 1)
+
+
+# Days since the Unix epoch (UTC) of a timestamp; works on scalars and NumPy arrays
+def day_of(timestamp):
+    return timestamp // SECONDS_PER_DAY
+
+
+def day_of_date(date_str):
+    return (date.fromisoformat(date_str) - epoch).days
+
+
+@lru_cache(maxsize=None)
+def date_of_day(day):
+    return (epoch + timedelta(days=day)).strftime('%Y-%m-%d')
+
+
+@lru_cache(maxsize=None)
+def year_of_day(day):
+    return (epoch + timedelta(days=day)).year
+
+
+# BitcoinExchangeRates.json loaded once into a dense array of micro-euros per BTC,
+# indexed by day - first_day, with a mask of the days that actually have a rate
+class RateTable:
+    def __init__(self, path):
+        with open(path) as f:
+            exchange_rates = json.load(f)
+
+        days = {day_of_date(date_str): rate for date_str, rate in exchange_rates.items()}
+        self.first_day = min(days)
+        n_days = max(days) - self.first_day + 1
+
+        self.micro_rates = np.zeros(n_days, dtype=np.int64)
+        self.valid = np.zeros(n_days, dtype=bool)
+        for day, rate in days.items():
+            self.micro_rates[day - self.first_day] = rate_to_micro_euros(rate)
+            self.valid[day - self.first_day] = True
+
+        # Plain lists are faster than NumPy scalars for the per-transaction lookups
+        self._micro_rates = self.micro_rates.tolist()
+        self._valid = self.valid.tolist()
+
+    def has_rate(self, day):
+        i = day - self.first_day
+        return 0 <= i < len(self._valid) and self._valid[i]
+
+    # Micro-euro rate of a day; 0 when the table has no rate for it (check has_rate)
+    def rate_of_day(self, day):
+        i = day - self.first_day
+        if 0 <= i < len(self._micro_rates):
+            return self._micro_rates[i]
+        return 0
+
+    def rate(self, timestamp):
+        return self.rate_of_day(day_of(timestamp))
+
+    # Vectorized lookup: (micro-euro rates, validity mask) for an array of timestamps
+    def rates(self, timestamps):
+        index = day_of(np.asarray(timestamps, dtype=np.int64)) - self.first_day
+        in_range = (index >= 0) & (index < len(self.micro_rates))
+        clipped = np.clip(index, 0, len(self.micro_rates) - 1)
+        valid = in_range & self.valid[clipped]
+        return np.where(valid, self.micro_rates[clipped], 0), valid
+
+
+# Print a summary of the days that had transactions but no exchange rate
+def report_missing_rates(missing_days):
+    if not missing_days:
+        return
+    days = sorted(missing_days)
+    print(f"Warning: no exchange rate for {len(days)} transaction days "
+          f"({date_of_day(days[0])} .. {date_of_day(days[-1])}); they are counted as 0 EUR")
@@ -0,0 +1,49 @@
+from decimal import Decimal
+
+import numpy as np
+
+# Exact money arithmetic.
+# Amounts are accumulated as integers and only converted to Decimal BTC/EUR for reporting:
+#   - BTC amounts in satoshis
+#   - exchange rates in micro-euros per BTC
+#   - EUR amounts as satoshis x micro-euros per BTC, i.e. units of 1e-14 EUR
+SATOSHIS_PER_BTC = 100_000_000  # 1 BTC = 100 million satoshis
+MICRO_EUROS_PER_EURO = 1_000_000
+EUR_FIXED_EXPONENT = -14  # 1 EUR fixed-point unit = 1e-14 EUR
+
+
+# Convert an exchange rate (EUR per BTC, as read from BitcoinExchangeRates.json) to micro-euros per BTC
+def rate_to_micro_euros(rate):
+    return int((Decimal(rate) * MICRO_EUROS_PER_EURO).to_integral_value())
+
+
+# EUR value of `satoshis` at a rate of `micro_rate`, in fixed-point units
+def eur_fixed(satoshis, micro_rate):
+    return satoshis * micro_rate
+
+
+# Reporting-time conversions; both are exact
+def btc(satoshis):
+    return Decimal(f"{satoshis}E-8")
+
+
+def eur(fixed):
+    return Decimal(f"{fixed}E{EUR_FIXED_EXPONENT}")
+
+
+# Vectorized path
+
+# Sum int64 satoshi `values` per day index (`days` = timestamp // 86400, relative to `first_day`)
+def sum_by_day(values, days, n_days, first_day=0):
+    totals = np.zeros(n_days, dtype=np.int64)
+    np.add.at(totals, np.asarray(days, dtype=np.int64) - first_day, np.asarray(values, dtype=np.int64))
+    return totals
+
+
+# Exact EUR fixed-point total of `values` paid on `days`, with `micro_rates` indexed by day.
+# Satoshis are summed per day in int64 first; the (few thousand) per-day products
+# are done with Python integers because they exceed int64.
+def eur_fixed_total(values, days, micro_rates, first_day=0):
+    daily_satoshis = sum_by_day(values, days, len(micro_rates), first_day)
+    used = np.nonzero(daily_satoshis)[0]
+    return sum(s * r for s, r in zip(daily_satoshis[used].tolist(), np.asarray(micro_rates)[used].tolist()))
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import pickle
+import subprocess
+import sys
+import time
+import zlib
+from collections import Counter
+
+import aggregators as aggregators_module
+import scan_engine
+from aggregators import figure_aggregators
+from exchange_rates import report_missing_rates
+from scan_engine import CorpusIndex, ScanEngine, aggregates_version, default_store, save_aggregates
+from scan_stats import ScanStats
+
+# Map-reduce execution of the scan, for corpora spread over several machines. The wallets are split
+# into partitions by the shard of their address in the wallet store (see wallet_store.py), so each
+# partition reads whole shard directories or archives:
+#   plan    - counts the wanted wallets of every shard and assigns the shards to N partitions of
+#             about the same number of wallets; the plan is written to a folder shared by the hosts
+#   map     - a host given only the shared folder and a partition id scans the wallets of that
+#             partition and writes its partial aggregates to partition-<id>.pickle in the folder
+#   reduce  - merges any set of partition files into the aggregates of `scan`; with every
+#             partition, they are identical to those of a single-machine scan
+# run_local stands in for the cluster: every partition is mapped by its own process on this machine.
+plan_file = 'plan.json'
+plan_version = 1
+
+
+def partition_path(folder, partition):
+    return os.path.join(folder, f'partition-{partition:04d}.pickle')
+
+
+# Identity of a plan: partition files only merge with files of the same plan
+def plan_id(plan):
+    fields = {name: plan[name] for name in ('version', 'partitions', 'sharding', 'figures', 'distinct_precision',
+                                            'shards')}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()[:16]
+
+
+# Split the wallets wanted by `figures` (aggregator names, default: all) into `partitions` partitions
+# of whole shards, the largest shards first, each to the partition with the fewest wallets so far.
+# Every partition counts distinct wallets with the same `distinct_precision` (see aggregators.py).
+def make_plan(folder, partitions, figures=None, distinct_precision=0, index=None):
+    if partitions < 1:
+        raise ValueError("The number of partitions must be at least 1")
+    selected = [cls for cls in figure_aggregators if not figures or cls.name in figures]
+    index = index or CorpusIndex()
+    sharding = default_store().sharding
+    wallets = set()
+    for universe in {cls.universe for cls in selected}:
+        wallets.update(index.wallets(universe))
+    sizes = Counter(sharding.shard(wallet) for wallet in wallets)
+
+    loads = [0] * partitions
+    shards = {}
+    for shard, size in sorted(sizes.items(), key=lambda item: (-item[1], item[0])):
+        partition = min(range(partitions), key=lambda i: (loads[i], i))
+        shards[shard] = partition
+        loads[partition] += size
+
+    plan = {'version': plan_version, 'partitions': partitions, 'sharding': sharding.spec,
+            'figures': [cls.name for cls in selected], 'distinct_precision': distinct_precision,
+            'shards': dict(sorted(shards.items())), 'wallets': loads}
+    plan['id'] = plan_id(plan)
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, plan_file), 'w') as f:
+        json.dump(plan, f, indent=4)
+    print(f"Plan {plan['id']}: {len(sizes)} shards ({sharding.spec}) of {len(wallets)} wallets in {partitions} "
+          f"partitions, {min(loads)} to {max(loads)} wallets each")
+    if min(loads) == 0:
+        print(f"Warning: some partitions are empty; the store has too few shards for {partitions} partitions")
+    return plan
+
+
+def load_plan(folder):
+    path = os.path.join(folder, plan_file)
+    if not os.path.exists(path):
+        raise ValueError(f"No plan in {folder}: run `cryptoabuse.py plan` first")
+    with open(path) as f:
+        plan = json.load(f)
+    if plan.get('version') != plan_version or plan.get('id') != plan_id(plan):
+        raise ValueError(f"{path} was written by another version or modified; plan again")
+    return plan
+
+
+# Partition of `shard` under `plan`. Shards without wanted wallets when the plan was made
+# (wallets listed since) go to a partition every host derives from the shard alone.
+def shard_partition(plan, shard):
+    partition = plan['shards'].get(shard)
+    if partition is None:
+        partition = zlib.crc32(shard.encode()) % plan['partitions']
+    return partition
+
+
+# Scan the wallets of `partition` and write their partial aggregates next to the plan
+def map_partition(folder, partition, workers=1, index=None):
+    plan = load_plan(folder)
+    if not 0 <= partition < plan['partitions']:
+        raise ValueError(f"Partition {partition} is not in 0..{plan['partitions'] - 1}")
+    store = default_store()
+    sharding = store.sharding
+    if sharding.spec != plan['sharding']:
+        raise ValueError(f"The plan shards by {plan['sharding']} but the wallet store by {sharding.spec}")
+
+    started = time.time()
+    index = index or CorpusIndex()
+    aggregators_module.distinct_precision = plan['distinct_precision']
+    engine = ScanEngine(index=index, store=store, report_path=os.path.join(folder, f'partition-{partition:04d}.json'))
+    for cls in figure_aggregators:
+        if cls.name in plan['figures']:
+            engine.register(cls(), wallets=[wallet for wallet in index.wallets(cls.universe)
+                                            if shard_partition(plan, sharding.shard(wallet)) == partition])
+    aggregators = engine.run(workers)
+
+    path = partition_path(folder, partition)
+    state = {'version': aggregates_version, 'plan': plan['id'], 'partition': partition, 'partitions': plan['partitions'],
+             'aggregates': {aggregator.name: aggregator for aggregator in aggregators},
+             'missing_rate_days': engine.missing_rate_days, 'stats': engine.stats, 'store': engine.store_state,
+             'wallet_counts': engine.wallet_counts, 'seconds': round(time.time() - started, 3)}
+    # Written under another name first: a reducer never sees a partial file
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, path)
+    print(f"Partition {partition}/{plan['partitions']}: wrote {path}")
+    return path
+
+
+# Merge the partition files at `paths` (any subset of one plan) and save the totals to `output`
+def reduce_partitions(paths, output):
+    if not paths:
+        raise ValueError("No partition files to reduce")
+    states = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('version') != aggregates_version:
+            raise ValueError(f"{path} was written by another version; map its partition again")
+        states.append(state)
+    plans = {state['plan'] for state in states}
+    if len(plans) > 1:
+        raise ValueError(f"The partition files come from different plans: {', '.join(sorted(plans))}")
+    partitions = Counter(state['partition'] for state in states)
+    duplicates = sorted(partition for partition, count in partitions.items() if count > 1)
+    if duplicates:
+        raise ValueError(f"Partitions given more than once: {', '.join(map(str, duplicates))}")
+
+    # Merged in partition order, so any listing of the same files gives the same totals
+    states.sort(key=lambda state: state['partition'])
+    aggregates = states[0]['aggregates']
+    missing_rate_days = set(states[0]['missing_rate_days'])
+    stats = ScanStats()
+    stats.merge(states[0]['stats'])
+    for state in states[1:]:
+        for name, aggregator in aggregates.items():
+            aggregator.merge(state['aggregates'][name])
+        missing_rate_days |= state['missing_rate_days']
+        stats.merge(state['stats'])
+
+    scanned = sum(state['wallet_counts'].get('scanned', 0) for state in states)
+    print(f"Reduced partitions {', '.join(str(state['partition']) for state in states)} of plan {plans.pop()} "
+          f"({scanned} wallets)")
+    absent = sorted(set(range(states[0]['partitions'])) - set(partitions))
+    if absent:
+        print(f"Warning: partitions {', '.join(map(str, absent))} are not included; the totals are partial")
+    report_missing_rates(missing_rate_days)
+    stats.report()
+    # Partitions mapped on other hosts read other copies of the wallet files, whose mtimes differ:
+    # the totals are only tied to a store state when every partition saw the same one
+    store_states = {json.dumps(state['store'], sort_keys=True) for state in states}
+    store_state = states[0]['store'] if len(store_states) == 1 else None
+    aggregators = list(aggregates.values())
+    save_aggregates(aggregators, output, store_state)
+    print(f"Saved {len(aggregators)} aggregates to {output}")
+    return aggregators
+
+
+# Plan `partitions` partitions in `folder`, map each in its own process, `processes` at a time, as
+# separate hosts would (only the folder and the partition id are passed), then reduce them all
+def run_local(folder, partitions, output, processes=1, workers=1, figures=None, distinct_precision=0):
+    plan = make_plan(folder, partitions, figures, distinct_precision)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cryptoabuse.py')
+    pending = list(range(plan['partitions']))
+    running = {}
+    failed = []
+    while pending or running:
+        while pending and len(running) < processes:
+            partition = pending.pop(0)
+            running[partition] = subprocess.Popen(
+                [sys.executable, script, 'map', folder, str(partition), '--workers', str(workers),
+                 '--stream-above', str(scan_engine.default_stream_threshold)],
+                stdout=subprocess.DEVNULL)
+        for partition, process in list(running.items()):
+            if process.poll() is not None:
+                del running[partition]
+                if process.returncode == 0:
+                    print(f"Partition {partition}: done")
+                else:
+                    print(f"Partition {partition}: failed (exit status {process.returncode})", file=sys.stderr)
+                    failed.append(partition)
+        time.sleep(0.05)
+    if failed:
+        raise ValueError(f"Partitions {', '.join(map(str, sorted(failed)))} failed; map them again, then reduce")
+    return reduce_partitions([partition_path(folder, partition) for partition in range(plan['partitions'])], output)
@@ -0,0 +1,108 @@
+import io
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Read-ahead of wallet documents: while the scanner parses one wallet, a small thread pool is already
+# reading the next ones into memory, so waiting on open()/read() (slow on network file systems)
+# overlaps with parsing instead of adding to it.
+
+
+# Counters of the read-ahead, summed over chunks and worker processes
+class IOStats:
+    __slots__ = ('reads', 'bytes', 'stalls', 'stall_seconds')
+
+    def __init__(self):
+        self.reads = 0
+        self.bytes = 0
+        self.stalls = 0
+        self.stall_seconds = 0.0
+
+    def merge(self, other):
+        self.reads += other.reads
+        self.bytes += other.bytes
+        self.stalls += other.stalls
+        self.stall_seconds += other.stall_seconds
+
+    # Stalls are the reads that were not finished by the time the scanner needed them:
+    # when they add up to a noticeable share of the scan, raise --io-threads or --read-ahead
+    def report(self):
+        if self.reads:
+            print(f"Read-ahead: {self.reads} wallets ({self.bytes / 2 ** 20:.1f} MiB) read in the background, "
+                  f"scan waited on {self.stalls} of them for {self.stall_seconds:.2f} s in total")
+
+
+# Wallet store wrapper that reads `wallets` ahead, in order, with `threads` threads and at most
+# `depth` documents in flight or waiting. The wallets must then be read in the same order;
+# others, and documents larger than `max_size` (left to be streamed), are read from `store` directly.
+# Use as a context manager: the thread pool lives until the block ends.
+class Prefetcher:
+    def __init__(self, store, wallets, depth, threads, max_size=None, stats=None):
+        self.store = store
+        self.pending = iter(wallets)
+        self.depth = depth
+        self.threads = threads
+        self.max_size = max_size
+        self.stats = stats if stats is not None else IOStats()
+        self.queue = deque()
+        self.current = None  # (wallet, document or None) of the wallet being read
+
+    def __enter__(self):
+        self.pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='read-ahead')
+        for _ in range(self.depth):
+            self._submit()
+        return self
+
+    def __exit__(self, *exc_info):
+        for _, future in self.queue:
+            future.cancel()
+        self.pool.shutdown(wait=True)
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def size(self, wallet):
+        document = self._fetched(wallet)
+        return len(document) if document is not None else self.store.size(wallet)
+
+    def open_wallet(self, wallet):
+        document = self._fetched(wallet)
+        return io.BytesIO(document) if document is not None else self.store.open_wallet(wallet)
+
+    def _submit(self):
+        wallet = next(self.pending, None)
+        if wallet is not None:
+            self.queue.append((wallet, self.pool.submit(self._read, wallet)))
+
+    # Runs in the pool
+    def _read(self, wallet):
+        if self.max_size is not None and self.store.size(wallet) > self.max_size:
+            return None
+        with self.store.open_wallet(wallet) as wf:
+            return wf.read()
+
+    def _fetched(self, wallet):
+        if self.current is None or self.current[0] != wallet:
+            self.current = (wallet, self._next(wallet))
+        return self.current[1]
+
+    # Document of `wallet` if it is next in the queue, None otherwise
+    def _next(self, wallet):
+        if not self.queue or self.queue[0][0] != wallet:
+            return None
+        _, future = self.queue.popleft()
+        self._submit()
+
+        if not future.done():
+            start = time.perf_counter()
+            wait([future])
+            self.stats.stalls += 1
+            self.stats.stall_seconds += time.perf_counter() - start
+        try:
+            document = future.result()
+        except OSError:
+            return None  # read again directly, so the error surfaces where it did without read-ahead
+        if document is not None:
+            self.stats.reads += 1
+            self.stats.bytes += len(document)
+        return document
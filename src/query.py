@@ -0,0 +1,163 @@
+import csv
+import json
+import sys
+from datetime import date, timedelta
+from decimal import Decimal
+
+import daily_cube
+from daily_cube import all_slot
+from money import btc, eur
+
+# Ad-hoc questions ("monthly ransomware inflow in EUR since 2017") answered from the materialized
+# daily cubes (see daily_cube.py) instead of a copy of a plot script and a rescan. The cubes were
+# scanned with the figures' inclusion rules, so the answers agree with the figures.
+
+# Query metric -> cube metric
+metrics = {'btc': 'satoshis', 'eur': 'eur_fixed', 'transactions': 'transactions', 'wallets': 'wallets'}
+time_dimensions = ('day', 'week', 'month', 'year')  # finest first
+dimensions = time_dimensions + ('abuse_type', 'source', 'direction')
+formats = ('table', 'csv', 'json')
+
+
+# ISO date of a YYYY, YYYY-MM or YYYY-MM-DD bound of a date range: its first day, or its last with `end`
+def normalize_date(value, end=False):
+    parts = value.split('-')
+    try:
+        if len(parts) == 1:
+            bound = date(int(parts[0]), 12, 31) if end else date(int(parts[0]), 1, 1)
+        elif len(parts) == 2:
+            bound = date(int(parts[0]), int(parts[1]), 1)
+            if end:
+                return period_bounds(bound, 'month')[1]
+        else:
+            bound = date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid date {value!r}: expected YYYY, YYYY-MM or YYYY-MM-DD") from None
+    return bound.isoformat()
+
+
+# First and last date (ISO strings) of the period starting on `start` (a date) in `unit`
+def period_bounds(start, unit):
+    if unit == 'day':
+        end = start
+    elif unit == 'week':
+        end = start + timedelta(days=6)
+    elif unit == 'month':
+        end = (start.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    else:
+        end = start.replace(month=12, day=31)
+    return start.isoformat(), end.isoformat()
+
+
+# Start date of the period of cube `unit` labelled `label` (see daily_cube.period_label)
+def period_start(label, unit):
+    if unit == 'month':
+        return date.fromisoformat(f'{label}-01')
+    if unit == 'year':
+        return date(label, 1, 1)
+    return date.fromisoformat(label)
+
+
+# Value of time dimension `dimension` for the period starting on `start`
+def time_key(start, dimension):
+    if dimension == 'day':
+        return start.isoformat()
+    if dimension == 'week':
+        return (start - timedelta(days=start.weekday())).isoformat()
+    if dimension == 'month':
+        return start.isoformat()[:7]
+    return start.year
+
+
+# Values to iterate over for a slot dimension: each selected (or every) value when grouped by it,
+# the selected values summed otherwise, and All without a filter
+def slot_values(dimension, group_by, selected, available):
+    unknown = sorted(set(selected or ()) - set(available))
+    if unknown:
+        raise ValueError(f"Unknown {dimension.replace('_', ' ')} {', '.join(unknown)}; "
+                         f"available: {', '.join(available) or 'none'}")
+    if dimension in group_by:
+        return list(selected or available)
+    return list(selected or [all_slot])
+
+
+# Run a query against the cube of `universe` built with `threshold_policy`.
+# Returns (column names, rows), rows sorted by their group-by values.
+# A wallet listed under several selected abuse types or sources counts in each of them, as in
+# the per-category figures; the wallets metric is a count of distinct wallets per period, so it
+# can only be restricted to a date range when grouped by a time dimension (whole periods are kept).
+def run_query(metric, group_by=(), since=None, until=None, abuse_types=None, sources=None, directions=None,
+              universe='categorized', threshold_policy='exclude', path=None):
+    since = since and normalize_date(since)
+    until = until and normalize_date(until, end=True)
+    if metric not in metrics:
+        raise ValueError(f"Unknown metric {metric!r}: expected one of {', '.join(metrics)}")
+    unknown = [dimension for dimension in group_by if dimension not in dimensions]
+    if unknown:
+        raise ValueError(f"Unknown group-by dimension {', '.join(unknown)}: expected {', '.join(dimensions)}")
+
+    path = path or daily_cube.threshold_policies[threshold_policy]
+    if not daily_cube.exists(universe, path):
+        raise ValueError(f"No {universe} cube in {path}: run `python src/cryptoabuse.py cube"
+                         f"{'' if threshold_policy == 'exclude' else ' --threshold-policy ' + threshold_policy}` first")
+    cube = daily_cube.Cube.load(universe, path)
+
+    requested_times = [dimension for dimension in time_dimensions if dimension in group_by]
+    if metric == 'wallets':
+        unit = requested_times[0] if requested_times else 'total'
+        if unit == 'total' and (since or until):
+            raise ValueError("The wallets metric needs a time dimension in --group-by to filter by date")
+    else:
+        unit = 'day'
+
+    type_values = slot_values('abuse_type', group_by, abuse_types, cube.abuse_types)
+    source_values = slot_values('source', group_by, sources, cube.sources)
+    if 'direction' in group_by:
+        direction_values = list(directions or ('received', 'sent'))
+    elif directions and len(directions) > 1:
+        raise ValueError("Several directions need --group-by direction")
+    else:
+        direction_values = list(directions or ('received',))
+    unknown = [direction for direction in direction_values if direction not in daily_cube.directions]
+    if unknown:
+        raise ValueError(f"Unknown direction {', '.join(unknown)}: expected {', '.join(daily_cube.directions)}")
+
+    totals = {}
+    for abuse_type in type_values:
+        for source in source_values:
+            for direction in direction_values:
+                values = {'abuse_type': abuse_type, 'source': source, 'direction': direction}
+                for label, value in cube.rollup(metrics[metric], unit, direction, abuse_type, source).items():
+                    if unit != 'total':
+                        start = period_start(label, unit)
+                        first, last = period_bounds(start, unit)
+                        if (since and last < since) or (until and first > until):
+                            continue
+                        values.update((dimension, time_key(start, dimension)) for dimension in requested_times)
+                    key = tuple(values[dimension] for dimension in group_by)
+                    totals[key] = totals.get(key, 0) + value
+
+    convert = {'btc': btc, 'eur': lambda fixed: eur(fixed).quantize(Decimal('0.01'))}.get(metric, int)
+    rows = [key + (convert(total),) for key, total in sorted(totals.items(), key=lambda item: [str(v) for v in item[0]])]
+    return list(group_by) + [metric], rows
+
+
+def write_result(columns, rows, output_format='table', out=None):
+    out = out or sys.stdout
+    if output_format == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    elif output_format == 'json':
+        json.dump([dict(zip(columns, row)) for row in rows], out, indent=4,
+                  default=lambda value: float(value) if isinstance(value, Decimal) else str(value))
+        out.write('\n')
+    else:
+        cells = [columns] + [[str(value) for value in row] for row in rows]
+        widths = [max(len(row[i]) for row in cells) for i in range(len(columns))]
+        for i, row in enumerate(cells):
+            # Text columns left-aligned, the metric right-aligned
+            out.write('  '.join(value.ljust(width) for value, width in zip(row[:-1], widths))
+                      + ('  ' if len(row) > 1 else '') + row[-1].rjust(widths[-1]) + '\n')
+            if i == 0:
+                out.write('  '.join('-' * width for width in widths) + '\n')
@@ -0,0 +1,160 @@
+import contextlib
+import hashlib
+import io
+import json
+import os
+import runpy
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from aggregators import figure_aggregators
+from scan_engine import ScanEngine, aggregates_path, default_store, save_aggregates, stored_aggregates
+
+# Headless batch rendering of the README figures: every plot script runs in a worker process with
+# the Agg backend, and its plt.show() saves the figure next to the script instead of opening a window.
+# A figure is only rendered again when its script or the aggregates it reads changed.
+plots_folder = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plots'))
+render_state_path = os.path.join(plots_folder, '.render_state.json')
+
+# (script, output name without extension, names of the aggregates it reads).
+# None reads the corpus directly: every aggregate stands in for the state of the corpus.
+figures = [
+    ('0_Overall_crime/Overall_crime.py', 'Totall_funds', ['overall_crime']),
+    ('1_Pie_chart_of_total_money_per_abuse_type/Pie_chart_of_total_money_per_abuse_type.py',
+     'Pie_chart_of_total_money_per_abuse_type', None),
+    ('2_Annual_crime/Annual_crime.py', 'Annual_crime', ['annual_crime']),
+    ('3_Annual_crime_per_category/Annual_crime_per_category.py', 'Annual_crime_per_category',
+     ['annual_crime_per_category']),
+    ('4_yoy_change_in_each_abuse_type/yoy_change_in_each_abuse_type.py', 'yoy_change_in_each_abuse_type',
+     ['annual_crime_per_category']),
+    ('5_overall_wallets_transactions/overall_wallets_transactions.py', 'overall_wallets_transactions',
+     ['overall_wallets_transactions']),
+    ('6_wallets_that_have_transactions_each_year/wallets_that_have_transactions_each_year.py',
+     'wallets_that_have_transations_each_year', ['wallets_per_year']),
+    ('7_wallets_that_have_transactions_each_year_per_crime/wallets_that_have_transactions_each_year_per_crime.py',
+     'wallets_that_have_transactions_each_year_per_crime', ['wallets_per_year_per_crime']),
+    ('8_number_of_transactions_each_year/number_of_transactions_each_year.py', 'number_of_transactions_each_year',
+     ['transactions_per_year']),
+    ('8_number_of_transactions_each_year/Tottal_only_one.py', 'totall_only_one', ['transactions_per_year']),
+    ('10_Number_of_wallets_and_transactions/Number_of_wallets_and_transactions.py',
+     'Numver_of_wallets_and_transactions', ['wallets_and_transactions']),
+]
+
+
+# Stable encoding of an aggregate for fingerprints: pickles of sets and dicts depend on
+# insertion order and string hashing, so containers are sorted first
+def canonical(value):
+    if isinstance(value, dict):
+        return sorted((repr(key), canonical(item)) for key, item in value.items())
+    if isinstance(value, (set, frozenset)):
+        return sorted(repr(item) for item in value)
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    if isinstance(value, (int, float, str, bytes, Decimal)) or value is None:
+        return repr(value)
+    return [type(value).__name__, canonical({key: item for key, item in vars(value).items() if not key.startswith('_')})]
+
+
+def digest(value):
+    return hashlib.sha256(repr(canonical(value)).encode()).hexdigest()
+
+
+# The aggregates of every figure, from `path` when it holds all of them and is current with the
+# wallet store (see scan_engine.stored_aggregates), otherwise from a new scan
+def figure_aggregates(path=aggregates_path, workers=1):
+    store = default_store()
+    stored = stored_aggregates(path, store)
+    if stored is not None and all(cls.name in stored for cls in figure_aggregators):
+        print(f"Using aggregates stored in {path}")
+        return stored
+
+    engine = ScanEngine(store=store)
+    for aggregator_class in figure_aggregators:
+        engine.register(aggregator_class())
+    aggregators = engine.run(workers)
+    save_aggregates(aggregators, path, engine.store_state)
+    print(f"Saved {len(aggregators)} aggregates to {path}")
+    return {aggregator.name: aggregator for aggregator in aggregators}
+
+
+# Runs in a worker: execute the plot script with plt.show() saving the current figure(s)
+# to `output` (a path without extension) in every format. Returns the files written.
+def render_figure(script, output, formats, dpi):
+    os.environ['MPLBACKEND'] = 'Agg'
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    written = []
+
+    def save(*args, **kwargs):
+        for i, number in enumerate(plt.get_fignums()):
+            figure = plt.figure(number)
+            for extension in formats:
+                path = f"{output}{'' if i == 0 else f'_{i + 1}'}.{extension}"
+                figure.savefig(path, dpi=dpi)
+                written.append(path)
+        plt.close('all')
+
+    # Workers are reused: drop any figure a failed script left open
+    plt.close('all')
+    show = plt.show
+    plt.show = save
+    try:
+        # The scripts print their figures' numbers; only the rendered files are reported
+        with contextlib.redirect_stdout(io.StringIO()):
+            runpy.run_path(script, run_name='__main__')
+        save()
+    finally:
+        plt.show = show
+        plt.close('all')
+    return written
+
+
+def _load_state(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+# Render every figure into plots/, in `workers` processes. Figures whose script, input aggregates
+# and output settings are unchanged since the last render are skipped unless `force`.
+def render(workers=1, formats=('png',), dpi=100, force=False, path=aggregates_path, state_path=render_state_path):
+    aggregates = figure_aggregates(path, workers)
+    aggregate_digests = {name: digest(aggregate) for name, aggregate in aggregates.items()}
+    state = _load_state(state_path)
+
+    pending = []
+    for script, name, inputs in figures:
+        script_path = os.path.join(plots_folder, script)
+        output = os.path.join(os.path.dirname(script_path), name)
+        with open(script_path, 'rb') as f:
+            code_digest = hashlib.sha256(f.read()).hexdigest()
+        fingerprint = [code_digest, sorted(formats), dpi,
+                       [aggregate_digests.get(input_name) for input_name in (inputs or sorted(aggregate_digests))]]
+        outputs = [f'{output}.{extension}' for extension in formats]
+        if not force and state.get(script) == fingerprint and all(os.path.exists(file) for file in outputs):
+            print(f"{script}: up to date")
+            continue
+        pending.append((script, script_path, output, fingerprint))
+
+    rendered = 0
+    with ProcessPoolExecutor(max_workers=max(workers, 1)) as pool:
+        futures = [(script, fingerprint, pool.submit(render_figure, script_path, output, list(formats), dpi))
+                   for script, script_path, output, fingerprint in pending]
+        for script, fingerprint, future in futures:
+            try:
+                written = future.result()
+            except Exception as e:
+                print(f"{script}: failed ({type(e).__name__}: {e})", file=sys.stderr)
+                state.pop(script, None)
+                continue
+            print(f"{script}: wrote {', '.join(os.path.relpath(file, plots_folder) for file in written)}")
+            state[script] = fingerprint
+            rendered += 1
+
+    with open(state_path, 'w') as f:
+        json.dump(state, f, indent=4)
+    print(f"Rendered {rendered} of {len(figures)} figures ({len(figures) - len(pending)} up to date)")
@@ -0,0 +1,145 @@
+import copy
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+
+from exchange_rates import report_missing_rates
+from scan_engine import aggregates_version, data_folder, first_year, n_tx_threshold, total_received_threshold
+from scan_stats import ScanStats
+
+# Per-wallet partial aggregates of the last scan, so a re-scan only visits the wallets that changed
+cache_path = os.path.join(data_folder, 'scan_cache.sqlite')
+
+schema = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB);
+CREATE TABLE IF NOT EXISTS wallets (wallet TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, partials BLOB);
+CREATE TABLE IF NOT EXISTS missing_rate_days (wallet TEXT NOT NULL, day INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS missing_rate_days_wallet ON missing_rate_days (wallet);
+'''
+
+
+# Everything besides the wallets themselves that the partial aggregates depend on;
+# the whole cache is rebuilt when it changes
+def config_key(engine):
+    rates = os.stat(engine.rates_path)
+    config = {
+        'aggregates_version': aggregates_version,
+        'aggregators': [aggregator.name for aggregator in engine.aggregators],
+        'total_received_threshold': total_received_threshold,
+        'n_tx_threshold': n_tx_threshold,
+        'first_year': first_year,
+        'source': type(engine.source).__name__,
+        'exchange_rates': [rates.st_size, rates.st_mtime_ns],
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+class ScanCache:
+    def __init__(self, path=cache_path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(schema)
+
+    def _meta(self, key):
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return None if row is None else row[0]
+
+    # The global aggregates stored along with the partials, or None when they were computed with another config
+    def aggregates(self, config):
+        if self._meta('config') != config:
+            return None
+        return pickle.loads(self._meta('aggregates'))
+
+    def reset(self, config):
+        self.connection.execute('DELETE FROM wallets')
+        self.connection.execute('DELETE FROM missing_rate_days')
+        self.connection.execute('DELETE FROM meta')
+        self.connection.execute('INSERT INTO meta VALUES (?, ?)', ('config', config))
+
+    def save_aggregates(self, aggregators):
+        self.connection.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('aggregates', pickle.dumps(aggregators)))
+
+    def fingerprints(self):
+        return dict(self.connection.execute('SELECT wallet, fingerprint FROM wallets'))
+
+    # {aggregator index: partial} of a wallet, None when it was missing
+    def partials(self, wallet):
+        row = self.connection.execute('SELECT partials FROM wallets WHERE wallet = ?', (wallet,)).fetchone()
+        return None if row is None or row[0] is None else pickle.loads(row[0])
+
+    # Days without an exchange rate on which the cached wallets moved funds, all of them and not only
+    # those of the wallets scanned again, as a full scan reports them
+    def missing_rate_days(self):
+        return {day for day, in self.connection.execute('SELECT DISTINCT day FROM missing_rate_days')}
+
+    def put(self, wallet, fingerprint, partials, missing_rate_days=()):
+        self.connection.execute('INSERT OR REPLACE INTO wallets VALUES (?, ?, ?)',
+                                (wallet, fingerprint, None if partials is None else pickle.dumps(partials)))
+        self.connection.executemany('INSERT INTO missing_rate_days VALUES (?, ?)',
+                                    ((wallet, day) for day in sorted(missing_rate_days)))
+
+    def delete(self, wallet):
+        self.connection.execute('DELETE FROM wallets WHERE wallet = ?', (wallet,))
+        self.connection.execute('DELETE FROM missing_rate_days WHERE wallet = ?', (wallet,))
+
+
+# Cache key of a wallet: the source's fingerprint of its content plus how it is routed
+def wallet_fingerprint(source, wallet, indices, abuse_types):
+    return json.dumps([source.fingerprint(wallet), indices, list(abuse_types)])
+
+
+# Incremental equivalent of engine.run(): only the wallets whose fingerprint changed since the
+# cached scan are scanned again; their old partials are subtracted from the global aggregates
+# and the new ones merged in. Falls back to a full (cached) scan when the config changed.
+def update(engine, path=cache_path, workers=1):
+    cache = ScanCache(path)
+    config = config_key(engine)
+
+    aggregators = cache.aggregates(config)
+    if aggregators is None:
+        print(f"Scan cache {path} is empty or was built with another configuration; scanning every wallet")
+        cache.reset(config)
+        aggregators = copy.deepcopy(engine.aggregators)
+
+    jobs = engine.jobs()
+    fingerprints = {wallet: wallet_fingerprint(engine.source, wallet, indices, abuse_types)
+                    for wallet, indices, abuse_types in jobs}
+    stored = cache.fingerprints()
+    changed = [job for job in jobs if stored.get(job[0]) != fingerprints[job[0]]]
+    outdated = [wallet for wallet in stored if fingerprints.get(wallet) != stored[wallet]]
+    removed = sum(1 for wallet in stored if wallet not in fingerprints)
+    print(f"Scan cache: {len(changed)} new or changed wallets, {removed} removed, {len(jobs) - len(changed)} unchanged")
+
+    started = time.time()
+    # Taken before any wallet is scanned, as in engine.run()
+    engine.store_state = engine.store.state() if engine.store is not None else None
+    stats = ScanStats(engine.slow_log)
+    with cache.connection:
+        for wallet in outdated:
+            partials = cache.partials(wallet)
+            for i, partial in (partials or {}).items():
+                aggregators[i].subtract(partial)
+            cache.delete(wallet)
+
+        for results, chunk_stats in engine.map_chunks('scan_wallets', engine.split(changed), workers):
+            stats.merge(chunk_stats)
+            for wallet, partials, wallet_missing_rate_days in results:
+                for i, partial in (partials or {}).items():
+                    aggregators[i].merge(partial)
+                cache.put(wallet, fingerprints[wallet], partials, wallet_missing_rate_days)
+
+        cache.save_aggregates(aggregators)
+    missing_rate_days = cache.missing_rate_days()
+
+    report_missing_rates(missing_rate_days)
+    stats.report()
+    engine.stats = stats
+    engine.missing_rate_days = missing_rate_days
+    engine.wallet_counts['scanned'] = len(changed)
+    engine.aggregators[:] = aggregators
+    engine.write_report(started, workers, incremental={'changed': len(changed), 'removed': removed,
+                                                       'unchanged': len(jobs) - len(changed)})
+    return engine.aggregators
@@ -0,0 +1,78 @@
+import hashlib
+import os
+import pickle
+import time
+
+# Checkpoints of a long scan (ScanEngine.run with a checkpoint path): every `interval` seconds the
+# aggregates merged so far are written to disk, with the number of chunks they cover. Chunks are
+# fixed slices of the job list (see ScanEngine.split) merged in order, so that number identifies the
+# set of wallets already processed, and a resumed run merges exactly the chunks an uninterrupted
+# run would have merged after them: its results are identical.
+#
+# A checkpoint only resumes the scan it was written by: the same aggregators, wallet jobs, chunk size,
+# thresholds and source. Wallet files changed in between are not rescanned (see scan_cache.py for that),
+# but the aggregates keep the store state of the interrupted run, so they are seen as stale when loaded.
+checkpoint_version = 2
+
+
+# Identity of a scan: everything the merged aggregates depend on besides the files' contents
+def scan_key(engine, chunks):
+    digest = hashlib.sha256()
+    digest.update(repr((checkpoint_version, [type(aggregator).__name__ for aggregator in engine.aggregators],
+                        engine.chunk_size, engine.thresholds, type(engine.source).__name__)).encode())
+    for chunk in chunks:
+        for wallet, indices, abuse_types in chunk:
+            digest.update(repr((wallet, indices, abuse_types)).encode())
+    return digest.hexdigest()
+
+
+class Checkpoint:
+    def __init__(self, path, interval, key):
+        self.path = path
+        self.interval = interval  # seconds between checkpoints
+        self.key = key
+        self.last = time.monotonic()
+
+    def due(self):
+        return time.monotonic() - self.last >= self.interval
+
+    # Write the state of `engine` after `chunks_done` chunks (`processed_wallets` wallets), atomically
+    def save(self, engine, chunks_done, processed_wallets):
+        state = {'key': self.key, 'chunks_done': chunks_done, 'processed_wallets': processed_wallets,
+                 'aggregators': engine.aggregators, 'missing_rate_days': engine.missing_rate_days,
+                 'stats': engine.stats, 'store_state': engine.store_state}
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.path)
+        self.last = time.monotonic()
+        print(f"Checkpoint: {processed_wallets} wallets ({chunks_done} chunks) saved to {self.path}")
+
+    # The state saved for this scan. Raises ValueError when there is no checkpoint of this scan.
+    def load(self):
+        if not os.path.exists(self.path):
+            raise ValueError(f"No checkpoint in {self.path}")
+        with open(self.path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('key') != self.key:
+            raise ValueError(f"The checkpoint in {self.path} was written by another scan (different figures, "
+                             f"wallets or options); run without --resume to start over")
+        return state
+
+    # Restore a loaded `state` into `engine`; returns the number of wallets it covers.
+    # Merged into the registered aggregators, so references to them stay valid.
+    def restore(self, engine, state):
+        for aggregator, saved in zip(engine.aggregators, state['aggregators']):
+            aggregator.merge(saved)
+        engine.missing_rate_days = state['missing_rate_days']
+        engine.stats = state['stats']
+        # The aggregates describe the wallet files as they were when the interrupted run started
+        engine.store_state = state['store_state']
+        print(f"Resuming after {state['processed_wallets']} wallets ({state['chunks_done']} chunks) from {self.path}")
+        return state['processed_wallets']
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
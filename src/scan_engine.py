@@ -0,0 +1,733 @@
+import contextlib
+import copy
+import json
+import os
+import pickle
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from abuse_lists import (abuse_json_path, abuse_masks, data_folder, decode_abuse_masks, wallet_abuse_types_path,
+                         wallets_by_abuse_type_path)
+from exchange_rates import RateTable, day_of, day_of_date, report_missing_rates, year_of_day
+import shard_archive
+import wallet_decoder
+from prefetch import Prefetcher
+from scan_checkpoint import Checkpoint, scan_key
+from scan_stats import CountingReader, ScanStats, write_report
+import wallet_stream
+from wallet_store import DirectoryStore, store_change
+
+# Paths under the data folder (see abuse_lists.py for the folder and the abuse lists)
+wallets_folder = os.path.join(data_folder, 'bitcoin')
+packed_wallets_folder = os.path.join(data_folder, 'bitcoin_packed')
+exchange_rates_path = os.path.join(data_folder, 'BitcoinExchangeRates.json')
+aggregates_path = os.path.join(data_folder, 'aggregates.pickle')
+scan_report_path = os.path.join(data_folder, 'scan_report.json')
+checkpoint_path = os.path.join(data_folder, 'scan_checkpoint.pickle')
+
+# Thresholds for transactions and total received
+total_received_threshold = 10_000_000_000_000  # 10 trillion satoshis
+n_tx_threshold = 100_000
+
+# Wallet files larger than this are parsed one transaction at a time (see wallet_stream.py)
+# instead of being loaded whole; 0 streams every file
+default_stream_threshold = 16 * 1024 * 1024
+
+# Wallet documents read ahead by a thread pool while the scanner parses (see prefetch.py):
+# at most `default_read_ahead` in flight or waiting per process, read by `default_io_threads`
+# threads; 0 reads every document when it is parsed
+default_read_ahead = 32
+default_io_threads = 4
+
+# Transactions before this year are excluded from every figure
+first_year = 2012
+first_day = day_of_date(f'{first_year}-01-01')
+
+
+# Wallets with extremely large total_received or n_tx values are skipped to avoid noise
+def exceeds_thresholds(total_received, n_tx):
+    return total_received > total_received_threshold or n_tx > n_tx_threshold
+
+
+# Lazily loaded views over the abuse lists, shared by every aggregator of a scan
+class CorpusIndex:
+    def __init__(self, abuse_path=abuse_json_path, by_type_path=wallets_by_abuse_type_path,
+                 reverse_path=wallet_abuse_types_path):
+        self.abuse_path = abuse_path
+        self.by_type_path = by_type_path
+        self.reverse_path = reverse_path
+        self._abuse_data = None
+        self._wallets_by_abuse_type = None
+        self._abuse_types_by_wallet = None
+        self._listings_by_wallet = None
+
+    @property
+    def abuse_data(self):
+        if self._abuse_data is None:
+            with open(self.abuse_path) as f:
+                self._abuse_data = json.load(f)
+        return self._abuse_data
+
+    @property
+    def wallets_by_abuse_type(self):
+        if self._wallets_by_abuse_type is None:
+            with open(self.by_type_path) as f:
+                data = json.load(f)
+            self._wallets_by_abuse_type = {abuse_type: set(wallets) for abuse_type, wallets in data.items()}
+        return self._wallets_by_abuse_type
+
+    def has_categories(self):
+        return os.path.exists(self.reverse_path) or os.path.exists(self.by_type_path)
+
+    # Reverse mapping wallet -> sorted tuple of its abuse types, decoded from the
+    # bitmask index written by AbuseToPerCategory.py (or rebuilt from wallets_by_abuse_type.json
+    # when that index is missing or older)
+    @property
+    def abuse_types_by_wallet(self):
+        if self._abuse_types_by_wallet is None:
+            if os.path.exists(self.reverse_path) and not (
+                    os.path.exists(self.by_type_path) and os.path.getmtime(self.by_type_path) > os.path.getmtime(self.reverse_path)):
+                with open(self.reverse_path) as f:
+                    reverse_index = json.load(f)
+                self._abuse_types_by_wallet = decode_abuse_masks(reverse_index['abuse_types'], reverse_index['wallets'])
+            else:
+                abuse_types = sorted(self.wallets_by_abuse_type)
+                masks = abuse_masks(abuse_types, self.wallets_by_abuse_type)
+                self._abuse_types_by_wallet = decode_abuse_masks(abuse_types, masks)
+        return self._abuse_types_by_wallet
+
+    # Mapping wallet -> sorted tuple of the (source, abuse type) lists of Abuses.json that hold it,
+    # the "All" lists included
+    @property
+    def listings_by_wallet(self):
+        if self._listings_by_wallet is None:
+            listings = defaultdict(set)
+            for source, abuse_types in self.abuse_data.items():
+                for abuse_type, wallets in abuse_types.items():
+                    for wallet in wallets:
+                        listings[wallet].add((source, abuse_type))
+            self._listings_by_wallet = {wallet: tuple(sorted(pairs)) for wallet, pairs in listings.items()}
+        return self._listings_by_wallet
+
+    # Wallet universes used by the plot scripts:
+    #   'abuse_all'   - the "All" list of every source in Abuses.json
+    #   'abuse_any'   - every list of every source in Abuses.json
+    #   'categorized' - every wallet of wallets_by_abuse_type.json (via the reverse index)
+    def wallets(self, universe):
+        if universe == 'abuse_all':
+            return {wallet for abuse_types in self.abuse_data.values() for wallet in abuse_types.get("All", [])}
+        if universe == 'abuse_any':
+            return {wallet for abuse_types in self.abuse_data.values() for wallets in abuse_types.values() for wallet in wallets}
+        if universe == 'categorized':
+            return set(self.abuse_types_by_wallet)
+        raise ValueError(f"Unknown wallet universe: {universe}")
+
+
+# What an aggregator gets to know about the wallet being scanned.
+# `listings` (see CorpusIndex.listings_by_wallet) is only filled for aggregators with uses_listings.
+class WalletContext:
+    __slots__ = ('wallet', 'abuse_types', 'n_tx', 'total_received', 'listings')
+
+    def __init__(self, wallet, abuse_types, n_tx, total_received, listings=()):
+        self.wallet = wallet
+        self.abuse_types = abuse_types
+        self.n_tx = n_tx
+        self.total_received = total_received
+        self.listings = listings
+
+
+# A transaction reduced to the fields the figures use, parsed once per scan
+class Transaction:
+    __slots__ = ('time', 'day', 'year', 'rate', 'received', 'sent')
+
+    def __init__(self, time, day, year, rate, received, sent):
+        self.time = time
+        self.day = day            # days since the Unix epoch (UTC)
+        self.year = year
+        self.rate = rate          # BTC -> EUR rate of the transaction's day, in micro-euros per BTC
+        self.received = received  # satoshi values of the outputs paying the wallet
+        self.sent = sent          # satoshi values of the inputs spent by the wallet
+
+
+# `tx` is a wallet_decoder.Tx record
+def parse_transaction(tx, wallet, exchange_rates):
+    received = [output_tx.value for output_tx in tx.out if output_tx.addr == wallet]
+    sent = [input_tx.prev_out.value for input_tx in tx.inputs
+            if input_tx.prev_out is not None and input_tx.prev_out.addr == wallet]
+
+    return make_transaction(tx.time, received, sent, exchange_rates)
+
+
+# Build a Transaction, or None when it has no timestamp or is before 2012.
+# `exchange_rates` is an exchange_rates.RateTable.
+def make_transaction(timestamp, received, sent, exchange_rates):
+    if not timestamp:
+        return None
+
+    # Exclude data before 2012
+    day = day_of(timestamp)
+    if day < first_day:
+        return None
+
+    return Transaction(timestamp, day, year_of_day(day), exchange_rates.rate_of_day(day), received, sent)
+
+
+# Header fields of a wallet plus its (lazily parsed) transactions.
+# `complete` is False for streamed records, whose transactions may still raise
+# WalletStreamError when the rest of the file turns out to be undecodable.
+class WalletRecord:
+    __slots__ = ('n_tx', 'total_received', 'transactions', 'complete')
+
+    def __init__(self, n_tx, total_received, transactions, complete=True):
+        self.n_tx = n_tx
+        self.total_received = total_received
+        self.transactions = transactions
+        self.complete = complete
+
+    def exceeds_thresholds(self):
+        return exceeds_thresholds(self.total_received, self.n_tx)
+
+
+# Reads the wallet JSON documents of a wallet store (data/bitcoin/ or its packed shards)
+class JsonWalletSource:
+    def __init__(self, store=None, stream_threshold=None, decoder=None, read_ahead=None, io_threads=None):
+        self.store = store or default_store()
+        self.stream_threshold = stream_threshold if stream_threshold is not None else default_stream_threshold
+        self.read_ahead = read_ahead if read_ahead is not None else default_read_ahead
+        self.io_threads = io_threads if io_threads is not None else default_io_threads
+        # Backend name rather than the decoder itself, so the source stays picklable
+        self.decoder = decoder or wallet_decoder.default_backend
+
+    def has_wallet(self, wallet):
+        return self.store.has_wallet(wallet)
+
+    def listing(self, wallets):
+        return self.store.listing(wallets)
+
+    def fingerprint(self, wallet):
+        return self.store.fingerprint(wallet)
+
+    # Context manager giving a copy of the source that reads `wallets` ahead, in that order,
+    # counting into `stats`; files that will be streamed are left to be read when parsed
+    @contextlib.contextmanager
+    def prefetch(self, wallets, stats):
+        if self.read_ahead <= 0 or self.io_threads <= 0:
+            yield self
+            return
+
+        with Prefetcher(self.store, wallets, self.read_ahead, self.io_threads,
+                        max_size=self.stream_threshold, stats=stats) as store:
+            source = copy.copy(self)
+            source.store = store
+            yield source
+
+    # Return the WalletRecord of the wallet, or None if its document cannot be decoded.
+    # Documents up to the stream threshold are decoded whole even when their header already exceeds the
+    # thresholds: a truncated or corrupt file is a decode error, not a wallet over the thresholds.
+    # Reads and errors are counted into `stats` (a scan_stats.ScanStats).
+    def read_wallet(self, wallet, exchange_rates, thresholds=True, stats=None):
+        stats = stats if stats is not None else ScanStats()
+        start = time.perf_counter()
+        if self.store.size(wallet) > self.stream_threshold:
+            record = self.stream_wallet(wallet, exchange_rates, thresholds, stats)
+            if record is not None:
+                stats.seconds['io'] += time.perf_counter() - start
+                return record
+
+        stats.counters['files_opened'] += 1
+        with self.store.open_wallet(wallet) as wf:
+            data = wf.read()
+        stats.counters['bytes_read'] += len(data)
+        decode_start = time.perf_counter()
+        stats.seconds['io'] += decode_start - start
+
+        try:
+            document = wallet_decoder.get_decoder(self.decoder).decode(data)
+        except wallet_decoder.WalletDecodeError:
+            stats.counters['decode_errors'] += 1
+            print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
+            return None
+        except wallet_decoder.WalletFormatError:
+            stats.counters['format_errors'] += 1
+            print(f"Warning: Unexpected format in JSON for wallet {wallet}. Skipping...")
+            return None
+        finally:
+            stats.seconds['decode'] += time.perf_counter() - decode_start
+
+        transactions = (parse_transaction(tx, wallet, exchange_rates) for tx in document.txs)
+        return WalletRecord(document.n_tx, document.total_received, transactions)
+
+    # Streamed WalletRecord of a large wallet document, or None when its header is not recognized.
+    # With `thresholds`, the transactions of a wallet whose header exceeds them are only read through,
+    # without building them, so that the scanner can still tell a truncated or corrupt document.
+    def stream_wallet(self, wallet, exchange_rates, thresholds=True, stats=None):
+        stats = stats if stats is not None else ScanStats()
+        wf = CountingReader(self.store.open_wallet(wallet), stats)
+        header, txs = wallet_stream.stream_wallet(wf)
+        if header is None:
+            wf.close()
+            return None
+        stats.counters['files_opened'] += 1
+
+        n_tx = header.get('n_tx', 0)
+        total_received = header.get('total_received', 0)
+        if thresholds and exceeds_thresholds(total_received, n_tx):
+            def read_through():
+                with wf:
+                    for _ in txs:
+                        pass
+                yield from ()
+
+            return WalletRecord(n_tx, total_received, read_through(), complete=False)
+
+        def transactions():
+            with wf:
+                for tx in txs:
+                    yield parse_transaction(wallet_decoder.tx_from_dict(tx), wallet, exchange_rates)
+
+        return WalletRecord(n_tx, total_received, transactions(), complete=False)
+
+
+# data/bitcoin_packed/ when `cryptoabuse.py pack` has been run, data/bitcoin/ otherwise. When wallet files
+# of data/bitcoin/ were fetched, re-fetched or deleted since the last pack (one stat per shard directory,
+# see shard_archive.stale), the archives would miss them: the loose files are read instead, with a
+# warning, until `pack` brings the archives up to date. Callers open the store once and pass it on.
+def default_store():
+    if shard_archive.is_packed(packed_wallets_folder):
+        reason = shard_archive.stale(packed_wallets_folder, wallets_folder) if os.path.isdir(wallets_folder) else None
+        if reason is None:
+            return shard_archive.PackedStore(packed_wallets_folder)
+        print(f"Warning: the shard archive folder {packed_wallets_folder} {reason}; reading the wallet files instead "
+              f"(re-run `python src/cryptoabuse.py pack`)")
+    return DirectoryStore(wallets_folder)
+
+
+# The compiled columnar store when `cryptoabuse.py ingest` has been run and the wallet files of `store`
+# (default: default_store()) have not changed since, the JSON documents of `store` otherwise
+def default_source(store=None):
+    import columnar_store
+    store = store or default_store()
+    if columnar_store.exists():
+        reason = columnar_store.stale(store)
+        if reason is None:
+            print(f"Reading transactions from the columnar store in {columnar_store.columnar_folder}")
+            return columnar_store.ColumnarWalletSource(columnar_store.ColumnarStore())
+        print(f"Warning: the columnar store in {columnar_store.columnar_folder} {reason}; reading the JSON "
+              f"documents instead (re-run `python src/cryptoabuse.py ingest` to use it again)")
+    return JsonWalletSource(store)
+
+
+# The wallet catalog when `cryptoabuse.py catalog` has been run, None otherwise. When some shards of
+# `store` (default: default_store()) changed since its last refresh, their wallets are catalogued again
+# first (see wallet_catalog.current), so the filter never drops or keeps a wallet wrongly.
+def default_catalog(store=None):
+    import wallet_catalog
+    if wallet_catalog.exists():
+        print(f"Filtering wallets with the catalog in {wallet_catalog.catalog_path}")
+        return wallet_catalog.current(store or default_store())
+    return None
+
+
+# Base class of the per-figure aggregator plugins.
+# `universe` selects the wallets the aggregator is fed (see CorpusIndex.wallets).
+# Aggregators must be picklable: parallel scans build them in worker processes.
+class Aggregator:
+    name = None
+    universe = 'categorized'
+    uses_listings = False
+
+    def start_wallet(self, ctx):
+        pass
+
+    def add_transaction(self, ctx, tx):
+        pass
+
+    def finish_wallet(self, ctx):
+        pass
+
+    # Fold the partial aggregate of another chunk of wallets into this one
+    def merge(self, other):
+        raise NotImplementedError
+
+    # Undo merge(other) for a partial aggregate previously merged in (incremental scans)
+    def subtract(self, other):
+        raise NotImplementedError
+
+
+# Scans chunks of wallets into fresh copies of the aggregator prototypes.
+# One instance lives in the parent for serial runs and in every worker process for parallel ones.
+# With `listed`, the chunks only hold wallets the source listed as stored, so they are not probed again.
+# Without `thresholds`, wallets over the thresholds are scanned like any other.
+# `slow_log` is the number of slowest wallets each chunk's ScanStats keeps (0: none).
+class WalletScanner:
+    def __init__(self, source, exchange_rates, prototypes, listed=False, listings=None, thresholds=True, slow_log=0):
+        self.source = source
+        self.exchange_rates = exchange_rates
+        self.prototypes = prototypes
+        self.listed = listed
+        self.listings = listings or {}
+        self.thresholds = thresholds
+        self.slow_log = slow_log
+        # Empty aggregator of each class, for scanning streamed wallets into scratch copies
+        self.empty_aggregators = {type(prototype): prototype for prototype in prototypes}
+
+    # Source reading the wallets of `chunk` ahead, in chunk order. Unlisted chunks may
+    # hold missing wallets, which would be requested out of order, so they are not read ahead.
+    def prefetch(self, chunk, stats):
+        return self.source.prefetch([wallet for wallet, _, _ in chunk] if self.listed else [], stats.io)
+
+    # `chunk` is a list of (wallet, aggregator indices, abuse types)
+    def scan_chunk(self, chunk):
+        partials = copy.deepcopy(self.prototypes)
+        processed_wallets = 0
+        missing_rate_days = set()
+        stats = ScanStats(self.slow_log)
+
+        with self.prefetch(chunk, stats) as source:
+            for wallet, indices, abuse_types in chunk:
+                if not self.listed and not source.has_wallet(wallet):
+                    continue
+
+                processed_wallets += 1
+                self.scan_wallet(source, wallet, [partials[i] for i in indices], abuse_types, missing_rate_days, stats)
+
+        return processed_wallets, partials, missing_rate_days, stats
+
+    # Scan each wallet of `chunk` into its own partial aggregates, for the incremental cache.
+    # Returns a list of (wallet, {aggregator index: partial}, missing rate days) and the ScanStats
+    # of the chunk; the partials are None for missing wallets and empty for wallets that contribute nothing.
+    def scan_wallets(self, chunk):
+        results = []
+        stats = ScanStats(self.slow_log)
+        with self.prefetch(chunk, stats) as source:
+            for wallet, indices, abuse_types in chunk:
+                if not self.listed and not source.has_wallet(wallet):
+                    results.append((wallet, None, set()))
+                    continue
+
+                partials = {i: copy.deepcopy(self.prototypes[i]) for i in indices}
+                missing_rate_days = set()
+                if not self.scan_wallet(source, wallet, list(partials.values()), abuse_types, missing_rate_days, stats):
+                    partials = {}
+                results.append((wallet, partials, missing_rate_days))
+        return results, stats
+
+    # Feed one wallet of `source` to `aggregators`, counting into `stats`; returns False when it is skipped
+    def scan_wallet(self, source, wallet, aggregators, abuse_types, missing_rate_days, stats):
+        if not stats.slow_log:
+            return self._scan_wallet(source, wallet, aggregators, abuse_types, missing_rate_days, stats)
+
+        start = time.perf_counter()
+        bytes_read = stats.counters['bytes_read']
+        transactions = stats.counters['transactions']
+        try:
+            return self._scan_wallet(source, wallet, aggregators, abuse_types, missing_rate_days, stats)
+        finally:
+            stats.log_wallet(wallet, time.perf_counter() - start, stats.counters['bytes_read'] - bytes_read,
+                             stats.counters['transactions'] - transactions)
+
+    def _scan_wallet(self, source, wallet, aggregators, abuse_types, missing_rate_days, stats):
+        record = source.read_wallet(wallet, self.exchange_rates, self.thresholds, stats)
+        if record is None:
+            return False
+        if self.thresholds and record.exceeds_thresholds():
+            # A streamed document is read to its end first: a truncated or corrupt one is a decode error
+            if not record.complete:
+                start = time.perf_counter()
+                try:
+                    for _ in record.transactions:
+                        pass
+                except wallet_stream.WalletStreamError:
+                    stats.counters['decode_errors'] += 1
+                    print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
+                    return False
+                finally:
+                    stats.seconds['stream'] += time.perf_counter() - start
+            stats.counters['wallets_over_thresholds'] += 1
+            return False
+        if record.complete:
+            start = time.perf_counter()
+            self.feed(wallet, record, aggregators, abuse_types, missing_rate_days, stats)
+            stats.seconds['aggregate'] += time.perf_counter() - start
+            return True
+
+        # A streamed file can still fail to decode after some transactions were seen:
+        # scan it into scratch aggregators and only merge them once it has been read completely
+        scratch = [copy.deepcopy(self.empty_aggregators[type(aggregator)]) for aggregator in aggregators]
+        scratch_missing_rate_days = set()
+        start = time.perf_counter()
+        try:
+            self.feed(wallet, record, scratch, abuse_types, scratch_missing_rate_days, stats)
+        except wallet_stream.WalletStreamError:
+            stats.counters['decode_errors'] += 1
+            print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
+            return False
+        finally:
+            stats.seconds['stream'] += time.perf_counter() - start
+
+        for aggregator, partial in zip(aggregators, scratch):
+            aggregator.merge(partial)
+        missing_rate_days |= scratch_missing_rate_days
+        return True
+
+    def feed(self, wallet, record, aggregators, abuse_types, missing_rate_days, stats=None):
+        ctx = WalletContext(wallet, abuse_types, record.n_tx, record.total_received, self.listings.get(wallet, ()))
+        for aggregator in aggregators:
+            aggregator.start_wallet(ctx)
+
+        transactions = dropped = 0
+        try:
+            for parsed in record.transactions:
+                if parsed is None:
+                    dropped += 1
+                    continue
+                transactions += 1
+                if (parsed.received or parsed.sent) and not self.exchange_rates.has_rate(parsed.day):
+                    missing_rate_days.add(parsed.day)
+                for aggregator in aggregators:
+                    aggregator.add_transaction(ctx, parsed)
+        finally:
+            if stats is not None:
+                stats.counters['transactions'] += transactions
+                stats.counters['transactions_dropped'] += dropped
+
+        for aggregator in aggregators:
+            aggregator.finish_wallet(ctx)
+
+
+# Scanner of the current worker process, set up once by the pool initializer
+_worker_scanner = None
+
+
+def _init_worker(scanner):
+    global _worker_scanner
+    _worker_scanner = scanner
+
+
+def _call_scanner(method, chunk):
+    return getattr(_worker_scanner, method)(chunk)
+
+
+# Visits every wallet file once and pushes each parsed transaction
+# to all registered aggregators interested in that wallet.
+# With `report_path`, each run ends by writing its JSON report there (see scan_stats.py), naming the
+# `slow_log` slowest wallets. With `checkpoint_path`, runs save their progress there every
+# `checkpoint_interval` seconds and can be resumed from it (see scan_checkpoint.py).
+# Without `source`, wallets are read from `store` (default: default_store()) or its compiled copies.
+class ScanEngine:
+    def __init__(self, index=None, source=None, rates_path=exchange_rates_path, chunk_size=256, catalog=None,
+                 thresholds=True, report_path=None, slow_log=0, checkpoint_path=None, checkpoint_interval=300,
+                 store=None):
+        self.index = index or CorpusIndex()
+        self.store = store or (default_store() if source is None else None)
+        self.catalog = catalog
+        # The default catalog describes the default corpus, so it is only used along with the default
+        # source; it is opened by jobs(), when the wallets are listed
+        self.default_catalog = catalog is None and source is None
+        self.source = source or default_source(self.store)
+        self.rates_path = rates_path
+        self.chunk_size = chunk_size
+        self.thresholds = thresholds  # False: wallets over the thresholds are not skipped
+        self.report_path = report_path
+        self.slow_log = slow_log
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.aggregators = []
+        self.universes = []
+        self.missing_rate_days = set()
+        self.wallet_counts = {}  # wanted / skipped by the catalog / found in the source, set by jobs()
+        self.stats = ScanStats(slow_log)
+        # State of the store when the run started (see wallet_store.store_change), saved with the aggregates
+        self.store_state = None
+
+    def register(self, aggregator, wallets=None):
+        if wallets is None:
+            wallets = self.index.wallets(aggregator.universe)
+        self.aggregators.append(aggregator)
+        self.universes.append(wallets)
+        return aggregator
+
+    # Map every wanted wallet to the indices of the aggregators that should see it
+    def routes(self):
+        routes = {}
+        for i, wallets in enumerate(self.universes):
+            for wallet in wallets:
+                routes.setdefault(wallet, []).append(i)
+        return routes
+
+    # (wallet, aggregator indices, abuse types) of every wanted wallet that the source holds,
+    # in the source's read order (see wallet_store.py); missing wallets are never probed
+    def jobs(self):
+        abuse_types_by_wallet = self.index.abuse_types_by_wallet if self.index.has_categories() else {}
+        routes = self.routes()
+        wallets = sorted(routes)
+        self.wallet_counts = {'wanted': len(wallets), 'skipped_by_catalog': 0}
+        if self.default_catalog:
+            self.catalog = default_catalog(self.store)
+            self.default_catalog = False
+        if self.catalog is not None:
+            # Missing, undecodable and over-threshold wallets are dropped with one indexed query
+            included = self.catalog.included(wallets, thresholds=self.thresholds)
+            print(f"Catalog: skipping {len(wallets) - len(included)} of {len(wallets)} wallets "
+                  f"(missing, undecodable{' or over the thresholds' if self.thresholds else ''})")
+            wallets = [wallet for wallet in wallets if wallet in included]
+            self.wallet_counts['skipped_by_catalog'] = self.wallet_counts['wanted'] - len(wallets)
+
+        listed = self.source.listing(wallets)
+        self.wallet_counts['found'] = len(listed)
+        print(f"Found {len(listed)} of {len(wallets)} wanted wallets")
+        return [(wallet, routes[wallet], abuse_types_by_wallet.get(wallet, ())) for wallet in listed]
+
+    # Split jobs into fixed-size chunks.
+    # The chunking does not depend on the number of workers, so serial and
+    # parallel runs merge exactly the same partial aggregates in the same order.
+    def split(self, jobs):
+        return [jobs[i:i + self.chunk_size] for i in range(0, len(jobs), self.chunk_size)]
+
+    def chunks(self):
+        return self.split(self.jobs())
+
+    # Yield the result of the WalletScanner `method` on every chunk, in chunk order,
+    # computed in `workers` processes when workers > 1. The scanner copies the aggregators right away,
+    # while they are still empty: results are only computed as they are consumed, and the caller may
+    # merge state into the aggregators in between (see run).
+    def map_chunks(self, method, chunks, workers=1):
+        listings = self.index.listings_by_wallet if any(aggregator.uses_listings for aggregator in self.aggregators) else None
+        scanner = WalletScanner(self.source, RateTable(self.rates_path), copy.deepcopy(self.aggregators), listed=True,
+                                listings=listings, thresholds=self.thresholds, slow_log=self.slow_log)
+        return self._map_chunks(scanner, method, chunks, workers)
+
+    @staticmethod
+    def _map_chunks(scanner, method, chunks, workers):
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(scanner,)) as pool:
+                yield from pool.map(partial(_call_scanner, method), chunks)
+        else:
+            yield from map(getattr(scanner, method), chunks)
+
+    # With `resume`, continue from the checkpoint of the same scan instead of starting over
+    # (ValueError when there is none); the checkpoint is removed once the run completes.
+    def run(self, workers=1, resume=False):
+        started = time.time()
+        # Taken first: a wallet file changed during the scan makes the aggregates stale, not wrongly fresh
+        self.store_state = self.store.state() if self.store is not None else None
+        chunks = self.chunks()
+        total_wallets = sum(len(chunk) for chunk in chunks)
+        checkpoint = None
+        if self.checkpoint_path:
+            checkpoint = Checkpoint(self.checkpoint_path, self.checkpoint_interval, scan_key(self, chunks))
+        elif resume:
+            raise ValueError("Resuming needs a checkpoint path")
+
+        self.stats = ScanStats(self.slow_log)
+        state = checkpoint.load() if resume else None
+        chunks_done = state['chunks_done'] if state else 0
+        results = self.map_chunks('scan_chunk', chunks[chunks_done:], workers)
+        processed_wallets = checkpoint.restore(self, state) if state else 0
+        self._merge(results, total_wallets, processed_wallets, chunks_done, checkpoint)
+        if checkpoint is not None:
+            checkpoint.remove()
+        self.write_report(started, workers)
+        return self.aggregators
+
+    # Merge the partial aggregates of every chunk, in chunk order, after the `chunks_done` chunks
+    # (`processed_wallets` wallets) already merged, saving `checkpoint` whenever it is due
+    def _merge(self, results, total_wallets, processed_wallets=0, chunks_done=0, checkpoint=None):
+        reported = processed_wallets // 500
+        for processed, partials, missing_rate_days, chunk_stats in results:
+            for aggregator, partial in zip(self.aggregators, partials):
+                aggregator.merge(partial)
+            self.missing_rate_days |= missing_rate_days
+            self.stats.merge(chunk_stats)
+            chunks_done += 1
+
+            # Print progress after every 500 wallets processed
+            processed_wallets += processed
+            if processed_wallets // 500 > reported:
+                reported = processed_wallets // 500
+                print(f"Processed {processed_wallets}/{total_wallets} wallets...")
+
+            if checkpoint is not None and checkpoint.due():
+                checkpoint.save(self, chunks_done, processed_wallets)
+
+        print(f"Processed {processed_wallets}/{total_wallets} wallets...")
+        self.wallet_counts['scanned'] = processed_wallets
+        report_missing_rates(self.missing_rate_days)
+        self.stats.report()
+
+    # Write the JSON report of the run that started at `started` (a time.time()) to report_path
+    def write_report(self, started, workers, **extra):
+        if not self.report_path:
+            return
+        finished = time.time()
+        write_report(self.report_path, dict({
+            'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(started)),
+            'seconds': round(finished - started, 3),
+            'workers': workers,
+            'source': type(self.source).__name__,
+            'aggregators': [aggregator.name for aggregator in self.aggregators],
+            'thresholds': self.thresholds,
+            'wallets': self.wallet_counts,
+            'missing_rate_days': len(self.missing_rate_days),
+        }, **extra, **self.stats.as_dict()))
+        print(f"Wrote the scan report to {self.report_path}")
+
+
+# Bumped whenever the stored aggregator classes change shape
+aggregates_version = 5
+
+
+# Persist the aggregators of a combined scan so each plot script can reuse them, with the state of the
+# wallet store they were computed from (see ScanEngine.store_state; None when it cannot be known)
+def save_aggregates(aggregators, path=aggregates_path, store_state=None):
+    with open(path, 'wb') as f:
+        pickle.dump({'version': aggregates_version, 'store': store_state,
+                     'aggregates': {aggregator.name: aggregator for aggregator in aggregators}}, f)
+
+
+# {name: aggregate} stored at `path` when they were saved by this version from the wallet files that
+# `store` (default: default_store()) holds now, None otherwise (the reason is printed). Checking costs
+# one stat per shard (see wallet_store.store_change).
+def stored_aggregates(path=aggregates_path, store=None):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        stored = pickle.load(f)
+    if stored.get('version') != aggregates_version or 'store' not in stored:
+        print(f"Ignoring {path}: written by an older version, re-run `python src/cryptoabuse.py scan`")
+        return None
+    if stored['store'] is None:
+        print(f"Note: {path} does not record the wallet files it was computed from; it is used unchecked")
+    else:
+        reason = store_change(stored['store'], store or default_store())
+        if reason is not None:
+            print(f"Ignoring {path}: it {reason}, re-run `python src/cryptoabuse.py scan`")
+            return None
+    return stored['aggregates']
+
+
+# Return the aggregate of `aggregator_class`, from the stored combined scan when available and current,
+# then from the daily cube of its universe for aggregators that have a from_cube(), otherwise
+# by scanning the corpus (`store`, default: default_store()) for this aggregator alone
+def load_aggregate(aggregator_class, path=aggregates_path, workers=1, store=None):
+    store = store or default_store()
+    stored = stored_aggregates(path, store)
+    if stored is not None and aggregator_class.name in stored:
+        print(f"Using aggregates stored in {path}")
+        return stored[aggregator_class.name]
+
+    import daily_cube
+    if hasattr(aggregator_class, 'from_cube') and daily_cube.exists(aggregator_class.universe):
+        reason = daily_cube.stale(aggregator_class.universe, store)
+        if reason is None:
+            print(f"Rolling up the {aggregator_class.universe} cube in {daily_cube.cube_folder}")
+            return aggregator_class.from_cube(daily_cube.Cube.load(aggregator_class.universe))
+        print(f"Ignoring the {aggregator_class.universe} cube in {daily_cube.cube_folder}: it {reason}, "
+              f"re-run `python src/cryptoabuse.py cube`")
+
+    engine = ScanEngine(store=store)
+    aggregator = engine.register(aggregator_class())
+    engine.run(workers)
+    return aggregator
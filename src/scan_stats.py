@@ -0,0 +1,104 @@
+import heapq
+import json
+import os
+
+from prefetch import IOStats
+
+# Instrumentation of the scan loop. Each chunk counts into its own ScanStats in the worker process
+# and the engine sums them, like the aggregators. Everything is updated once per wallet (the
+# transaction counts are summed locally first), so the scan pays a few clock reads per wallet.
+#
+# Counters:
+#   files_opened             - wallet documents opened (served from the read-ahead buffer or not)
+#   bytes_read               - bytes of them read by the scanner
+#   decode_errors            - documents that are not valid JSON
+#   format_errors            - valid JSON, but not a wallet document
+#   wallets_over_thresholds  - wallets skipped for their total_received or n_tx
+#   transactions             - transactions fed to the aggregators
+#   transactions_dropped     - transactions before 2012 or without a time
+# Timers, in seconds summed over the worker processes:
+#   io         - opening and reading documents (waits on the read-ahead included)
+#   decode     - JSON parsing of whole documents
+#   aggregate  - parsing the transactions of a decoded document and feeding them to the aggregators
+#   stream     - the same for streamed documents, whose reading and parsing happen as they are fed
+counter_names = ('files_opened', 'bytes_read', 'decode_errors', 'format_errors', 'wallets_over_thresholds',
+                 'transactions', 'transactions_dropped')
+timer_names = ('io', 'decode', 'aggregate', 'stream')
+
+
+class ScanStats:
+    def __init__(self, slow_log=0):
+        self.counters = dict.fromkeys(counter_names, 0)
+        self.seconds = dict.fromkeys(timer_names, 0.0)
+        self.io = IOStats()      # read-ahead (see prefetch.py)
+        self.slow_log = slow_log  # number of slowest wallets to keep, 0 for none
+        self.slow_wallets = []    # min-heap of (seconds, wallet, bytes read, transactions)
+
+    # Keep the wallet if it is among the slow_log slowest seen so far
+    def log_wallet(self, wallet, seconds, bytes_read, transactions):
+        self._keep((seconds, wallet, bytes_read, transactions))
+
+    def _keep(self, entry):
+        if len(self.slow_wallets) < self.slow_log:
+            heapq.heappush(self.slow_wallets, entry)
+        elif self.slow_wallets and entry > self.slow_wallets[0]:
+            heapq.heapreplace(self.slow_wallets, entry)
+
+    def merge(self, other):
+        for name, value in other.counters.items():
+            self.counters[name] += value
+        for name, value in other.seconds.items():
+            self.seconds[name] += value
+        self.io.merge(other.io)
+        for entry in other.slow_wallets:
+            self._keep(entry)
+
+    def slowest(self):
+        return sorted(self.slow_wallets, reverse=True)
+
+    def report(self):
+        counters = self.counters
+        print(f"Scan: opened {counters['files_opened']} wallet files ({counters['bytes_read'] / 2 ** 20:.1f} MiB), "
+              f"{counters['decode_errors'] + counters['format_errors']} unreadable, "
+              f"{counters['wallets_over_thresholds']} over the thresholds; {counters['transactions']} transactions, "
+              f"{counters['transactions_dropped']} dropped (before 2012 or without a time)")
+        print("Time: " + ', '.join(f"{name} {seconds:.2f} s" for name, seconds in self.seconds.items()))
+        self.io.report()
+        for seconds, wallet, bytes_read, transactions in self.slowest()[:5]:
+            print(f"Slow wallet {wallet}: {seconds:.3f} s, {bytes_read / 2 ** 20:.1f} MiB, {transactions} transactions")
+
+    def as_dict(self):
+        return {'counters': dict(self.counters), 'phase_seconds': {name: round(value, 6) for name, value in self.seconds.items()},
+                'read_ahead': {name: getattr(self.io, name) for name in self.io.__slots__},
+                'slow_wallets': [{'wallet': wallet, 'seconds': round(seconds, 6), 'bytes_read': bytes_read,
+                                  'transactions': transactions}
+                                 for seconds, wallet, bytes_read, transactions in self.slowest()]}
+
+
+# Binary file wrapper counting the bytes read into `stats`, for documents that are streamed
+class CountingReader:
+    def __init__(self, wf, stats):
+        self.wf = wf
+        self.stats = stats
+
+    def read(self, size=-1):
+        data = self.wf.read(size)
+        self.stats.counters['bytes_read'] += len(data)
+        return data
+
+    def close(self):
+        self.wf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wf.close()
+
+
+def write_report(path, report):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=4)
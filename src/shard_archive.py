@@ -0,0 +1,248 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from collections import defaultdict
+
+from wallet_store import open_store, parse_sharding, read_layout, store_change, write_layout
+
+# Packed layout: the wallet documents of each shard (see wallet_store.py) go into one <shard>.shard file:
+#
+#   magic | zlib-compressed wallet documents... | zlib-compressed JSON index | trailer
+#
+# The index maps each wallet to [offset, compressed length, size, crc32 of the document], and the
+# trailer holds the index offset and length. Readers memory-map the shard and parse the index once,
+# so finding and reading a wallet costs no further syscalls.
+magic = b'CAWSHRD1'
+trailer = struct.Struct('<QQ8s')  # index offset, index length, magic
+
+
+def is_packed(folder):
+    return read_layout(folder)['layout'] == 'packed'
+
+
+# Pack the store in `folder` into shard archives in `output`, sharded like the source unless
+# `sharding` is given. Shards none of whose wallets changed since they were written are kept.
+# The state of the source (see wallet_store.store_change) is recorded in layout.json, so readers
+# can tell cheaply whether the wallet files changed since.
+def pack(folder, output, level=6, force=False, sharding=None):
+    source = open_store(folder)
+    # Taken first: a wallet file changed while packing makes the archives stale, not wrongly fresh
+    state = source.state()
+    sharding = parse_sharding(sharding) if sharding else source.sharding
+    if read_layout(output)['sharding'] != sharding.spec:
+        force = True  # existing shards were cut differently
+    os.makedirs(output, exist_ok=True)
+
+    shards = _entries_by_shard(source, sharding)
+
+    written = 0
+    kept = 0
+    for name in sorted(shards):
+        entries = shards[name]
+        shard_path = os.path.join(output, f'{name}.shard')
+
+        if not force and _up_to_date(shard_path, entries):
+            kept += 1
+            continue
+
+        write_shard(shard_path, source, [wallet for wallet, _ in entries], level)
+        written += 1
+        if written % 100 == 0:
+            print(f"Packed {written} shards...")
+
+    # Drop shards that no longer hold any wallet
+    removed = 0
+    for file_name in os.listdir(output):
+        if file_name.endswith('.shard') and file_name[:-len('.shard')] not in shards:
+            os.remove(os.path.join(output, file_name))
+            removed += 1
+
+    write_layout(output, 'packed', sharding.spec, version=1, source=os.path.abspath(folder), store=state)
+
+    print(f"Packed {folder} into {output}: {written} shards written, {kept} up to date, {removed} removed")
+
+
+# {shard: [(wallet, mtime_ns)]} of the wallets of `store` under `sharding`
+def _entries_by_shard(store, sharding):
+    shards = defaultdict(list)
+    for wallet, _, _, mtime_ns in store.entries():
+        shards[sharding.shard(wallet)].append((wallet, mtime_ns))
+    return shards
+
+
+# Why the archives in `output` no longer match the wallet files in `folder` they were packed from,
+# None when they still do: one stat per shard directory, nothing is read from the archives
+def stale(output, folder):
+    return store_change(read_layout(output).get('store'), open_store(folder))
+
+
+def _up_to_date(shard_path, entries):
+    if not os.path.exists(shard_path):
+        return False
+    if os.stat(shard_path).st_mtime_ns < max(mtime_ns for _, mtime_ns in entries):
+        return False
+    return set(ShardArchive(shard_path).index) == {wallet for wallet, _ in entries}
+
+
+# Write the documents of `wallets` (any order), read from `source` (a wallet store), into one shard archive
+def write_shard(shard_path, source, wallets, level=6):
+    index = {}
+    temporary_path = shard_path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(magic)
+        for wallet in sorted(wallets):
+            with source.open_wallet(wallet) as wf:
+                document = wf.read()
+            record = zlib.compress(document, level)
+            index[wallet] = [f.tell(), len(record), len(document), zlib.crc32(document)]
+            f.write(record)
+
+        index_offset = f.tell()
+        index_record = zlib.compress(json.dumps(index).encode())
+        f.write(index_record)
+        f.write(trailer.pack(index_offset, len(index_record), magic))
+    os.replace(temporary_path, shard_path)
+
+
+# Read-only, memory-mapped view of one shard archive
+class ShardArchive:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        index_offset, index_length, end_magic = trailer.unpack_from(self.map, len(self.map) - trailer.size)
+        if self.map[:len(magic)] != magic or end_magic != magic:
+            raise ValueError(f"{path} is not a wallet shard archive")
+        self.index = json.loads(zlib.decompress(self.map[index_offset:index_offset + index_length]))
+
+    # Whole wallet document
+    def read(self, wallet):
+        offset, length, _, _ = self.index[wallet]
+        return zlib.decompress(self.map[offset:offset + length])
+
+    # File-like object decompressing the wallet document on demand (for header checks and streaming)
+    def open(self, wallet):
+        offset, length, _, _ = self.index[wallet]
+        return RecordReader(memoryview(self.map)[offset:offset + length])
+
+
+# Minimal binary file object over one compressed record
+class RecordReader:
+    def __init__(self, record, block_size=64 * 1024):
+        self.record = record
+        self.block_size = block_size
+        self.pos = 0
+        self.decompressor = zlib.decompressobj()
+
+    def read(self, size=-1):
+        chunks = []
+        while size != 0:
+            if self.decompressor.unconsumed_tail:
+                data = self.decompressor.unconsumed_tail
+            elif self.pos < len(self.record):
+                data = self.record[self.pos:self.pos + self.block_size]
+                self.pos += len(data)
+            else:
+                break
+
+            chunk = self.decompressor.decompress(data, max(size, 0))
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(chunks)
+
+    def close(self):
+        self.record = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Wallet store over a folder of shard archives (see wallet_store.DirectoryStore for the interface)
+class PackedStore:
+    def __init__(self, folder):
+        self.folder = folder
+        self.sharding = parse_sharding(read_layout(folder)['sharding'])
+        self._shards = {}
+
+    # Only the folder travels to worker processes; they map the shards themselves
+    def __getstate__(self):
+        return {'folder': self.folder}
+
+    def __setstate__(self, state):
+        self.__init__(state['folder'])
+
+    # The ShardArchive that would hold `wallet`, or None
+    def shard(self, wallet):
+        name = self.sharding.shard(wallet)
+        if name not in self._shards:
+            path = os.path.join(self.folder, f'{name}.shard')
+            self._shards[name] = ShardArchive(path) if os.path.exists(path) else None
+        return self._shards[name]
+
+    def has_wallet(self, wallet):
+        shard = self.shard(wallet)
+        return shard is not None and wallet in shard.index
+
+    def size(self, wallet):
+        return self._entry(wallet)[2]
+
+    def open_wallet(self, wallet):
+        self._entry(wallet)
+        return self.shard(wallet).open(wallet)
+
+    # Document size and checksum, recorded at packing time
+    def fingerprint(self, wallet):
+        if not self.has_wallet(wallet):
+            return None
+        _, _, size, crc = self._entry(wallet)
+        return [size, crc]
+
+    # Wanted wallets in shard and then record order, so each shard is read front to back
+    def listing(self, wallets):
+        wanted_by_shard = defaultdict(list)
+        for wallet in wallets:
+            wanted_by_shard[self.sharding.shard(wallet)].append(wallet)
+
+        listed = []
+        for name in sorted(wanted_by_shard):
+            shard = self.shard(wanted_by_shard[name][0])
+            if shard is None:
+                continue
+            found = [(shard.index[wallet][0], wallet) for wallet in set(wanted_by_shard[name]) if wallet in shard.index]
+            listed.extend(wallet for _, wallet in sorted(found))
+        return listed
+
+    # The state of the wallet files the archives were packed from (see pack), so that copies built from
+    # the archives or from the files compare alike; the mtimes of the archives when none was recorded
+    def state(self):
+        recorded = read_layout(self.folder).get('store')
+        if recorded:
+            return recorded
+        return {'sharding': self.sharding.spec,
+                'shards': {file_name[:-len('.shard')]: os.stat(os.path.join(self.folder, file_name)).st_mtime_ns
+                           for file_name in os.listdir(self.folder) if file_name.endswith('.shard')}}
+
+    def entries(self, shards=None):
+        if shards is None:
+            shards = [file_name[:-len('.shard')] for file_name in os.listdir(self.folder) if file_name.endswith('.shard')]
+        for name in sorted(shards):
+            path = os.path.join(self.folder, f'{name}.shard')
+            if not os.path.exists(path):
+                continue
+            shard = ShardArchive(path)
+            mtime_ns = os.stat(path).st_mtime_ns
+            for wallet in sorted(shard.index):
+                yield wallet, f'{path}:{wallet}', shard.index[wallet][2], mtime_ns
+
+    def _entry(self, wallet):
+        shard = self.shard(wallet)
+        if shard is None or wallet not in shard.index:
+            raise FileNotFoundError(f"No wallet {wallet} in {self.folder}")
+        return shard.index[wallet]
@@ -0,0 +1,385 @@
+import hashlib
+import json
+import os
+import random
+import shutil
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from exchange_rates import day_of_date
+from scan_engine import n_tx_threshold, total_received_threshold
+from wallet_store import DirectoryStore, parse_sharding, write_layout
+
+# Synthetic stand-in for the data/ corpus, for contractors, CI and scale tests: Abuses.json,
+# wallets_by_abuse_type.json (+ its reverse index), benign.txt, the exchange rates and a
+# bitcoin/<shard>/<wallet>.json tree in the blockchain.info rawaddr schema the loaders read.
+#
+# Everything is a function of the seed: each wallet draws from its own generator seeded with
+# (seed, wallet index), so the output does not depend on the number of workers or on the order
+# files are written in. Wallet indices 0..wallets-1 are the listed abuse wallets, the next
+# `benign` indices the benign ones. Each wallet file is one of:
+#   normal       - a heavy-tailed (Pareto) number of transactions, a few shared with other wallets
+#   whale        - a header over n_tx_threshold or total_received_threshold (see scan_engine.py)
+#   corrupt      - truncated JSON, a non-wallet JSON value or an empty file
+#   missing      - listed, but without a file (as wallets the fetch could not download)
+#
+# Point the scripts at a generated corpus with CRYPTOABUSE_DATA=<output>.
+
+# The exchange rates shipped in the repository's data/ folder, copied into every corpus. Not
+# scan_engine.exchange_rates_path: with CRYPTOABUSE_DATA already pointing at the output, that is the
+# file being written.
+rates_path = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data',
+                                           'BitcoinExchangeRates.json'))
+
+# (name, share of the abuse wallets, has an "All" list)
+sources = [
+    ('BitcoinAbuse', 0.55, True),
+    ('CheckBitcoinAddress', 0.2, True),
+    ('BitcoinWhosWho', 0.15, True),
+    ('CryptoScamDB', 0.1, False),
+]
+# (abuse type, weight)
+abuse_types = [
+    ('Ransomware', 0.3),
+    ('Blackmail scam', 0.25),
+    ('Sextortion', 0.15),
+    ('Darknet market', 0.1),
+    ('Bitcoin tumbler', 0.07),
+    ('Ponzi scheme', 0.05),
+    ('Phishing', 0.05),
+    ('Other', 0.03),
+]
+
+# Timestamps span a year before first_year (dropped by the scans) to the last day with a rate
+first_time = day_of_date('2011-01-01') * 86400
+last_time = day_of_date('2024-08-03') * 86400 + 86399
+
+base58_alphabet = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+bech32_alphabet = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+
+# Transactions shared between two generated wallets: wallet i pays wallet (i + offset) % n
+shared_links = 2
+
+
+class CorpusOptions:
+    def __init__(self, wallets=10_000, benign=None, seed=0, multi_category=0.1, uncategorized=0.05,
+                 whales=0.001, corrupt=0.002, missing=0.01, shared=0.05, tail=1.2, max_tx=5_000, whale_txs=1_000):
+        self.wallets = wallets
+        self.benign = wallets if benign is None else benign
+        self.seed = seed
+        self.multi_category = multi_category  # share of abuse wallets listed under 2-3 abuse types
+        self.uncategorized = uncategorized    # share only in "All" lists, under no abuse type
+        self.whales = whales
+        self.corrupt = corrupt
+        self.missing = missing
+        self.shared = shared                  # chance of each possible shared transaction
+        self.tail = tail                      # Pareto shape of n_tx: lower is heavier
+        self.max_tx = max_tx
+        self.whale_txs = whale_txs            # transactions stored in a whale file (its header says more)
+        rng = random.Random(f'{seed}:offsets')
+        total = self.wallets + self.benign
+        self.offsets = [1 + rng.randrange(total - 1) for _ in range(shared_links)] if total > 1 else []
+
+    @property
+    def total(self):
+        return self.wallets + self.benign
+
+
+def address(seed, index):
+    digest = hashlib.blake2b(f'{seed}:{index}'.encode(), digest_size=32).digest()
+    number = int.from_bytes(digest, 'big')
+    kind = digest[0] % 10
+    if kind == 0:
+        chars = []
+        for _ in range(39):
+            number, digit = divmod(number, 32)
+            chars.append(bech32_alphabet[digit])
+        return 'bc1q' + ''.join(chars)
+    chars = []
+    for _ in range(33):
+        number, digit = divmod(number, 58)
+        chars.append(base58_alphabet[digit])
+    return ('3' if kind <= 3 else '1') + ''.join(chars)
+
+
+def wallet_kind(options, index):
+    draw = random.Random(f'{options.seed}:kind:{index}').random()
+    for kind, share in (('missing', options.missing), ('corrupt', options.corrupt), ('whale', options.whales)):
+        if draw < share:
+            return kind
+        draw -= share
+    return 'normal'
+
+
+# (abuse type bitmask, source bitmask) of abuse wallet `index`; bits index abuse_types and sources
+def listing(options, index):
+    rng = random.Random(f'{options.seed}:listing:{index}')
+    source_mask = 1 << _weighted(rng, [share for _, share, _ in sources])
+    if rng.random() < 0.15:
+        source_mask |= 1 << _weighted(rng, [share for _, share, _ in sources])
+    if rng.random() < options.uncategorized:
+        # Only in "All" lists: give it a source that has one
+        return 0, source_mask & sum(1 << bit for bit, (_, _, has_all) in enumerate(sources) if has_all) or 1
+    type_mask = 1 << _weighted(rng, [weight for _, weight in abuse_types])
+    if rng.random() < options.multi_category:
+        for _ in range(rng.choice((1, 1, 2))):
+            type_mask |= 1 << _weighted(rng, [weight for _, weight in abuse_types])
+    return type_mask, source_mask
+
+
+def _weighted(rng, weights):
+    draw = rng.random() * sum(weights)
+    for i, weight in enumerate(weights):
+        if draw < weight:
+            return i
+        draw -= weight
+    return len(weights) - 1
+
+
+def _hex(rng, bits):
+    return f'{rng.getrandbits(bits):0{bits // 4}x}'
+
+
+def _output(rng, addr, value, n, tx_index):
+    return {'type': 0, 'spent': rng.random() < 0.7, 'value': value, 'spending_outpoints': [], 'n': n,
+            'tx_index': tx_index, 'script': f'76a914{_hex(rng, 160)}88ac', 'addr': addr}
+
+
+def _input(rng, addr, value, n):
+    return {'sequence': 4294967295, 'witness': '', 'script': _hex(rng, 256), 'index': n,
+            'prev_out': {'addr': addr, 'n': rng.randrange(4), 'script': f'76a914{_hex(rng, 160)}88ac',
+                         'spending_outpoints': [], 'spent': True, 'tx_index': rng.getrandbits(53),
+                         'type': 0, 'value': value}}
+
+
+def _amount(rng):
+    return min(int(rng.lognormvariate(15.4, 2.2)) + 546, 2_100_000_000_000_000)
+
+
+# One transaction paying `receivers` from `senders` ((address, satoshis) lists), with change
+def _transaction(rng, time, senders, receivers):
+    tx_index = rng.getrandbits(53)
+    inputs = [_input(rng, addr, value, n) for n, (addr, value) in enumerate(senders)]
+    out = [_output(rng, addr, value, n, tx_index) for n, (addr, value) in enumerate(receivers)]
+    if rng.random() < 0.02:
+        out.append({'type': 0, 'spent': False, 'value': 0, 'spending_outpoints': [], 'n': len(out),
+                    'tx_index': tx_index, 'script': f'6a{_hex(rng, 160)}'})  # OP_RETURN, no address
+    size = 10 + 148 * len(inputs) + 34 * len(out)
+    return {'hash': _hex(rng, 256), 'ver': rng.choice((1, 2)), 'vin_sz': len(inputs), 'vout_sz': len(out),
+            'size': size, 'weight': 4 * size, 'fee': max(sum(value for _, value in senders)
+                                                         - sum(value for _, value in receivers), 0),
+            'relayed_by': '0.0.0.0', 'lock_time': 0, 'tx_index': tx_index, 'double_spend': False, 'time': time,
+            'block_index': None, 'block_height': 150_000 + (time - first_time) // 600, 'inputs': inputs, 'out': out}
+
+
+def _counterparty(rng):
+    return address('counterparty', rng.getrandbits(40))
+
+
+# The transaction between wallet `index` and wallet (index + offset) % total, or None when the
+# pair does not share one; both wallets generate the same one
+def _shared_transaction(options, index, k):
+    rng = random.Random(f'{options.seed}:shared:{index}:{k}')
+    if rng.random() >= options.shared:
+        return None
+    payee = (index + options.offsets[k]) % options.total
+    value = _amount(rng)
+    change = rng.randrange(value) if rng.random() < 0.5 else 0
+    fee = rng.randrange(1_000, 100_000)
+    payer_address = address(options.seed, index)
+    receivers = [(address(options.seed, payee), value)] + ([(payer_address, change)] if change else [])
+    return _transaction(rng, rng.randint(first_time, last_time), [(payer_address, value + change + fee)], receivers)
+
+
+# blockchain.info rawaddr document of wallet `index`
+def wallet_document(options, index, kind):
+    rng = random.Random(f'{options.seed}:wallet:{index}')
+    wallet = address(options.seed, index)
+    n_tx = min(int(rng.paretovariate(options.tail)), options.max_tx)
+    if kind == 'whale':
+        n_tx = options.whale_txs
+
+    start = rng.randint(first_time, last_time)
+    span = min(int(rng.expovariate(1 / 200) * 86400 * (1 + n_tx ** 0.5)), last_time - start)
+    txs = []
+    for _ in range(n_tx):
+        time = start + rng.randint(0, span)
+        roll = rng.random()
+        if roll < 0.55:
+            senders = [(_counterparty(rng), 0) for _ in range(rng.choice((1, 1, 1, 2, 3)))]
+            value = _amount(rng)
+            receivers = [(wallet, value)] + [(_counterparty(rng), _amount(rng)) for _ in range(rng.choice((0, 1, 1)))]
+            paid = sum(amount for _, amount in receivers) + rng.randrange(1_000, 50_000)
+            senders = [(addr, paid // len(senders)) for addr, _ in senders]
+        else:
+            value = _amount(rng)
+            senders = [(wallet, value)] + [(_counterparty(rng), _amount(rng)) for _ in range(rng.choice((0, 0, 1)))]
+            change = rng.randrange(value) if rng.random() < 0.3 else 0
+            paid = sum(amount for _, amount in senders) - change - rng.randrange(1_000, 50_000)
+            receivers = [(_counterparty(rng), max(paid, 546))] + ([(wallet, change)] if change else [])
+        txs.append(_transaction(rng, time, senders, receivers))
+
+    for k, offset in enumerate(options.offsets):
+        paid = _shared_transaction(options, index, k)
+        if paid is not None:
+            txs.append(paid)
+        received = _shared_transaction(options, (index - offset) % options.total, k)
+        if received is not None:
+            txs.append(received)
+
+    # Newest first with the running balance, like the API
+    txs.sort(key=lambda tx: tx['time'], reverse=True)
+    total_received = total_sent = 0
+    for tx in reversed(txs):
+        received = sum(output['value'] for output in tx['out'] if output.get('addr') == wallet)
+        sent = sum(input_tx['prev_out']['value'] for input_tx in tx['inputs'] if input_tx['prev_out']['addr'] == wallet)
+        total_received += received
+        total_sent += sent
+        tx['result'] = received - sent
+        tx['balance'] = total_received - total_sent
+
+    n_tx = len(txs)
+    if kind == 'whale':
+        if rng.random() < 0.5:
+            n_tx = n_tx_threshold + int(rng.paretovariate(1.0) * 10_000)
+        else:
+            total_received = total_received_threshold + int(rng.paretovariate(1.0) * 1e12)
+    return {'hash160': _hex(rng, 160), 'address': wallet, 'n_tx': n_tx, 'n_unredeemed': rng.randrange(n_tx + 1),
+            'total_received': total_received, 'total_sent': total_sent,
+            'final_balance': total_received - total_sent, 'txs': txs}
+
+
+def corrupt_document(options, index):
+    rng = random.Random(f'{options.seed}:wallet:{index}')
+    damage = rng.randrange(3)
+    if damage == 0:
+        data = json.dumps(wallet_document(options, index, 'normal')).encode()
+        return data[:rng.randrange(1, max(len(data) - 1, 2))]  # truncated download
+    if damage == 1:
+        return json.dumps({'error': 'Rate limited'} if rng.random() < 0.5 else 'Invalid address').encode()
+    return b''
+
+
+# Runs in a worker: write the files of wallets first..last-1 into `folder`.
+# Returns {'files', 'bytes', 'txs', 'whale', 'corrupt', 'missing'}.
+def write_wallets(options, folder, sharding, first, last):
+    store = DirectoryStore(folder, sharding)
+    created = set()
+    counts = dict.fromkeys(('files', 'bytes', 'txs', 'whale', 'corrupt', 'missing'), 0)
+    for index in range(first, last):
+        kind = wallet_kind(options, index)
+        if kind in ('whale', 'corrupt', 'missing'):
+            counts[kind] += 1
+        if kind == 'missing':
+            continue
+        if kind == 'corrupt':
+            data = corrupt_document(options, index)
+        else:
+            document = wallet_document(options, index, kind)
+            counts['txs'] += len(document['txs'])
+            data = json.dumps(document).encode()
+
+        path = store.path(address(options.seed, index))
+        shard_folder = os.path.dirname(path)
+        if shard_folder not in created:
+            os.makedirs(shard_folder, exist_ok=True)
+            created.add(shard_folder)
+        with open(path, 'wb') as f:
+            f.write(data)
+        counts['files'] += 1
+        counts['bytes'] += len(data)
+    return counts
+
+
+def _write_json_lists(path, lists, seed):
+    with open(path, 'w') as f:
+        f.write('{')
+        for i, (name, indices) in enumerate(lists):
+            f.write(f'{", " if i else ""}{json.dumps(name)}: [')
+            f.write(', '.join(json.dumps(address(seed, index)) for index in indices))
+            f.write(']')
+        f.write('}')
+
+
+# Abuses.json, wallets_by_abuse_type.json, wallet_abuse_types.json and benign.txt
+def write_lists(options, output):
+    type_masks = array('H')
+    by_list = {}  # (source bit, type bit or None for "All") -> wallet indices
+    for index in range(options.wallets):
+        type_mask, source_mask = listing(options, index)
+        type_masks.append(type_mask)
+        for source_bit, (_, _, has_all) in enumerate(sources):
+            if not source_mask >> source_bit & 1:
+                continue
+            if has_all:
+                by_list.setdefault((source_bit, None), array('l')).append(index)
+            for type_bit in range(len(abuse_types)):
+                if type_mask >> type_bit & 1:
+                    by_list.setdefault((source_bit, type_bit), array('l')).append(index)
+
+    with open(os.path.join(output, 'Abuses.json'), 'w') as f:
+        f.write('{')
+        for source_bit, (source, _, _) in enumerate(sources):
+            keys = [key for key in [(source_bit, None)] + [(source_bit, bit) for bit in range(len(abuse_types))]
+                    if key in by_list]
+            f.write(f'{", " if source_bit else ""}{json.dumps(source)}: ')
+            f.write('{')
+            for i, key in enumerate(keys):
+                name = 'All' if key[1] is None else abuse_types[key[1]][0]
+                f.write(f'{", " if i else ""}{json.dumps(name)}: [')
+                f.write(', '.join(json.dumps(address(options.seed, index)) for index in by_list[key]))
+                f.write(']')
+            f.write('}')
+        f.write('}')
+
+    # As AbuseToPerCategory.py would write them (abuse types sorted by name for the bitmasks)
+    names = sorted(name for name, _ in abuse_types)
+    bit_of_name = {name: names.index(name) for name, _ in abuse_types}
+    _write_json_lists(os.path.join(output, 'wallets_by_abuse_type.json'),
+                      [(name, [index for index in range(options.wallets) if type_masks[index] >> bit & 1])
+                       for bit, (name, _) in enumerate(abuse_types)], options.seed)
+    with open(os.path.join(output, 'wallet_abuse_types.json'), 'w') as f:
+        f.write(f'{{"abuse_types": {json.dumps(names)}, "wallets": {{')
+        first = True
+        for index, type_mask in enumerate(type_masks):
+            if not type_mask:
+                continue
+            mask = sum(1 << bit_of_name[name] for bit, (name, _) in enumerate(abuse_types) if type_mask >> bit & 1)
+            f.write(f'{"" if first else ", "}{json.dumps(address(options.seed, index))}: {mask}')
+            first = False
+        f.write('}}')
+
+    with open(os.path.join(output, 'benign.txt'), 'w') as f:
+        for index in range(options.wallets, options.total):
+            f.write(address(options.seed, index) + '\n')
+
+
+# Generate the corpus of `options` (a CorpusOptions) into the data folder `output`
+def generate(output, options, workers=1, sharding='prefix:3', chunk_size=2_000, force=False):
+    if os.path.exists(os.path.join(output, 'Abuses.json')) and not force:
+        raise ValueError(f"{output} already holds a corpus (Abuses.json): pass --force to overwrite it")
+    folder = os.path.join(output, 'bitcoin')
+    if force and os.path.exists(folder):
+        shutil.rmtree(folder)
+    os.makedirs(folder, exist_ok=True)
+    write_layout(folder, 'directory', parse_sharding(sharding).spec)
+    if rates_path != os.path.abspath(os.path.join(output, 'BitcoinExchangeRates.json')):
+        shutil.copyfile(rates_path, os.path.join(output, 'BitcoinExchangeRates.json'))
+
+    write_lists(options, output)
+    print(f"Wrote the lists of {options.wallets} abuse and {options.benign} benign wallets to {output}")
+
+    totals = dict.fromkeys(('files', 'bytes', 'txs', 'whale', 'corrupt', 'missing'), 0)
+    chunks = [(first, min(first + chunk_size, options.total)) for first in range(0, options.total, chunk_size)]
+    with ProcessPoolExecutor(max_workers=max(workers, 1)) as pool:
+        futures = [pool.submit(write_wallets, options, folder, sharding, first, last) for first, last in chunks]
+        for done, future in enumerate(futures, 1):
+            for key, value in future.result().items():
+                totals[key] += value
+            if done % 10 == 0 or done == len(futures):
+                print(f"Generated {chunks[done - 1][1]}/{options.total} wallets...")
+
+    with open(os.path.join(output, 'synthetic.json'), 'w') as f:
+        json.dump({'options': vars(options), 'sharding': sharding, 'written': totals}, f, indent=4)
+    print(f"Wrote {totals['files']} wallet files ({totals['bytes'] / 1e6:.1f} MB, {totals['txs']} transactions) "
+          f"to {folder}: {totals['whale']} whales, {totals['corrupt']} corrupt, {totals['missing']} listed without a file")
@@ -0,0 +1,224 @@
+import json
+import os
+from array import array
+
+import numpy as np
+
+from columnar_store import STATUS_DECODE_ERROR, STATUS_INVALID, STATUS_OK
+from exchange_rates import day_of
+from scan_engine import data_folder, exceeds_thresholds, first_day
+from wallet_decoder import WalletDecodeError, WalletFormatError, get_decoder
+from wallet_store import store_change
+
+# Corpus-wide transaction table: every transaction of the wallet documents stored once, keyed by its
+# hash, with one link per tracked (stored) wallet it involves. A transaction between two abuse wallets
+# appears in both of their files; it is decoded the first time and only looked up afterwards.
+#
+#   tx_hash, tx_time              - one row per transaction; tx_hash is uint8 [N, 32], the raw bytes of
+#                                   the hash, all zero when the transaction has none
+#   link_offset                   - the links of transaction i are link_offset[i]:link_offset[i + 1]
+#   link_wallet                   - id of the involved wallet (index into wallets.json)
+#   link_outputs, link_received   - number and satoshi sum of the outputs paying the wallet
+#   link_inputs, link_sent        - number and satoshi sum of the inputs spent by the wallet
+#   wallet_status, wallet_n_tx, wallet_total_received - header of each wallet, for the threshold checks
+transactions_folder = os.path.join(data_folder, 'transactions')
+
+link_columns = ('link_wallet', 'link_outputs', 'link_received', 'link_inputs', 'link_sent')
+
+
+hash_size = 32
+no_hash = bytes(hash_size)
+
+
+# 32-byte key of a transaction hash, or None when the transaction cannot be deduplicated
+def hash_key(tx_hash):
+    if not tx_hash:
+        return None
+    try:
+        key = bytes.fromhex(tx_hash)
+    except ValueError:
+        return None
+    return key if len(key) == hash_size else None
+
+
+# Build the transaction table of every wallet document of `store` (see wallet_store.py) into `output`
+def ingest(store, output=transactions_folder):
+    # Taken first: a wallet file changed while reading makes the copy stale, not wrongly fresh
+    state = store.state()
+    entries = list(store.entries())
+    wallets = sorted(wallet for wallet, _, _, _ in entries)
+    wallet_ids = {wallet: wallet_id for wallet_id, wallet in enumerate(wallets)}
+
+    tx_ids = {}
+    tx_hashes = bytearray()
+    tx_times = array('q')
+    link_offsets = array('q')
+    links = {column: array('q') for column in link_columns}
+    wallet_data = {'status': array('q'), 'n_tx': array('q'), 'total_received': array('q')}
+    seen_txs = 0
+
+    for wallet_id, wallet in enumerate(wallets):
+        try:
+            with store.open_wallet(wallet) as wf:
+                document = get_decoder().decode(wf.read())
+        except WalletDecodeError:
+            print(f"Error: Could not decode JSON for wallet {wallet}. Skipping...")
+            _append_wallet(wallet_data, STATUS_DECODE_ERROR)
+            continue
+        except WalletFormatError:
+            print(f"Warning: Unexpected format in JSON for wallet {wallet}. Skipping...")
+            _append_wallet(wallet_data, STATUS_INVALID)
+            continue
+
+        _append_wallet(wallet_data, STATUS_OK, document.n_tx, document.total_received)
+
+        for tx in document.txs:
+            if not tx.time:
+                continue
+            seen_txs += 1
+            key = hash_key(tx.hash)
+            if key is not None:
+                if key in tx_ids:
+                    continue
+                tx_ids[key] = len(tx_times)
+
+            tx_hashes += key or no_hash
+            tx_times.append(tx.time)
+            link_offsets.append(len(links['link_wallet']))
+            _append_links(links, tx, wallet_ids)
+
+        if (wallet_id + 1) % 500 == 0:
+            print(f"Read {wallet_id + 1}/{len(wallets)} wallets...")
+
+    link_offsets.append(len(links['link_wallet']))
+
+    os.makedirs(output, exist_ok=True)
+    # Fixed-width uint8 rows rather than an 'S32' array, which would drop trailing zero bytes on read
+    np.save(os.path.join(output, 'tx_hash.npy'), np.frombuffer(bytes(tx_hashes), dtype=np.uint8).reshape(-1, hash_size))
+    np.save(os.path.join(output, 'tx_time.npy'), np.frombuffer(tx_times, dtype=np.int64))
+    np.save(os.path.join(output, 'link_offset.npy'), np.frombuffer(link_offsets, dtype=np.int64))
+    np.save(os.path.join(output, 'link_wallet.npy'), np.frombuffer(links['link_wallet'], dtype=np.int64).astype(np.int32))
+    for column in ('link_outputs', 'link_inputs'):
+        np.save(os.path.join(output, f'{column}.npy'), np.frombuffer(links[column], dtype=np.int64).astype(np.int32))
+    for column in ('link_received', 'link_sent'):
+        np.save(os.path.join(output, f'{column}.npy'), np.frombuffer(links[column], dtype=np.int64))
+    np.save(os.path.join(output, 'wallet_status.npy'), np.frombuffer(wallet_data['status'], dtype=np.int64).astype(np.int8))
+    for column in ('n_tx', 'total_received'):
+        np.save(os.path.join(output, f'wallet_{column}.npy'), np.frombuffer(wallet_data[column], dtype=np.int64))
+
+    with open(os.path.join(output, 'wallets.json'), 'w') as f:
+        json.dump(wallets, f)
+    with open(os.path.join(output, 'meta.json'), 'w') as f:
+        json.dump({'source': os.path.abspath(store.folder), 'store': state, 'wallets': len(wallets),
+                   'transactions': len(tx_times), 'links': len(links['link_wallet'])}, f, indent=4)
+
+    print(f"Stored {len(tx_times)} unique transactions of {seen_txs} in the wallet files "
+          f"({len(links['link_wallet'])} wallet links) into {output}")
+
+
+def _append_wallet(columns, status, n_tx=0, total_received=0):
+    columns['status'].append(status)
+    columns['n_tx'].append(n_tx)
+    columns['total_received'].append(total_received)
+
+
+# One link per tracked wallet among the outputs and spent inputs of `tx`, in order of first appearance
+def _append_links(links, tx, wallet_ids):
+    involved = {}
+    for output_tx in tx.out:
+        if output_tx.addr in wallet_ids:
+            link = involved.setdefault(output_tx.addr, [0, 0, 0, 0])
+            link[0] += 1
+            link[1] += output_tx.value
+    for input_tx in tx.inputs:
+        prev_out = input_tx.prev_out
+        if prev_out is not None and prev_out.addr in wallet_ids:
+            link = involved.setdefault(prev_out.addr, [0, 0, 0, 0])
+            link[2] += 1
+            link[3] += prev_out.value
+
+    for wallet, (outputs, received, inputs, sent) in involved.items():
+        links['link_wallet'].append(wallet_ids[wallet])
+        links['link_outputs'].append(outputs)
+        links['link_received'].append(received)
+        links['link_inputs'].append(inputs)
+        links['link_sent'].append(sent)
+
+
+# Whether the table at `path` exists and still matches the wallet `store` the caller reads (see
+# scan_engine.default_store): the shard mtimes recorded at ingest are compared with the current ones,
+# one stat per shard (see wallet_store.store_change). A stale table is reported and treated as missing,
+# so it is never mixed with a fresh scan.
+def exists(store, path=transactions_folder):
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return False
+    with open(os.path.join(path, 'meta.json')) as f:
+        reason = store_change(json.load(f).get('store'), store)
+    if reason is not None:
+        print(f"Warning: the transaction table in {path} {reason}; ignoring it "
+              f"(re-run `python src/cryptoabuse.py transactions`)")
+        return False
+    return True
+
+
+# Read-only view of an ingested transaction table; columns are memory-mapped NumPy arrays
+class TransactionTable:
+    def __init__(self, path=transactions_folder):
+        self.path = path
+        self._open()
+
+    def _open(self):
+        def load(name):
+            return np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+
+        with open(os.path.join(self.path, 'wallets.json')) as f:
+            self.wallets = json.load(f)
+        self.wallet_ids = {wallet: wallet_id for wallet_id, wallet in enumerate(self.wallets)}
+
+        self.tx_hash = load('tx_hash')
+        self.tx_time = load('tx_time')
+        self.link_offset = load('link_offset')
+        for column in link_columns:
+            setattr(self, column, load(column))
+
+        self.wallet_status = load('wallet_status')
+        self.wallet_n_tx = load('wallet_n_tx')
+        self.wallet_total_received = load('wallet_total_received')
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._open()
+
+    # Hex hash of transaction `tx`, None when it has none
+    def hash_of(self, tx):
+        key = self.tx_hash[tx].tobytes()
+        return None if key == no_hash else key.hex()
+
+    # Transaction index of every link
+    def link_tx(self):
+        return np.repeat(np.arange(len(self.tx_time)), np.diff(self.link_offset))
+
+    # Mask over the wallet ids of the wallets among `wallets` that the scans include:
+    # decodable and not over the thresholds
+    def included_wallets(self, wallets):
+        mask = np.zeros(len(self.wallets), dtype=bool)
+        for wallet in wallets:
+            wallet_id = self.wallet_ids.get(wallet)
+            if wallet_id is not None and self.wallet_status[wallet_id] == STATUS_OK and not exceeds_thresholds(
+                    int(self.wallet_total_received[wallet_id]), int(self.wallet_n_tx[wallet_id])):
+                mask[wallet_id] = True
+        return mask
+
+    # {year: number of distinct transactions} with an input or output of at least one included
+    # wallet of `wallets`, from 2012 on; a transaction between several of them is counted once
+    def unique_transactions_per_year(self, wallets):
+        links = self.included_wallets(wallets)[self.link_wallet] & ((self.link_outputs > 0) | (self.link_inputs > 0))
+        txs = np.unique(self.link_tx()[links])
+        days = day_of(self.tx_time[txs])
+        days = days[days >= first_day]
+        years = days.astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970
+        unique_years, counts = np.unique(years, return_counts=True)
+        return dict(zip(unique_years.tolist(), counts.tolist()))
@@ -0,0 +1,150 @@
+import json
+import os
+import sqlite3
+
+from columnar_store import STATUS_DECODE_ERROR, STATUS_INVALID, STATUS_OK
+from scan_engine import data_folder, n_tx_threshold, total_received_threshold
+from wallet_decoder import WalletDecodeError, WalletFormatError, get_decoder
+from wallet_store import changed_shards
+
+# SQLite catalog of the wallet files: what exists, whether it parses and its header fields,
+# so existence and threshold checks are indexed queries instead of opening every file
+catalog_path = os.path.join(data_folder, 'wallet_catalog.sqlite')
+
+schema = '''
+CREATE TABLE IF NOT EXISTS wallets (
+    wallet TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    status INTEGER NOT NULL,
+    n_tx INTEGER,
+    total_received INTEGER,
+    total_sent INTEGER,
+    min_time INTEGER,
+    max_time INTEGER
+);
+CREATE INDEX IF NOT EXISTS wallets_total_received ON wallets (total_received);
+CREATE INDEX IF NOT EXISTS wallets_n_tx ON wallets (n_tx);
+CREATE INDEX IF NOT EXISTS wallets_status ON wallets (status);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+'''
+
+
+def exists(path=catalog_path):
+    return os.path.exists(path)
+
+
+# Header fields and tx time range of one wallet, as a catalog row (without wallet/path/size/mtime)
+def describe_wallet(store, wallet):
+    try:
+        with store.open_wallet(wallet) as wf:
+            document = get_decoder().decode(wf.read())
+    except WalletDecodeError:
+        return STATUS_DECODE_ERROR, None, None, None, None, None
+    except WalletFormatError:
+        return STATUS_INVALID, None, None, None, None, None
+
+    times = [tx.time for tx in document.txs if tx.time]
+    return (STATUS_OK, document.n_tx, document.total_received, document.total_sent,
+            min(times) if times else None, max(times) if times else None)
+
+
+# Bring the catalog at `path` up to date with `store` (see wallet_store.py): only new wallets and
+# wallets whose size or mtime changed are parsed again, and rows of deleted wallets are dropped.
+# With `shards`, only the wallets of those shards are listed again.
+def refresh(store, path=catalog_path, shards=None):
+    catalog = WalletCatalog(path)
+    # Taken first: a wallet file changed while refreshing makes the catalog stale, not wrongly fresh
+    state = store.state()
+    known = {wallet: (size, mtime_ns) for wallet, size, mtime_ns in
+             catalog.connection.execute('SELECT wallet, size, mtime_ns FROM wallets')
+             if shards is None or store.sharding.shard(wallet) in shards}
+
+    seen = set()
+    updated = 0
+    with catalog.connection:
+        for wallet, location, size, mtime_ns in store.entries(shards):
+            seen.add(wallet)
+            if known.get(wallet) == (size, mtime_ns):
+                continue
+
+            catalog.connection.execute('INSERT OR REPLACE INTO wallets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                       (wallet, location, size, mtime_ns) + describe_wallet(store, wallet))
+            updated += 1
+            if updated % 500 == 0:
+                print(f"Catalogued {updated} new or changed wallets...")
+
+        removed = [(wallet,) for wallet in known if wallet not in seen]
+        catalog.connection.executemany('DELETE FROM wallets WHERE wallet = ?', removed)
+        catalog.connection.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('store', json.dumps(state)))
+
+    print(f"Catalog {path}: {len(seen)} wallets{'' if shards is None else f' in {len(shards)} changed shards'}, "
+          f"{updated} new or changed, {len(removed)} removed")
+    return catalog
+
+
+# The catalog at `path`, refreshed first only when `store` changed since its last refresh: checking
+# costs one stat per shard (see wallet_store.store_change), and only the changed shards are listed again
+def current(store, path=catalog_path):
+    catalog = WalletCatalog(path)
+    recorded = catalog.store_state()
+    state = store.state()
+    if recorded is None or recorded['sharding'] != state['sharding'] or state['sharding'] != store.sharding.spec:
+        return refresh(store, path)
+    shards = changed_shards(recorded, state)
+    if shards:
+        return refresh(store, path, set(shards))
+    return catalog
+
+
+class WalletCatalog:
+    def __init__(self, path=catalog_path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(schema)
+
+    # Only the path travels to worker processes
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    # State of the store at the last refresh (see wallet_store.store_change), None before the first one
+    def store_state(self):
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', ('store',)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def has_wallet(self, wallet):
+        return self.connection.execute('SELECT 1 FROM wallets WHERE wallet = ?', (wallet,)).fetchone() is not None
+
+    def wallet(self, wallet):
+        cursor = self.connection.execute('SELECT * FROM wallets WHERE wallet = ?', (wallet,))
+        row = cursor.fetchone()
+        return None if row is None else dict(zip((column[0] for column in cursor.description), row))
+
+    # (wallet, total_received, n_tx) of the parsed wallets above either threshold
+    def exceeding_thresholds(self, total_received_limit=total_received_threshold, n_tx_limit=n_tx_threshold):
+        return self.connection.execute(
+            'SELECT wallet, total_received, n_tx FROM wallets WHERE status = ? AND (total_received > ? OR n_tx > ?) ORDER BY wallet',
+            (STATUS_OK, total_received_limit, n_tx_limit)).fetchall()
+
+    def wallets_with_status(self, status):
+        return [wallet for wallet, in self.connection.execute('SELECT wallet FROM wallets WHERE status = ? ORDER BY wallet', (status,))]
+
+    # The subset of `wallets` the figures include: the file exists, parses as a wallet
+    # document and, with `thresholds`, is within the thresholds
+    def included(self, wallets, total_received_limit=total_received_threshold, n_tx_limit=n_tx_threshold,
+                 thresholds=True):
+        query = 'SELECT w.wallet FROM wanted JOIN wallets w ON w.wallet = wanted.wallet WHERE w.status = ?'
+        parameters = (STATUS_OK,)
+        if thresholds:
+            query += ' AND w.total_received <= ? AND w.n_tx <= ?'
+            parameters += (total_received_limit, n_tx_limit)
+
+        with self.connection:
+            self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS wanted (wallet TEXT PRIMARY KEY)')
+            self.connection.execute('DELETE FROM wanted')
+            self.connection.executemany('INSERT OR IGNORE INTO wanted VALUES (?)', ((wallet,) for wallet in wallets))
+            return {wallet for wallet, in self.connection.execute(query, parameters)}
@@ -0,0 +1,181 @@
+import json
+import os
+from typing import List, Optional, Union
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Pluggable decoding of wallet documents into records holding only the fields the figures use:
+#   WalletDocument(n_tx, total_received, total_sent, txs)
+#   Tx(time, inputs, out, hash), Input(prev_out), Output(addr, value)
+# Backends: 'json' (stdlib, the default), and 'orjson' / 'msgspec' when installed.
+# The CRYPTOABUSE_DECODER environment variable selects the backend of every loader.
+default_backend = os.environ.get('CRYPTOABUSE_DECODER', 'json')
+
+
+# The document is not valid JSON
+class WalletDecodeError(ValueError):
+    pass
+
+
+# The document is valid JSON but not a wallet document
+class WalletFormatError(ValueError):
+    pass
+
+
+if msgspec is not None:
+    # Typed, slotted records that msgspec decodes into directly, skipping every other field
+    class Output(msgspec.Struct):
+        addr: Optional[str] = None
+        value: int = 0
+
+    class Input(msgspec.Struct):
+        prev_out: Optional[Output] = None
+
+    class Tx(msgspec.Struct):
+        time: Optional[int] = None
+        inputs: List[Input] = []
+        out: List[Output] = []
+        hash: Optional[str] = None
+
+    class WalletDocument(msgspec.Struct):
+        n_tx: int = 0
+        total_received: int = 0
+        total_sent: int = 0
+        txs: List[Tx] = []
+else:
+    class Output:
+        __slots__ = ('addr', 'value')
+
+        def __init__(self, addr=None, value=0):
+            self.addr = addr
+            self.value = value
+
+    class Input:
+        __slots__ = ('prev_out',)
+
+        def __init__(self, prev_out=None):
+            self.prev_out = prev_out
+
+    class Tx:
+        __slots__ = ('time', 'inputs', 'out', 'hash')
+
+        def __init__(self, time=None, inputs=(), out=(), hash=None):
+            self.time = time
+            self.inputs = inputs
+            self.out = out
+            self.hash = hash
+
+    class WalletDocument:
+        __slots__ = ('n_tx', 'total_received', 'total_sent', 'txs')
+
+        def __init__(self, n_tx=0, total_received=0, total_sent=0, txs=()):
+            self.n_tx = n_tx
+            self.total_received = total_received
+            self.total_sent = total_sent
+            self.txs = txs
+
+
+# Conversions from the dicts produced by the stdlib/orjson parsers (and by wallet_stream)
+
+def output_from_dict(output):
+    return Output(output.get('addr'), output.get('value', 0))
+
+
+def tx_from_dict(tx):
+    inputs = []
+    for input_tx in tx.get('inputs', []):
+        prev_out = input_tx.get('prev_out')
+        inputs.append(Input(output_from_dict(prev_out) if prev_out else None))
+    return Tx(tx.get('time'), inputs, [output_from_dict(output) for output in tx.get('out', [])], tx.get('hash'))
+
+
+# Some files wrap the wallet document in a list: use its first element (an empty list is an empty wallet)
+def unwrap(data):
+    if isinstance(data, list):
+        data = data[0] if data else {}
+    if not isinstance(data, dict):
+        raise WalletFormatError(f"Expected a wallet object, got {type(data).__name__}")
+    return data
+
+
+def document_from_dict(data):
+    data = unwrap(data)
+    return WalletDocument(data.get('n_tx', 0), data.get('total_received', 0), data.get('total_sent', 0),
+                          [tx_from_dict(tx) for tx in data.get('txs', [])])
+
+
+class StdlibDecoder:
+    name = 'json'
+
+    def decode(self, data):
+        try:
+            parsed = json.loads(data)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise WalletDecodeError(str(e)) from e
+        return document_from_dict(parsed)
+
+
+# The compiled backends are stricter than the stdlib (e.g. integers beyond 64 bits, unexpected
+# field types); documents they reject are decoded again by the stdlib so every backend accepts
+# exactly the same files.
+class OrjsonDecoder:
+    name = 'orjson'
+
+    def decode(self, data):
+        try:
+            parsed = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return StdlibDecoder().decode(data)
+        return document_from_dict(parsed)
+
+
+class MsgspecDecoder:
+    name = 'msgspec'
+
+    def __init__(self):
+        self._decoder = msgspec.json.Decoder(Union[WalletDocument, List[WalletDocument]])
+
+    def decode(self, data):
+        try:
+            document = self._decoder.decode(data)
+        except msgspec.DecodeError:
+            return StdlibDecoder().decode(data)
+        if isinstance(document, list):
+            document = document[0] if document else WalletDocument()
+        return document
+
+
+backends = {'json': StdlibDecoder, 'orjson': OrjsonDecoder, 'msgspec': MsgspecDecoder}
+
+
+def available_backends():
+    return ['json'] + [name for name, module in (('orjson', orjson), ('msgspec', msgspec)) if module is not None]
+
+
+_decoders = {}
+
+
+# Decoder of backend `name` (default: CRYPTOABUSE_DECODER or the stdlib), created once per process
+def get_decoder(name=None):
+    name = name or default_backend
+    if name not in _decoders:
+        if name not in backends:
+            raise ValueError(f"Unknown decoder backend: {name}")
+        if name not in available_backends():
+            raise ValueError(f"Decoder backend {name} is not installed")
+        _decoders[name] = backends[name]()
+    return _decoders[name]
+
+
+# Read and decode a wallet file; raises WalletDecodeError / WalletFormatError
+def load_wallet(path, decoder=None):
+    with open(path, 'rb') as wf:
+        return get_decoder(decoder).decode(wf.read())
@@ -0,0 +1,41 @@
+import json
+
+# blockchain.info address documents put the summary fields before the (potentially huge) txs array:
+#   {"hash160": ..., "address": ..., "n_tx": ..., "total_received": ..., "total_sent": ..., ..., "txs": [...]}
+# so the header can be parsed from a prefix of the file without materializing any transaction.
+header_block_size = 64 * 1024
+txs_key = b'"txs"'
+
+
+# Parse the header fields of a wallet document from `prefix` (the first bytes of the file).
+# Returns None when the prefix does not end in a recognizable header (e.g. list-wrapped documents,
+# or "txs" not being the first large field); callers then fall back to a full parse.
+def parse_header(prefix):
+    start = prefix.lstrip()
+    if not start.startswith(b'{'):
+        return None
+
+    end = prefix.find(txs_key)
+    if end < 0:
+        return None
+
+    head = prefix[:end].rstrip()
+    if head.endswith(b','):
+        head = head[:-1]
+    try:
+        header = json.loads(head + b'}')
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    return header if isinstance(header, dict) else None
+
+
+# Read the first block of an open binary wallet file and parse its header.
+# Returns (header or None, bytes read so far) so the caller can continue with a full parse.
+def read_header(wf, block_size=header_block_size):
+    prefix = wf.read(block_size)
+    return parse_header(prefix), prefix
+
+
+def read_header_file(path):
+    with open(path, 'rb') as wf:
+        return read_header(wf)[0]
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import shutil
+from collections import Counter, defaultdict
+
+# Storage layouts of the wallet documents:
+#   DirectoryStore            - one <folder>/<shard>/<wallet>.json file per wallet
+#   shard_archive.PackedStore - one compressed <folder>/<shard>.shard archive per shard (cryptoabuse.py pack)
+# Both expose has_wallet / size / open_wallet / fingerprint / entries, so every loader reads either.
+#
+# The shard of a wallet comes from the sharding function recorded in <folder>/layout.json:
+#   prefix:N - the first N characters of the address (the fetched data/bitcoin/ tree uses prefix:3)
+#   hash:N   - a stable hash of the address into N evenly filled buckets
+# Folders without layout.json are the fetched tree: a directory layout sharded by prefix:3.
+#
+# listing(wallets) returns the stored wallets among `wallets` in the order they are best read in,
+# which lets scans skip per-wallet existence probes.
+layout_file = 'layout.json'
+default_sharding = 'prefix:3'
+
+
+class PrefixSharding:
+    def __init__(self, length):
+        self.length = length
+        self.spec = f'prefix:{length}'
+
+    def shard(self, wallet):
+        return wallet[:self.length]
+
+
+class HashSharding:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.spec = f'hash:{buckets}'
+        self.width = len(f'{buckets - 1:x}')
+
+    # blake2b rather than hash(): the bucket must not depend on the process
+    def shard(self, wallet):
+        digest = hashlib.blake2b(wallet.encode(), digest_size=8).digest()
+        return f'{int.from_bytes(digest, "big") % self.buckets:0{self.width}x}'
+
+
+def parse_sharding(spec):
+    kind, _, size = spec.partition(':')
+    if kind == 'prefix' and size.isdigit() and int(size) > 0:
+        return PrefixSharding(int(size))
+    if kind == 'hash' and size.isdigit() and int(size) > 0:
+        return HashSharding(int(size))
+    raise ValueError(f"Unknown sharding {spec!r}: expected prefix:N or hash:N")
+
+
+# {'layout': 'directory' | 'packed', 'sharding': spec, ...} of a store folder
+def read_layout(folder):
+    layout = {'layout': 'directory', 'sharding': default_sharding}
+    path = os.path.join(folder, layout_file)
+    if os.path.exists(path):
+        with open(path) as f:
+            layout.update(json.load(f))
+    return layout
+
+
+def write_layout(folder, layout, sharding, **extra):
+    with open(os.path.join(folder, layout_file), 'w') as f:
+        json.dump(dict({'layout': layout, 'sharding': sharding}, **extra), f, indent=4)
+
+
+class DirectoryStore:
+    def __init__(self, folder, sharding=None):
+        self.folder = folder
+        self.sharding = parse_sharding(sharding or read_layout(folder)['sharding'])
+
+    # Path resolver of the layout
+    def path(self, wallet):
+        return os.path.join(self.folder, self.sharding.shard(wallet), f'{wallet}.json')
+
+    def has_wallet(self, wallet):
+        return os.path.exists(self.path(wallet))
+
+    # Size of the wallet document in bytes
+    def size(self, wallet):
+        return os.path.getsize(self.path(wallet))
+
+    # Binary file object over the wallet document
+    def open_wallet(self, wallet):
+        return open(self.path(wallet), 'rb')
+
+    # What identifies the current content of the wallet for incremental scans: file size and mtime
+    def fingerprint(self, wallet):
+        try:
+            stat = os.stat(self.path(wallet))
+        except FileNotFoundError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns]
+
+    # Each shard directory holding wanted wallets is listed once; its wanted files are
+    # returned in inode order, which is mostly sequential on disk
+    def listing(self, wallets):
+        wanted_by_shard = defaultdict(set)
+        for wallet in wallets:
+            wanted_by_shard[self.sharding.shard(wallet)].add(wallet)
+
+        listed = []
+        for shard in sorted(wanted_by_shard):
+            wanted = wanted_by_shard[shard]
+            try:
+                with os.scandir(os.path.join(self.folder, shard)) as entries:
+                    found = [(entry.inode(), entry.name[:-len('.json')]) for entry in entries
+                             if entry.name.endswith('.json') and entry.name[:-len('.json')] in wanted]
+            except FileNotFoundError:
+                continue
+            listed.extend(wallet for _, wallet in sorted(found))
+        return listed
+
+    # {'sharding': spec, 'shards': {shard: mtime_ns of its directory}}, which copies derived from the
+    # store record to tell cheaply whether it changed since (see store_change)
+    def state(self):
+        with os.scandir(self.folder) as shards:
+            return {'sharding': self.sharding.spec,
+                    'shards': {entry.name: entry.stat().st_mtime_ns for entry in shards if entry.is_dir()}}
+
+    # Yield (wallet, location, size, mtime_ns) for every stored wallet, one shard directory at a time,
+    # or only for the wallets of `shards`
+    def entries(self, shards=None):
+        if shards is None:
+            with os.scandir(self.folder) as entries:
+                shards = [entry.name for entry in entries if entry.is_dir()]
+        for shard in sorted(shards):
+            shard_folder = os.path.join(self.folder, shard)
+            if not os.path.isdir(shard_folder):
+                continue
+            with os.scandir(shard_folder) as entries:
+                for entry in sorted(entries, key=lambda entry: entry.name):
+                    if entry.name.endswith('.json') and entry.is_file():
+                        stat = entry.stat()
+                        yield entry.name[:-len('.json')], entry.path, stat.st_size, stat.st_mtime_ns
+
+
+# The store of `folder`, whichever layout it has
+def open_store(folder):
+    import shard_archive
+    if read_layout(folder)['layout'] == 'packed':
+        return shard_archive.PackedStore(folder)
+    return DirectoryStore(folder)
+
+
+# Why `store` no longer matches the state `recorded` from its state() when a copy was built from it,
+# None when it still does. One stat per shard: wallet files added, deleted or renamed into place change
+# the mtime of their shard directory, whatever their own mtimes. A file rewritten in place does not,
+# so fetchers should write to a temporary name and rename it (rebuilding the copy catches the rest).
+def store_change(recorded, store):
+    if not recorded or 'shards' not in recorded:
+        return "was built by an older version"
+    current = store.state()
+    if current['sharding'] != recorded['sharding']:
+        return f"was built from a store sharded by {recorded['sharding']}, not {current['sharding']}"
+    changed = changed_shards(recorded, current)
+    if changed:
+        return (f"is older than {len(changed)} shard{'s' if len(changed) > 1 else ''} of {store.folder} "
+                f"({', '.join(changed[:3])}{', ...' if len(changed) > 3 else ''})")
+    return None
+
+
+# Shards added, removed or changed between two states of a store
+def changed_shards(recorded, current):
+    before = recorded['shards']
+    after = current['shards']
+    return sorted(shard for shard in before.keys() | after.keys() if before.get(shard) != after.get(shard))
+
+
+# Number of wallets per shard of `store` under `sharding` (a sharding object)
+def shard_sizes(store, sharding):
+    return Counter(sharding.shard(wallet) for wallet, _, _, _ in store.entries())
+
+
+def print_shard_balance(sizes):
+    if not sizes:
+        print("No wallets")
+        return
+    counts = sorted(sizes.values())
+    print(f"{len(counts)} shards, wallets per shard: min {counts[0]}, median {counts[len(counts) // 2]}, "
+          f"max {counts[-1]}, largest shard holds {100 * counts[-1] / sum(counts):.1f}% of {sum(counts)} wallets")
+
+
+# Copy every wallet of the store in `folder` into a new store in `output`,
+# with layout 'directory' or 'packed' and the given sharding spec
+def migrate(folder, output, layout='directory', sharding=default_sharding):
+    import shard_archive
+    target_sharding = parse_sharding(sharding)
+    if layout == 'packed':
+        shard_archive.pack(folder, output, sharding=sharding)
+        print_shard_balance(shard_sizes(open_store(output), target_sharding))
+        return
+    if layout != 'directory':
+        raise ValueError(f"Unknown layout {layout!r}")
+
+    source = open_store(folder)
+    os.makedirs(output, exist_ok=True)
+    write_layout(output, 'directory', target_sharding.spec)
+    target = DirectoryStore(output)
+
+    copied = 0
+    for wallet, _, _, _ in source.entries():
+        path = target.path(wallet)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with source.open_wallet(wallet) as wf, open(path, 'wb') as f:
+            shutil.copyfileobj(wf, f)
+        copied += 1
+        if copied % 10_000 == 0:
+            print(f"Copied {copied} wallets...")
+
+    print(f"Migrated {copied} wallets from {folder} to {output} ({target_sharding.spec})")
+    print_shard_balance(shard_sizes(target, target_sharding))
@@ -0,0 +1,103 @@
+import codecs
+import json
+
+from wallet_header import header_block_size, parse_header, txs_key
+
+# Incremental parsing of a wallet document: the header is parsed from the first block and the
+# txs array is decoded one transaction at a time, so memory stays bounded by the largest
+# transaction instead of growing with the wallet.
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+
+
+# Raised while iterating the transactions of a document that turns out not to be valid JSON
+class WalletStreamError(ValueError):
+    pass
+
+
+# Start streaming an open binary wallet file.
+# Returns (header, iterator over the tx dicts), or (None, bytes read so far) when the document
+# does not start with a recognizable header, in which case the caller falls back to a full parse.
+def stream_wallet(wf, block_size=header_block_size):
+    prefix = wf.read(block_size)
+    header = parse_header(prefix)
+    if header is None:
+        return None, prefix
+
+    # Position right after the '[' that opens the txs array
+    start = prefix.find(txs_key) + len(txs_key)
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    try:
+        text = utf8.decode(prefix[start:])
+    except UnicodeDecodeError:
+        return None, prefix
+    rest = text.lstrip(_whitespace)
+    if not rest.startswith(':') or not rest[1:].lstrip(_whitespace).startswith('['):
+        return None, prefix
+    rest = rest[1:].lstrip(_whitespace)[1:]
+
+    return header, _iter_txs(wf, rest, utf8, block_size)
+
+
+def _iter_txs(wf, text, utf8, block_size):
+    pos = 0
+    eof = False
+    expect_value = True  # after '[' or ','
+    first = True
+
+    # Append at least one more block (and at least as much as is buffered, so a large
+    # transaction is re-scanned a logarithmic number of times)
+    def read_more():
+        data = wf.read(max(block_size, len(text) - pos))
+        try:
+            return text + utf8.decode(data, final=not data), not data
+        except UnicodeDecodeError as e:
+            raise WalletStreamError(str(e)) from e
+
+    while True:
+        while pos < len(text) and text[pos] in _whitespace:
+            pos += 1
+        if pos == len(text):
+            if eof:
+                raise WalletStreamError("Unterminated txs array")
+            text, eof = read_more()
+            continue
+
+        if text[pos] == ']' and (first or not expect_value):
+            _check_tail(wf, text[pos + 1:], utf8)
+            return
+
+        if not expect_value:
+            if text[pos] != ',':
+                raise WalletStreamError(f"Expected ',' or ']' in txs array, got {text[pos]!r}")
+            pos += 1
+            expect_value = True
+            continue
+
+        try:
+            tx, end = _decoder.raw_decode(text, pos)
+        except json.JSONDecodeError as e:
+            if eof:
+                raise WalletStreamError(str(e)) from e
+            text, eof = read_more()
+            continue
+
+        yield tx
+        pos = end
+        expect_value = False
+        first = False
+
+        # Drop what has been consumed so the buffer does not grow with the wallet
+        if pos > block_size:
+            text = text[pos:]
+            pos = 0
+
+
+# Validate whatever follows the txs array, so truncated files are still reported as undecodable
+def _check_tail(wf, tail, utf8):
+    try:
+        tail += utf8.decode(wf.read(), final=True)
+        json.loads('{"txs": []' + tail)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise WalletStreamError(str(e)) from e
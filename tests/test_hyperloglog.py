@@ -0,0 +1,48 @@
+import math
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from hyperloglog import HyperLogLog, alpha
+
+
+def test_alpha_uses_the_small_register_constants():
+    assert alpha(16) == 0.673
+    assert alpha(32) == 0.697
+    assert alpha(64) == 0.709
+    assert alpha(128) == pytest.approx(0.7213 / (1 + 1.079 / 128))
+
+
+# Beyond the linear counting range, at low precisions too: the mean relative error over many sketches
+# is within three standard errors of that mean (no bias) and their spread matches 1.04 / sqrt(m)
+@pytest.mark.parametrize('precision', [4, 5, 6])
+def test_low_precision_relative_error(precision):
+    items = 40 << precision  # well above 2.5 m, where the raw estimator is used
+    trials = 200
+    errors = []
+    for trial in range(trials):
+        sketch = HyperLogLog(precision)
+        for i in range(items):
+            sketch.add(f'{trial}:{i}')
+        errors.append(sketch.count() / items - 1)
+    mean_error = sum(errors) / trials
+    rms_error = math.sqrt(sum(error * error for error in errors) / trials)
+    assert abs(mean_error) < 3 * sketch.relative_error / math.sqrt(trials)
+    assert rms_error < 1.25 * sketch.relative_error
+
+
+# Merging loses nothing: the union of two sketches, sparse or dense, is the sketch of the union
+@pytest.mark.parametrize('items', [100, 30_000])
+def test_merged_sketches_count_the_union(items):
+    left, right, union = HyperLogLog(12), HyperLogLog(12), HyperLogLog(12)
+    for i in range(items):
+        wallet = f'wallet-{i}'
+        (left if i % 3 else right).add(wallet)
+        if i % 10 == 0:
+            right.add(wallet)
+        union.add(wallet)
+    left |= right
+    assert len(left) == len(union)
+    assert abs(len(union) - items) <= 3 * union.relative_error * items
@@ -0,0 +1,177 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# Every loader resolves its paths from CRYPTOABUSE_DATA when scan_engine is first imported: point them
+# at a synthetic corpus generated below, so the tests never touch data/
+data_folder = tempfile.mkdtemp(prefix='cryptoabuse-test-')
+os.environ['CRYPTOABUSE_DATA'] = data_folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import columnar_store
+import daily_cube
+import partitioned_scan
+import scan_cache
+import scan_engine
+import shard_archive
+import synthetic_corpus
+from aggregators import AnnualCrime, figure_aggregators
+from render import digest
+from scan_engine import JsonWalletSource, ScanEngine, WalletScanner
+from wallet_store import DirectoryStore
+
+
+@pytest.fixture(scope='module', autouse=True)
+def corpus():
+    assert scan_engine.data_folder == data_folder, "scan_engine was imported before CRYPTOABUSE_DATA was set"
+    options = synthetic_corpus.CorpusOptions(wallets=150, seed=7, multi_category=0.2, whales=0.03, corrupt=0.03,
+                                             missing=0.03, max_tx=120, whale_txs=40)
+    synthetic_corpus.generate(data_folder, options)
+    # Drop a third of the exchange rates, so some transactions have no rate
+    with open(scan_engine.exchange_rates_path) as f:
+        rates = json.load(f)
+    with open(scan_engine.exchange_rates_path, 'w') as f:
+        json.dump({day: rate for i, (day, rate) in enumerate(sorted(rates.items())) if i % 3}, f)
+    yield
+    shutil.rmtree(data_folder)
+
+
+def scan(workers=1, **options):
+    engine = ScanEngine(chunk_size=16, **options)
+    for aggregator_class in figure_aggregators:
+        engine.register(aggregator_class())
+    engine.run(workers)
+    return engine
+
+
+def digests(aggregators):
+    return {aggregator.name: digest(aggregator) for aggregator in aggregators}
+
+
+@pytest.fixture(scope='module')
+def serial():
+    return scan()
+
+
+def test_the_corpus_has_days_without_rates(serial):
+    assert serial.missing_rate_days
+    assert serial.stats.counters['decode_errors'] and serial.stats.counters['wallets_over_thresholds']
+
+
+def test_workers(serial):
+    assert digests(scan(workers=3).aggregators) == digests(serial.aggregators)
+
+
+def test_streaming(serial):
+    engine = scan(source=JsonWalletSource(DirectoryStore(scan_engine.wallets_folder), stream_threshold=0))
+    assert digests(engine.aggregators) == digests(serial.aggregators)
+    assert engine.stats.counters['decode_errors'] == serial.stats.counters['decode_errors']
+    assert engine.stats.counters['wallets_over_thresholds'] == serial.stats.counters['wallets_over_thresholds']
+
+
+def test_columnar(serial, tmp_path):
+    columnar_store.ingest(DirectoryStore(scan_engine.wallets_folder), str(tmp_path))
+    engine = scan(source=columnar_store.ColumnarWalletSource(columnar_store.ColumnarStore(str(tmp_path))))
+    assert digests(engine.aggregators) == digests(serial.aggregators)
+
+
+def test_packed(serial, tmp_path):
+    shard_archive.pack(scan_engine.wallets_folder, str(tmp_path))
+    engine = scan(source=JsonWalletSource(shard_archive.PackedStore(str(tmp_path))))
+    assert digests(engine.aggregators) == digests(serial.aggregators)
+
+
+# Interrupted after a few chunks, with a checkpoint after each of them, then resumed
+def test_checkpoint_resumed(serial, tmp_path, monkeypatch):
+    checkpoint_path = str(tmp_path / 'checkpoint.pickle')
+    scan_chunk = WalletScanner.scan_chunk
+    calls = []
+
+    def interrupted(scanner, chunk):
+        calls.append(chunk)
+        if len(calls) > 3:
+            raise KeyboardInterrupt
+        return scan_chunk(scanner, chunk)
+
+    monkeypatch.setattr(WalletScanner, 'scan_chunk', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        scan(checkpoint_path=checkpoint_path, checkpoint_interval=0)
+    monkeypatch.setattr(WalletScanner, 'scan_chunk', scan_chunk)
+
+    engine = ScanEngine(chunk_size=16, checkpoint_path=checkpoint_path, checkpoint_interval=0)
+    for aggregator_class in figure_aggregators:
+        engine.register(aggregator_class())
+    engine.run(resume=True)
+    assert digests(engine.aggregators) == digests(serial.aggregators)
+    assert engine.missing_rate_days == serial.missing_rate_days
+
+
+def test_partitioned(serial, tmp_path):
+    folder = str(tmp_path)
+    partitioned_scan.make_plan(folder, 3)
+    for partition in range(3):
+        partitioned_scan.map_partition(folder, partition)
+    aggregators = partitioned_scan.reduce_partitions(
+        [partitioned_scan.partition_path(folder, partition) for partition in range(3)], str(tmp_path / 'aggregates.pickle'))
+    assert digests(aggregators) == digests(serial.aggregators)
+
+
+# Wallets removed, then restored: after each incremental update the aggregates, their keys and the
+# reported days without rates are those of a full scan of the same files
+def test_incremental(tmp_path):
+    cache_path = str(tmp_path / 'cache.sqlite')
+
+    def update():
+        engine = ScanEngine(chunk_size=16)
+        for aggregator_class in figure_aggregators:
+            engine.register(aggregator_class())
+        scan_cache.update(engine, cache_path)
+        return engine
+
+    update()
+    store = DirectoryStore(scan_engine.wallets_folder)
+    removed = [(wallet, location) for wallet, location, _, _ in list(store.entries())[::5]]
+    for wallet, location in removed:
+        os.replace(location, str(tmp_path / f'{wallet}.json'))
+    try:
+        engine = update()
+        full = scan()
+        assert digests(engine.aggregators) == digests(full.aggregators)
+        assert engine.missing_rate_days == full.missing_rate_days
+    finally:
+        for wallet, location in removed:
+            os.replace(str(tmp_path / f'{wallet}.json'), location)
+
+    engine = update()
+    full = scan()
+    assert digests(engine.aggregators) == digests(full.aggregators)
+    assert engine.missing_rate_days == full.missing_rate_days
+
+
+# A key whose sum is zero stays as long as a wallet that added to it remains
+def test_subtract_keeps_zero_sums_of_remaining_wallets():
+    def partial(year, value):
+        aggregator = AnnualCrime()
+        aggregator.annual_received_eur_fixed[year] += value
+        aggregator._contributors.touch('annual_received_eur_fixed', year)
+        aggregator._contributors.finish_wallet()
+        return aggregator
+
+    total = AnnualCrime()
+    for wallet in (partial(2015, 0), partial(2015, 5), partial(2016, 7)):
+        total.merge(wallet)
+    total.subtract(partial(2015, 5))
+    assert dict(total.annual_received_eur_fixed) == {2015: 0, 2016: 7}
+    total.subtract(partial(2015, 0))
+    assert dict(total.annual_received_eur_fixed) == {2016: 7}
+
+
+def test_from_cube(serial, tmp_path):
+    daily_cube.build(str(tmp_path))
+    for aggregator in serial.aggregators:
+        if hasattr(aggregator, 'from_cube'):
+            cube = daily_cube.Cube.load(aggregator.universe, str(tmp_path))
+            assert digest(type(aggregator).from_cube(cube)) == digest(aggregator), aggregator.name